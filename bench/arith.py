@@ -0,0 +1,29 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Integer and float arithmetic in a while loop
+
+def arith(n):
+    a = 0
+    b = 1
+    x = 0.5
+    i = 0
+    while i < n:
+        a = (a + i * 3) % 1009
+        b = (b * 7 + a) // 3 % 10007
+        x = x * 0.5 + 0.25
+        i += 1
+    return a + b + (x > 0.4999)
+
+print(arith(2700000))
@@ -0,0 +1,28 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Lots of short-lived lists and strings, with a few kept around, to
+# keep the collector busy
+
+def churn(n):
+    keep = [[]] * 64
+    t = 0
+    for i in range(n):
+        l = [i, i + 1, i + 2]
+        s = "x" + chr(65 + i % 26) + "y"
+        keep[i % 64] = l + [s]
+        t += len(keep[(i * 7) % 64])
+    return t
+
+print(churn(540000))
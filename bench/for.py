@@ -0,0 +1,36 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# for loops over ranges, lists and strings
+
+def ranges(n):
+    t = 0
+    for i in range(n):
+        for j in range(0, 20, 3):
+            t = (t + i - j) % 100003
+    return t
+
+def items(n):
+    l = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3]
+    s = "abcdefghij"
+    t = 0
+    for i in range(n):
+        for v in l:
+            t += v
+        for c in s:
+            t += 1
+    return t
+
+print(ranges(360000))
+print(items(180000))
@@ -0,0 +1,33 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Recursive calls: towers of hanoi and fibonacci
+
+moves = 0
+
+def hanoi(n, src, dst, tmp):
+    global moves
+    if n > 0:
+        hanoi(n - 1, src, tmp, dst)
+        moves += 1
+        hanoi(n - 1, tmp, dst, src)
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+hanoi(20, 0, 2, 1)
+print(moves)
+print(fib(26))
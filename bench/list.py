@@ -0,0 +1,42 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Growing lists, slicing and indexing them
+
+def grow(n):
+    l = []
+    for i in range(n):
+        l += [i]
+    return l
+
+def slices(l, rounds):
+    t = 0
+    for r in range(rounds):
+        for i in range(0, len(l) - 10, 7):
+            s = l[i:i + 10]
+            t = (t + s[0] + s[9]) % 100003
+    return t
+
+def index(l, rounds):
+    t = 0
+    for r in range(rounds):
+        for i in range(len(l)):
+            l[i] = l[i] + 1
+        t += l[r]
+    return t
+
+l = grow(20000)
+print(len(l))
+print(slices(l, 90))
+print(index(l, 90))
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Time each workload under snek and python, several times over, and
+# report the CPU time each took as JSON. Given the report from an
+# earlier run as a baseline, exit with an error when any workload has
+# become slower under snek by more than the threshold, comparing the
+# fastest runs and allowing for the spread measured in both.
+#
+
+import sys
+import os
+import argparse
+import json
+import math
+import resource
+import statistics
+import subprocess
+
+
+class BenchError(Exception):
+    pass
+
+
+# Run 'file' under 'interp' once, returning its output and the CPU
+# seconds it used. snek carries on after a runtime error, so any error
+# output counts as a failure too
+def run_once(interp, file):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    proc = subprocess.run([interp, file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if proc.returncode != 0 or proc.stderr:
+        raise BenchError(
+            "%s %s failed: %s" % (interp, file, proc.stderr.decode(errors="replace").strip())
+        )
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return proc.stdout, cpu
+
+
+def summarize(times):
+    return {
+        "median": statistics.median(times),
+        "variance": statistics.variance(times) if len(times) > 1 else 0.0,
+        "min": min(times),
+        "max": max(times),
+        "times": times,
+    }
+
+
+def bench(file, interps, runs):
+    outputs = {}
+    result = {}
+    for name, interp in interps:
+        times = []
+        for r in range(runs):
+            output, cpu = run_once(interp, file)
+            times += [cpu]
+        outputs[name] = output
+        result[name] = summarize(times)
+    # A workload which doesn't do the same thing everywhere can't be compared
+    if len(set(outputs.values())) > 1:
+        raise BenchError("%s: output differs between %s" % (file, " and ".join(outputs)))
+    if "snek" in result and "python" in result and result["python"]["median"] > 0:
+        result["ratio"] = result["snek"]["median"] / result["python"]["median"]
+    return result
+
+
+# Return the workloads where snek is slower than in 'baseline' by more
+# than 'threshold'. The fastest run of each is compared, as it is the
+# one least disturbed by the rest of the system, and the allowance is
+# widened by two standard deviations of the difference so that noisy
+# runs don't fail the check
+def regressions(report, baseline, threshold):
+    slower = []
+    for name, result in report["workloads"].items():
+        base = baseline.get("workloads", {}).get(name, {}).get("snek")
+        if not base or "snek" not in result or base["min"] <= 0:
+            continue
+        now = result["snek"]
+        change = now["min"] / base["min"] - 1
+        noise = 2 * math.sqrt(base["variance"] + now["variance"]) / base["min"]
+        if change > threshold + noise:
+            slower += [(name, base["min"], now["min"], change)]
+    return slower
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--snek", default=os.path.join(here, "..", "posix", "snek"), help="snek to time"
+    )
+    arg_parser.add_argument("--python", default="python3", help="python to compare with")
+    arg_parser.add_argument("--no-python", action="store_true", help="Only time snek")
+    arg_parser.add_argument("--runs", type=int, default=5, help="Times to run each workload")
+    arg_parser.add_argument("--baseline", help="Earlier report to compare with")
+    arg_parser.add_argument(
+        "--threshold", type=float, default=0.10, help="Allowed slowdown, 0.10 is 10%%"
+    )
+    arg_parser.add_argument("--output", help="Where to write the report, otherwise stdout")
+    arg_parser.add_argument("workload", nargs="+", help="Snek programs to time")
+    args = arg_parser.parse_args()
+
+    interps = [("snek", args.snek)]
+    if not args.no_python:
+        interps += [("python", args.python)]
+
+    report = {"runs": args.runs, "workloads": {}}
+    try:
+        for file in args.workload:
+            name = os.path.splitext(os.path.basename(file))[0]
+            result = bench(file, interps, args.runs)
+            report["workloads"][name] = result
+            line = "%-10s snek %8.3fs" % (name, result["snek"]["median"])
+            if "python" in result:
+                line += "  python %8.3fs" % result["python"]["median"]
+            if "ratio" in result:
+                line += "  ratio %5.2f" % result["ratio"]
+            print(line, file=sys.stderr)
+    except BenchError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = regressions(report, baseline, args.threshold)
+        for name, base, now, change in slower:
+            print(
+                "%s: %.3fs, was %.3fs, %.0f%% slower" % (name, now, base, change * 100),
+                file=sys.stderr,
+            )
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Building strings a character at a time and indexing them
+
+def build(n):
+    s = ""
+    for i in range(n):
+        s += chr(97 + i % 26)
+    return s
+
+def scan(s, rounds):
+    t = 0
+    for r in range(rounds):
+        for i in range(len(s)):
+            t += ord(s[i]) - 96
+    return t
+
+def words(n):
+    t = 0
+    for i in range(n):
+        w = "w" + chr(65 + i % 26) + "-" + chr(97 + i % 7)
+        t += len(w)
+    return t
+
+s = build(20000)
+print(len(s))
+print(scan(s, 30))
+print(words(600000))
@@ -0,0 +1,300 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+#include "snek.h"
+
+#if SNEK_ALLOC_PROFILE
+
+/*
+ * 'snek --allocs' counts the objects and bytes allocated on each line,
+ * split by the kind of object. A record of each object, in heap order,
+ * names the line and kind which allocated it. The collector walks the
+ * objects which survive in the same order, so the records can follow
+ * them as they move, dropping those which didn't make it. Each object
+ * adds its size to the bytes surviving for its line each time it lives
+ * through a collection.
+ *
+ * The busiest lines are printed to stderr at exit, or to stdout by
+ * gc.allocs().
+ */
+
+#define SNEK_ALLOCS_PRINT	32
+#define SNEK_ALLOCS_HASH	256
+
+typedef struct snek_alloc_site {
+	uint32_t	count;
+	uint32_t	bytes;
+	uint32_t	survived;
+	snek_offset_t	line;
+	snek_kind_t	kind;
+} snek_alloc_site_t;
+
+typedef struct snek_alloc_record {
+	snek_offset_t	offset;
+	uint32_t	site;
+} snek_alloc_record_t;
+
+bool			snek_alloc_profiling;
+snek_kind_t		snek_alloc_next;
+
+static const char * const snek_alloc_kind_names[] = {
+	[snek_kind_other] = "other",
+	[snek_kind_string] = "string",
+	[snek_kind_list] = "list",
+	[snek_kind_func] = "func",
+	[snek_kind_frame] = "frame",
+	[snek_kind_code] = "code",
+	[snek_kind_name] = "name",
+};
+
+static snek_alloc_site_t	*snek_alloc_sites;
+static uint32_t			snek_alloc_nsite, snek_alloc_site_size;
+
+/* Indexes into snek_alloc_sites, plus one so that zero is empty */
+static uint32_t			*snek_alloc_hash;
+static uint32_t			snek_alloc_hash_size;
+
+static snek_alloc_record_t	*snek_alloc_records;
+static uint32_t			snek_alloc_nrecord, snek_alloc_record_size;
+
+/* Where the collector is in the records */
+static uint32_t			snek_alloc_read, snek_alloc_write;
+
+static uint32_t			snek_alloc_collections;
+static uint32_t			snek_alloc_survived;
+static uint32_t			snek_alloc_lost;
+
+/* The hash slot holding 'line' and 'kind', or the empty one where they belong */
+static uint32_t *
+snek_alloc_hash_find(snek_offset_t line, snek_kind_t kind)
+{
+	uint32_t	i = ((uint32_t) line * 2654435761u) ^ kind;
+
+	for (;;) {
+		uint32_t	*h = &snek_alloc_hash[i++ & (snek_alloc_hash_size - 1)];
+
+		if (!*h || (snek_alloc_sites[*h - 1].line == line &&
+			    snek_alloc_sites[*h - 1].kind == kind))
+			return h;
+	}
+}
+
+static bool
+snek_alloc_hash_grow(void)
+{
+	uint32_t	size = snek_alloc_hash_size ? snek_alloc_hash_size * 2 : SNEK_ALLOCS_HASH;
+	uint32_t	*hash = calloc(size, sizeof (uint32_t));
+	uint32_t	s;
+
+	if (!hash)
+		return false;
+	free(snek_alloc_hash);
+	snek_alloc_hash = hash;
+	snek_alloc_hash_size = size;
+	for (s = 0; s < snek_alloc_nsite; s++) {
+		snek_alloc_site_t *site = &snek_alloc_sites[s];
+
+		*snek_alloc_hash_find(site->line, site->kind) = s + 1;
+	}
+	return true;
+}
+
+/* Find or add the site for 'line' and 'kind', returning its index or -1 */
+static int32_t
+snek_alloc_site(snek_offset_t line, snek_kind_t kind)
+{
+	uint32_t	*h;
+
+	if (snek_alloc_nsite * 4 >= snek_alloc_hash_size * 3 && !snek_alloc_hash_grow())
+		return -1;
+	h = snek_alloc_hash_find(line, kind);
+	if (*h)
+		return *h - 1;
+
+	if (snek_alloc_nsite == snek_alloc_site_size) {
+		uint32_t		size = snek_alloc_site_size * 2 + SNEK_ALLOCS_HASH;
+		snek_alloc_site_t	*sites = realloc(snek_alloc_sites, size * sizeof (snek_alloc_site_t));
+
+		if (!sites)
+			return -1;
+		snek_alloc_sites = sites;
+		snek_alloc_site_size = size;
+	}
+	snek_alloc_sites[snek_alloc_nsite] = (snek_alloc_site_t) { .line = line, .kind = kind };
+	*h = snek_alloc_nsite + 1;
+	return snek_alloc_nsite++;
+}
+
+void
+snek_alloc_note(snek_offset_t offset, snek_offset_t size)
+{
+	int32_t	s = snek_alloc_site(snek_line, snek_alloc_next);
+
+	snek_alloc_next = snek_kind_other;
+	if (s < 0) {
+		snek_alloc_lost++;
+		return;
+	}
+	snek_alloc_sites[s].count++;
+	snek_alloc_sites[s].bytes += size;
+
+	if (snek_alloc_nrecord == snek_alloc_record_size) {
+		uint32_t		alloc = snek_alloc_record_size * 2 + 1024;
+		snek_alloc_record_t	*records = realloc(snek_alloc_records, alloc * sizeof (snek_alloc_record_t));
+
+		if (!records) {
+			snek_alloc_lost++;
+			return;
+		}
+		snek_alloc_records = records;
+		snek_alloc_record_size = alloc;
+	}
+	snek_alloc_records[snek_alloc_nrecord++] = (snek_alloc_record_t) { .offset = offset, .site = s };
+}
+
+/* Growing in place only ever happens to the most recent object */
+void
+snek_alloc_note_grow(snek_offset_t offset, snek_offset_t size)
+{
+	snek_alloc_record_t	*record;
+
+	if (!snek_alloc_nrecord)
+		return;
+	record = &snek_alloc_records[snek_alloc_nrecord - 1];
+	if (record->offset == offset)
+		snek_alloc_sites[record->site].bytes += size;
+}
+
+/* Objects below 'low' aren't collected, so leave their records alone */
+void
+snek_alloc_note_collect(snek_offset_t low)
+{
+	uint32_t	l = 0, r = snek_alloc_nrecord;
+
+	while (l < r) {
+		uint32_t m = (l + r) >> 1;
+
+		if (snek_alloc_records[m].offset < low)
+			l = m + 1;
+		else
+			r = m;
+	}
+	snek_alloc_read = snek_alloc_write = l;
+	snek_alloc_collections++;
+}
+
+void
+snek_alloc_note_live(snek_offset_t old_offset, snek_offset_t new_offset, snek_offset_t size)
+{
+	while (snek_alloc_read < snek_alloc_nrecord &&
+	       snek_alloc_records[snek_alloc_read].offset < old_offset)
+		snek_alloc_read++;
+	if (snek_alloc_read < snek_alloc_nrecord &&
+	    snek_alloc_records[snek_alloc_read].offset == old_offset)
+	{
+		snek_alloc_record_t record = snek_alloc_records[snek_alloc_read++];
+
+		record.offset = new_offset;
+		snek_alloc_sites[record.site].survived += size;
+		snek_alloc_survived += size;
+		snek_alloc_records[snek_alloc_write++] = record;
+	}
+}
+
+void
+snek_alloc_note_done(void)
+{
+	snek_alloc_nrecord = snek_alloc_write;
+}
+
+/* The heap has been replaced */
+void
+snek_alloc_note_reset(void)
+{
+	snek_alloc_nrecord = 0;
+}
+
+static int
+snek_alloc_site_cmp(const void *a, const void *b)
+{
+	const snek_alloc_site_t	*sa = a, *sb = b;
+
+	if (sa->bytes != sb->bytes)
+		return sa->bytes < sb->bytes ? 1 : -1;
+	if (sa->line != sb->line)
+		return (int) sa->line - (int) sb->line;
+	return (int) sa->kind - (int) sb->kind;
+}
+
+static void
+snek_alloc_report(FILE *f)
+{
+	snek_alloc_site_t	*sites = malloc(snek_alloc_nsite * sizeof (snek_alloc_site_t) + 1);
+	uint32_t		count = 0, bytes = 0, s;
+
+	if (!sites)
+		return;
+	if (snek_alloc_nsite)
+		memcpy(sites, snek_alloc_sites, snek_alloc_nsite * sizeof (snek_alloc_site_t));
+	qsort(sites, snek_alloc_nsite, sizeof (snek_alloc_site_t), snek_alloc_site_cmp);
+	for (s = 0; s < snek_alloc_nsite; s++) {
+		count += sites[s].count;
+		bytes += sites[s].bytes;
+	}
+
+	fprintf(f, "allocations   %10lu (%lu bytes), %lu not counted\n",
+		(unsigned long) count, (unsigned long) bytes, (unsigned long) snek_alloc_lost);
+	fprintf(f, "collections   %10lu, %lu bytes surviving each on average\n",
+		(unsigned long) snek_alloc_collections,
+		(unsigned long) (snek_alloc_collections ? snek_alloc_survived / snek_alloc_collections : 0));
+	fprintf(f, "%10s %10s %10s %6s  %s\n", "count", "bytes", "survived", "line", "kind");
+	for (s = 0; s < snek_alloc_nsite && s < SNEK_ALLOCS_PRINT; s++)
+		fprintf(f, "%10lu %10lu %10lu %6d  %s\n",
+			(unsigned long) sites[s].count,
+			(unsigned long) sites[s].bytes,
+			(unsigned long) sites[s].survived,
+			sites[s].line,
+			snek_alloc_kind_names[sites[s].kind]);
+	free(sites);
+}
+
+static void
+snek_alloc_finish(void)
+{
+	snek_alloc_profiling = false;
+	snek_alloc_report(stderr);
+}
+
+void
+snek_alloc_profile_start(void)
+{
+	if (!snek_alloc_profiling)
+		atexit(snek_alloc_finish);
+	snek_alloc_profiling = true;
+}
+
+#endif
+
+/* Print the allocation report so far */
+snek_poly_t
+snek_builtin_gc_allocs(void)
+{
+#if SNEK_ALLOC_PROFILE
+	if (snek_alloc_profiling) {
+		snek_alloc_report(stdout);
+		return SNEK_NULL;
+	}
+#endif
+	return snek_error("not counting allocations");
+}
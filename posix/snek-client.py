@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Run programs on a 'snek --serve' server. The program's output goes
+# straight to our own stdout and stderr, which are handed to the
+# server along with the program.
+#
+
+import sys
+import argparse
+import socket
+import struct
+
+#
+# Run 'program' (bytes) on the server listening at 'path', sending
+# output to the 'stdout' and 'stderr' file descriptors. Returns the
+# program's exit status, or -1 when the server doesn't report one.
+#
+def snek_run(path, program, name="<client>", stdout=1, stderr=2):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        name = name.encode()[:255]
+        fds = struct.pack("ii", stdout, stderr)
+        sock.sendmsg([bytes([len(name)])],
+                     [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        sock.sendall(name)
+        sock.sendall(program)
+        sock.shutdown(socket.SHUT_WR)
+        status = b""
+        while len(status) < 4:
+            data = sock.recv(4 - len(status))
+            if not data:
+                return -1
+            status += data
+        return struct.unpack("!I", status)[0]
+    finally:
+        sock.close()
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--socket", required=True, help="Server socket")
+    arg_parser.add_argument("file", nargs="*", help="Programs to run, otherwise standard input")
+    args = arg_parser.parse_args()
+
+    status = 0
+    if not args.file:
+        status = snek_run(args.socket, sys.stdin.buffer.read(), "<stdin>")
+    for file in args.file:
+        with open(file, "rb") as f:
+            ret = snek_run(args.socket, f.read(), file)
+        if ret != 0:
+            status = ret
+    sys.exit(status if status >= 0 else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+#include "snek.h"
+#include <unistd.h>
+
+/*
+ * A heap image holds the interpreter state after running a program.
+ * The header records the next id to hand out and the globals version
+ * which cached lookups in the saved code refer to. The ids of the
+ * modules which have been imported follow, and then the heap as
+ * written by snek_mem_save. Loading an image replaces the heap, so it
+ * must happen before anything else runs. Images only work with a
+ * snek built the same way as the one that wrote them.
+ */
+
+#define SNEK_IMAGE_VERSION	2
+
+typedef struct snek_image_header {
+	char		magic[6];
+	uint8_t		version;
+	uint8_t		offset_size;
+	uint8_t		nop;
+	uint8_t		builtin_end;
+	snek_id_t	id;
+	snek_offset_t	globals_version;
+	uint32_t	nmodule;
+} snek_image_header_t;
+
+static void
+snek_image_header(snek_image_header_t *header)
+{
+	memset(header, 0, sizeof (*header));
+	strcpy(header->magic, "snekh");
+	header->version = SNEK_IMAGE_VERSION;
+	header->offset_size = sizeof (snek_offset_t);
+	header->nop = snek_op_nop;
+	header->builtin_end = SNEK_BUILTIN_END;
+}
+
+static bool
+snek_image_put(const void *data, uint32_t size, void *closure)
+{
+	return fwrite(data, 1, size, closure) == size;
+}
+
+static bool
+snek_image_get(void *data, uint32_t size, void *closure)
+{
+	return fread(data, 1, size, closure) == size;
+}
+
+/* Write the image under a temporary name so that readers never see part of it */
+bool
+snek_image_save(const char *file)
+{
+	snek_image_header_t	header;
+	const snek_id_t		*modules;
+	char			*tmp = malloc(strlen(file) + 16);
+	FILE			*f = NULL;
+	bool			ok = false;
+
+	if (tmp) {
+		sprintf(tmp, "%s.%d", file, (int) getpid());
+		f = fopen(tmp, "wb");
+	}
+	if (f) {
+		snek_image_header(&header);
+		header.id = snek_id;
+		header.globals_version = snek_globals_version;
+		header.nmodule = snek_import_modules(&modules);
+		ok = (fwrite(&header, sizeof (header), 1, f) == 1 &&
+		      fwrite(modules, sizeof (snek_id_t), header.nmodule, f) == header.nmodule &&
+		      snek_mem_save(snek_image_put, f));
+		if (fclose(f) != 0)
+			ok = false;
+		if (ok && rename(tmp, file) != 0)
+			ok = false;
+		if (!ok)
+			unlink(tmp);
+	}
+	if (!ok)
+		perror(file);
+	free(tmp);
+	return ok;
+}
+
+bool
+snek_image_load(const char *file)
+{
+	snek_image_header_t	header, expect;
+	snek_id_t		id;
+	FILE			*f = fopen(file, "rb");
+	bool			ok;
+	uint32_t		i;
+
+	if (!f) {
+		perror(file);
+		return false;
+	}
+	ok = fread(&header, sizeof (header), 1, f) == 1;
+	if (ok) {
+		snek_image_header(&expect);
+		expect.id = header.id;
+		expect.globals_version = header.globals_version;
+		expect.nmodule = header.nmodule;
+		ok = memcmp(&header, &expect, sizeof (header)) == 0;
+	}
+	for (i = 0; ok && i < header.nmodule; i++)
+		ok = fread(&id, sizeof (id), 1, f) == 1 && snek_import_mark(id);
+	ok = ok && snek_mem_load(snek_image_get, f);
+	fclose(f);
+	if (!ok) {
+		fprintf(stderr, "%s: not a snek heap image\n", file);
+		return false;
+	}
+	snek_id = header.id;
+	snek_globals_version = header.globals_version;
+	return true;
+}
@@ -0,0 +1,1100 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+#include "snek.h"
+#include <unistd.h>
+
+/*
+ * 'import foo' runs foo.py from the directory holding the importing
+ * file or from one of the directories listed in SNEKPATH; 'import
+ * foo.bar' runs foo/bar.py. Modules which can't be found are ignored,
+ * as 'import time' and the like only name builtins. Modules share
+ * the global namespace, and each name a module defines is also bound
+ * as foo.name so that code written for Python works.
+ *
+ * As foo.py is compiled, each piece of top-level code is saved, and
+ * the result is written to foo.snekc if no errors occur. Importing an
+ * unchanged foo.py later runs the saved code instead of lexing and
+ * parsing it again. Ids and heap offsets differ from run to run, so
+ * names and string constants are saved as text.
+ *
+ * The whole file is checked before any of it runs. A file which
+ * fails the check is ignored, and foo.py is compiled and saved again.
+ */
+
+#define SNEK_IMPORT_VERSION	2
+
+typedef struct snek_import_header {
+	char		magic[6];
+	uint8_t		version;
+	uint8_t		offset_size;
+	uint8_t		cache_size;
+	uint8_t		nop;
+	uint32_t	length;
+	uint32_t	hash;
+	uint32_t	sum;		/* hash of the records */
+} snek_import_header_t;
+
+/* Records in a .snekc file, after the header */
+#define SNEK_IMPORT_NAME	'n'
+#define SNEK_IMPORT_CODE	'c'
+#define SNEK_IMPORT_DEF		'f'
+#define SNEK_IMPORT_DEL		'd'
+#define SNEK_IMPORT_MODULE	'i'
+#define SNEK_IMPORT_END		'e'
+
+typedef struct snek_id_list {
+	snek_id_t	*ids;
+	uint32_t	n;
+	uint32_t	alloc;
+} snek_id_list_t;
+
+typedef struct snek_module {
+	FILE		*save;		/* records, or NULL when not saving */
+	char		*save_buf;
+	size_t		save_size;
+	bool		save_failed;
+	snek_id_list_t	names;		/* ids, in the order saved or loaded */
+	snek_id_list_t	defined;	/* names assigned at the top level */
+} snek_module_t;
+
+/* The module being compiled or loaded */
+static snek_module_t	*snek_module;
+
+static snek_id_list_t	snek_imported;
+
+static bool
+snek_id_list_add(snek_id_list_t *list, snek_id_t id)
+{
+	if (list->n == list->alloc) {
+		uint32_t	alloc = list->alloc ? list->alloc * 2 : 32;
+		snek_id_t	*ids = realloc(list->ids, alloc * sizeof (snek_id_t));
+
+		if (!ids)
+			return false;
+		list->ids = ids;
+		list->alloc = alloc;
+	}
+	list->ids[list->n++] = id;
+	return true;
+}
+
+static int32_t
+snek_id_list_find(snek_id_list_t *list, snek_id_t id)
+{
+	uint32_t	i;
+
+	for (i = 0; i < list->n; i++)
+		if (list->ids[i] == id)
+			return i;
+	return -1;
+}
+
+/*
+ * Find each id and string operand in 'code', which hasn't had its
+ * locals resolved. 'f' returns false to stop the walk. Unknown
+ * opcodes and operands running past the end also stop it.
+ */
+static bool
+snek_import_walk(uint8_t *code, snek_offset_t size,
+		 bool (*f)(uint8_t *operand, bool is_string, void *closure),
+		 void *closure)
+{
+	snek_offset_t	ip = 0;
+
+	while (ip < size) {
+		snek_op_t op = code[ip++] & ~snek_op_push;
+		if (op > snek_op_local_int_assign || snek_op_extra_size(op) > size - ip)
+			return false;
+		switch (op) {
+		case snek_op_string:
+			if (!f(&code[ip], true, closure))
+				return false;
+			break;
+		case snek_op_id:
+		case snek_op_id_array:
+		case snek_op_id_int_assign:
+		case snek_op_global:
+		case snek_op_name:
+		case snek_op_assign:
+		case snek_op_assign_named:
+		case snek_op_assign_plus:
+		case snek_op_assign_minus:
+		case snek_op_assign_times:
+		case snek_op_assign_divide:
+		case snek_op_assign_div:
+		case snek_op_assign_mod:
+		case snek_op_assign_pow:
+		case snek_op_assign_land:
+		case snek_op_assign_lor:
+		case snek_op_assign_lxor:
+		case snek_op_assign_lshift:
+		case snek_op_assign_rshift:
+			if (!f(&code[ip], false, closure))
+				return false;
+			break;
+		case snek_op_range_step:
+		case snek_op_in_step:
+			if (!f(&code[ip + sizeof (snek_offset_t) + sizeof (uint8_t)], false, closure))
+				return false;
+			break;
+		default:
+			break;
+		}
+		ip += snek_op_extra_size(op);
+	}
+	return true;
+}
+
+/* Note the names assigned by top-level code */
+static void
+snek_import_defined(snek_code_t *code)
+{
+	snek_offset_t	ip = 0;
+	snek_id_t	id;
+
+	while (ip < code->size) {
+		snek_op_t op = code->code[ip++] & ~snek_op_push;
+		switch (op) {
+		case snek_op_assign:
+		case snek_op_id_int_assign:
+		case snek_op_assign_plus:
+		case snek_op_assign_minus:
+		case snek_op_assign_times:
+		case snek_op_assign_divide:
+		case snek_op_assign_div:
+		case snek_op_assign_mod:
+		case snek_op_assign_pow:
+		case snek_op_assign_land:
+		case snek_op_assign_lor:
+		case snek_op_assign_lxor:
+		case snek_op_assign_lshift:
+		case snek_op_assign_rshift:
+			memcpy(&id, &code->code[ip], sizeof (snek_id_t));
+			break;
+		case snek_op_range_step:
+		case snek_op_in_step:
+			memcpy(&id, &code->code[ip + sizeof (snek_offset_t) + sizeof (uint8_t)], sizeof (snek_id_t));
+			break;
+		default:
+			id = SNEK_ID_NONE;
+			break;
+		}
+		if (id != SNEK_ID_NONE && snek_id_list_find(&snek_module->defined, id) < 0)
+			snek_id_list_add(&snek_module->defined, id);
+		ip += snek_op_extra_size(op);
+	}
+}
+
+/* FNV-1a */
+static uint32_t
+snek_import_hash(const uint8_t *data, size_t len)
+{
+	uint32_t	h = 2166136261u;
+
+	while (len--)
+		h = (h ^ *data++) * 16777619u;
+	return h;
+}
+
+static void
+snek_import_header(snek_import_header_t *header, uint32_t length, uint32_t hash, uint32_t sum)
+{
+	memset(header, 0, sizeof (*header));
+	strcpy(header->magic, "snekc");
+	header->version = SNEK_IMPORT_VERSION;
+	header->offset_size = sizeof (snek_offset_t);
+	header->cache_size = SNEK_CACHE_SIZE;
+	header->nop = snek_op_nop;
+	header->length = length;
+	header->hash = hash;
+	header->sum = sum;
+}
+
+/* Saving */
+
+static void
+snek_save(const void *data, size_t size)
+{
+	if (fwrite(data, 1, size, snek_module->save) != size)
+		snek_module->save_failed = true;
+}
+
+static void
+snek_save_type(uint8_t type)
+{
+	snek_save(&type, 1);
+}
+
+/* Ids are saved as their position in the module's name records, plus one */
+static snek_id_t
+snek_save_index(snek_id_t id)
+{
+	if (id == SNEK_ID_NONE)
+		return 0;
+	return snek_id_list_find(&snek_module->names, id) + 1;
+}
+
+/* Make sure 'id' has a name record */
+static void
+snek_save_name(snek_id_t id)
+{
+	const char	*name;
+	size_t		len;
+	uint8_t		len8;
+
+	if (id == SNEK_ID_NONE || snek_id_list_find(&snek_module->names, id) >= 0)
+		return;
+	name = snek_name_string(id);
+	len = name ? strlen(name) : 256;
+	if (len > 255 || !snek_id_list_add(&snek_module->names, id)) {
+		snek_module->save_failed = true;
+		return;
+	}
+	len8 = len;
+	snek_save_type(SNEK_IMPORT_NAME);
+	snek_save(&len8, 1);
+	snek_save(name, len);
+}
+
+static bool
+snek_save_operand_name(uint8_t *operand, bool is_string, void *closure)
+{
+	snek_id_t	id;
+
+	(void) closure;
+	if (!is_string) {
+		memcpy(&id, operand, sizeof (snek_id_t));
+		snek_save_name(id);
+	}
+	return true;
+}
+
+static bool
+snek_save_operand(uint8_t *operand, bool is_string, void *closure)
+{
+	snek_offset_t	*nstring = closure;
+	snek_id_t	id;
+
+	if (is_string) {
+		memcpy(operand, nstring, sizeof (snek_offset_t));
+		++*nstring;
+	} else {
+		memcpy(&id, operand, sizeof (snek_id_t));
+		id = snek_save_index(id);
+		memcpy(operand, &id, sizeof (snek_id_t));
+	}
+	return true;
+}
+
+static bool
+snek_save_string(uint8_t *operand, bool is_string, void *closure)
+{
+	snek_offset_t	o, len;
+	char		*s;
+
+	(void) closure;
+	if (is_string) {
+		memcpy(&o, operand, sizeof (snek_offset_t));
+		s = snek_poly_to_string(snek_offset_to_poly(o, snek_string));
+		len = snek_string_len(s);
+		snek_save(&len, sizeof (snek_offset_t));
+		snek_save(s, len);
+	}
+	return true;
+}
+
+/*
+ * Save the code with ids replaced by name indices and strings by
+ * their position in the list of strings which follows
+ */
+static void
+snek_save_code(snek_code_t *code)
+{
+	uint8_t		*copy = malloc(code->size);
+	snek_offset_t	nstring = 0;
+
+	if (!copy) {
+		snek_module->save_failed = true;
+		return;
+	}
+	memcpy(copy, code->code, code->size);
+	snek_import_walk(copy, code->size, snek_save_operand, &nstring);
+	snek_save(&code->size, sizeof (snek_offset_t));
+	snek_save(&nstring, sizeof (snek_offset_t));
+	snek_save(copy, code->size);
+	free(copy);
+	snek_import_walk(code->code, code->size, snek_save_string, NULL);
+}
+
+void
+snek_import_code(snek_code_t *code)
+{
+	if (!snek_module || !code)
+		return;
+	snek_import_defined(code);
+	if (!snek_module->save)
+		return;
+	snek_import_walk(code->code, code->size, snek_save_operand_name, NULL);
+	snek_save_type(SNEK_IMPORT_CODE);
+	snek_save_code(code);
+}
+
+void
+snek_import_def(snek_id_t id, snek_code_t *code)
+{
+	uint8_t		i;
+	snek_id_t	index;
+
+	if (!snek_module)
+		return;
+	if (snek_id_list_find(&snek_module->defined, id) < 0)
+		snek_id_list_add(&snek_module->defined, id);
+	if (!snek_module->save)
+		return;
+	snek_save_name(id);
+	for (i = 0; i < snek_parse_nformal; i++)
+		snek_save_name(snek_parse_formals[i]);
+	snek_import_walk(code->code, code->size, snek_save_operand_name, NULL);
+	snek_save_type(SNEK_IMPORT_DEF);
+	index = snek_save_index(id);
+	snek_save(&index, sizeof (snek_id_t));
+	snek_save(&snek_parse_nformal, 1);
+	for (i = 0; i < snek_parse_nformal; i++) {
+		index = snek_save_index(snek_parse_formals[i]);
+		snek_save(&index, sizeof (snek_id_t));
+	}
+	snek_save_code(code);
+}
+
+void
+snek_import_del(void)
+{
+	uint8_t		i;
+	snek_id_t	index;
+
+	if (!snek_module || !snek_module->save)
+		return;
+	for (i = 0; i < snek_parse_nformal; i++)
+		snek_save_name(snek_parse_formals[i]);
+	snek_save_type(SNEK_IMPORT_DEL);
+	snek_save(&snek_parse_nformal, 1);
+	for (i = 0; i < snek_parse_nformal; i++) {
+		index = snek_save_index(snek_parse_formals[i]);
+		snek_save(&index, sizeof (snek_id_t));
+	}
+}
+
+/* Write the file under a temporary name so that readers never see part of it */
+static void
+snek_save_file(const char *cache, const char *data, size_t size)
+{
+	char	*tmp = malloc(strlen(cache) + 16);
+	FILE	*f;
+	bool	ok = false;
+
+	if (!tmp)
+		return;
+	sprintf(tmp, "%s.%ld", cache, (long) getpid());
+	f = fopen(tmp, "wb");
+	if (f) {
+		ok = fwrite(data, 1, size, f) == size;
+		if (fclose(f) != 0)
+			ok = false;
+		if (ok && rename(tmp, cache) != 0)
+			ok = false;
+		if (!ok)
+			unlink(tmp);
+	}
+	free(tmp);
+}
+
+/* Loading */
+
+typedef struct snek_load {
+	const uint8_t	*p;
+	const uint8_t	*end;
+} snek_load_t;
+
+static bool
+snek_load(snek_load_t *load, void *data, size_t size)
+{
+	if ((size_t) (load->end - load->p) < size)
+		return false;
+	memcpy(data, load->p, size);
+	load->p += size;
+	return true;
+}
+
+static bool
+snek_load_skip(snek_load_t *load, size_t size)
+{
+	if ((size_t) (load->end - load->p) < size)
+		return false;
+	load->p += size;
+	return true;
+}
+
+static bool
+snek_load_id(snek_load_t *load, snek_id_t *id)
+{
+	snek_id_t	index;
+
+	if (!snek_load(load, &index, sizeof (snek_id_t)))
+		return false;
+	if (index == 0) {
+		*id = SNEK_ID_NONE;
+		return true;
+	}
+	if (index > snek_module->names.n)
+		return false;
+	*id = snek_module->names.ids[index - 1];
+	return true;
+}
+
+typedef struct snek_load_operand {
+	snek_list_t	*strings;
+} snek_load_operand_t;
+
+static bool
+snek_load_operand(uint8_t *operand, bool is_string, void *closure)
+{
+	snek_load_operand_t	*l = closure;
+	snek_load_t		load = { .p = operand, .end = operand + sizeof (snek_id_t) };
+	snek_offset_t		o;
+	snek_id_t		id;
+
+	if (is_string) {
+		memcpy(&o, operand, sizeof (snek_offset_t));
+		if (!l->strings || o >= l->strings->size)
+			return false;
+		o = snek_poly_to_offset(snek_list_data(l->strings)[o]);
+		memcpy(operand, &o, sizeof (snek_offset_t));
+		return true;
+	}
+	if (!snek_load_id(&load, &id))
+		return false;
+	memcpy(operand, &id, sizeof (snek_id_t));
+	return true;
+}
+
+static snek_code_t *
+snek_load_code(snek_load_t *load)
+{
+	snek_offset_t		size, nstring, len, i;
+	const uint8_t		*bytes;
+	snek_load_operand_t	l = { .strings = NULL };
+	snek_code_t		*code;
+
+	if (!snek_load(load, &size, sizeof (snek_offset_t)) ||
+	    !snek_load(load, &nstring, sizeof (snek_offset_t)) ||
+	    (size_t) (load->end - load->p) < size)
+		return NULL;
+	bytes = load->p;
+	load->p += size;
+
+	if (nstring) {
+		l.strings = snek_list_make(nstring, true);
+		if (!l.strings)
+			return NULL;
+		snek_stack_push_list(l.strings);
+		for (i = 0; i < nstring; i++) {
+			if (!snek_load(load, &len, sizeof (snek_offset_t)) ||
+			    (size_t) (load->end - load->p) < len)
+				break;
+			char *s = snek_string_alloc(len);
+			if (!s)
+				break;
+			memcpy(s, load->p, len);
+			load->p += len;
+			l.strings = snek_poly_to_list(snek_stack_pick(0));
+			snek_list_data(l.strings)[i] = snek_string_to_poly(s);
+		}
+		if (i < nstring) {
+			snek_stack_drop(1);
+			return NULL;
+		}
+	}
+	code = snek_alloc(sizeof (snek_code_t) + size);
+	if (nstring)
+		l.strings = snek_stack_pop_list();
+	if (!code)
+		return NULL;
+	code->size = size;
+	memcpy(code->code, bytes, size);
+	if (!snek_import_walk(code->code, size, snek_load_operand, &l))
+		return NULL;
+	return code;
+}
+
+static bool
+snek_load_formals(snek_load_t *load)
+{
+	uint8_t	i;
+
+	if (!snek_load(load, &snek_parse_nformal, 1))
+		return false;
+#if SNEK_MAX_LOCALS < 255
+	if (snek_parse_nformal > SNEK_MAX_LOCALS)
+		return false;
+#endif
+	for (i = 0; i < snek_parse_nformal; i++)
+		if (!snek_load_id(load, &snek_parse_formals[i]))
+			return false;
+	return true;
+}
+
+/* Checking */
+
+typedef struct snek_check {
+	uint32_t	nname;
+	snek_offset_t	nstring;
+} snek_check_t;
+
+/* Is 'index' one of the name records read so far? */
+static bool
+snek_check_index(snek_load_t *load, uint32_t nname)
+{
+	snek_id_t	index;
+
+	return snek_load(load, &index, sizeof (snek_id_t)) && index <= nname;
+}
+
+static bool
+snek_check_formals(snek_load_t *load, uint32_t nname)
+{
+	uint8_t	nformal, i;
+
+	if (!snek_load(load, &nformal, 1))
+		return false;
+#if SNEK_MAX_LOCALS < 255
+	if (nformal > SNEK_MAX_LOCALS)
+		return false;
+#endif
+	for (i = 0; i < nformal; i++)
+		if (!snek_check_index(load, nname))
+			return false;
+	return true;
+}
+
+static bool
+snek_check_operand(uint8_t *operand, bool is_string, void *closure)
+{
+	snek_check_t	*check = closure;
+	snek_offset_t	o;
+	snek_id_t	index;
+
+	if (is_string) {
+		memcpy(&o, operand, sizeof (snek_offset_t));
+		return o < check->nstring;
+	}
+	memcpy(&index, operand, sizeof (snek_id_t));
+	return index <= check->nname;
+}
+
+/* Caches are saved empty, as the compiler leaves them */
+static bool
+snek_check_cache(const uint8_t *cache)
+{
+	uint8_t	i;
+
+	for (i = 0; i < SNEK_CACHE_SIZE; i++)
+		if (cache[i])
+			return false;
+	return true;
+}
+
+#define snek_check_bit(bits, i)	((bits)[(i) >> 3] & (1 << ((i) & 7)))
+#define snek_check_set(bits, i)	((bits)[(i) >> 3] |= (1 << ((i) & 7)))
+
+/*
+ * Branches must land on an instruction or at the end, fused
+ * instructions must hold a valid operator and loops must start
+ * before they step or end. Saved code has not had its locals
+ * resolved, so the local forms never appear.
+ */
+static bool
+snek_check_ops(const uint8_t *code, snek_offset_t size)
+{
+	uint8_t		*starts = calloc((size >> 3) + 1, 1);
+	uint8_t		loops[256 >> 3] = { 0 };
+	snek_offset_t	ip, target;
+	snek_id_t	index;
+	snek_op_t	op;
+	bool		ret = false;
+
+	if (!starts)
+		return false;
+	for (ip = 0; ip < size; ip += 1 + snek_op_extra_size(code[ip] & ~snek_op_push))
+		snek_check_set(starts, ip);
+	snek_check_set(starts, size);
+
+	for (ip = 0; ip < size; ip += snek_op_extra_size(op)) {
+		op = code[ip++] & ~snek_op_push;
+		target = 0;
+		switch (op) {
+		case snek_op_local:
+		case snek_op_assign_local:
+		case snek_op_local_array:
+		case snek_op_local_int_assign:
+			goto done;
+		case snek_op_id:
+		case snek_op_id_array:
+		case snek_op_assign:
+		case snek_op_assign_named:
+		case snek_op_assign_plus:
+		case snek_op_assign_minus:
+		case snek_op_assign_times:
+		case snek_op_assign_divide:
+		case snek_op_assign_div:
+		case snek_op_assign_mod:
+		case snek_op_assign_pow:
+		case snek_op_assign_land:
+		case snek_op_assign_lor:
+		case snek_op_assign_lxor:
+		case snek_op_assign_lshift:
+		case snek_op_assign_rshift:
+			if (!snek_check_cache(&code[ip + sizeof (snek_id_t)]))
+				goto done;
+			break;
+		case snek_op_id_int_assign:
+			memcpy(&index, &code[ip], sizeof (snek_id_t));
+			if (index == 0 ||
+			    !snek_check_cache(&code[ip + sizeof (snek_id_t)]) ||
+			    code[ip + sizeof (snek_id_t) + SNEK_CACHE_SIZE] > snek_op_rshift)
+				goto done;
+			break;
+		case snek_op_branch:
+		case snek_op_branch_true:
+		case snek_op_branch_false:
+			memcpy(&target, &code[ip], sizeof (snek_offset_t));
+			break;
+		case snek_op_compare_branch:
+		case snek_op_int_compare_branch:
+			memcpy(&target, &code[ip], sizeof (snek_offset_t));
+			if (code[ip + sizeof (snek_offset_t)] > snek_op_le)
+				goto done;
+			break;
+		case snek_op_int_binary:
+			if (code[ip] > snek_op_rshift)
+				goto done;
+			break;
+		case snek_op_range_start:
+			snek_check_set(loops, code[ip + sizeof (snek_offset_t)]);
+			break;
+		case snek_op_in_start:
+			snek_check_set(loops, code[ip]);
+			break;
+		case snek_op_range_step:
+		case snek_op_in_step:
+			memcpy(&target, &code[ip], sizeof (snek_offset_t));
+			if (!snek_check_bit(loops, code[ip + sizeof (snek_offset_t)]) ||
+			    !snek_check_cache(&code[ip + sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof (snek_id_t)]))
+				goto done;
+			break;
+		case snek_op_in_end:
+			if (!snek_check_bit(loops, code[ip]))
+				goto done;
+			break;
+		default:
+			break;
+		}
+		if (target > size || !snek_check_bit(starts, target))
+			goto done;
+	}
+	ret = true;
+done:
+	free(starts);
+	return ret;
+}
+
+static bool
+snek_check_code(snek_load_t *load, uint32_t nname)
+{
+	snek_offset_t	size, len, i;
+	uint8_t		*code;
+	snek_check_t	check = { .nname = nname };
+
+	if (!snek_load(load, &size, sizeof (snek_offset_t)) ||
+	    !snek_load(load, &check.nstring, sizeof (snek_offset_t)))
+		return false;
+	code = (uint8_t *) load->p;
+	if (!snek_load_skip(load, size))
+		return false;
+	for (i = 0; i < check.nstring; i++)
+		if (!snek_load(load, &len, sizeof (snek_offset_t)) || !snek_load_skip(load, len))
+			return false;
+	return (snek_import_walk(code, size, snek_check_operand, &check) &&
+		snek_check_ops(code, size));
+}
+
+/* Check each record without running anything */
+static bool
+snek_import_check(snek_load_t load)
+{
+	uint8_t		type, len;
+	uint32_t	nname = 0;
+
+	for (;;) {
+		if (!snek_load(&load, &type, 1))
+			return false;
+		switch (type) {
+		case SNEK_IMPORT_NAME:
+			if (!snek_load(&load, &len, 1) || !snek_load_skip(&load, len))
+				return false;
+			nname++;
+			break;
+		case SNEK_IMPORT_CODE:
+			if (!snek_check_code(&load, nname))
+				return false;
+			break;
+		case SNEK_IMPORT_DEF:
+			if (!snek_check_index(&load, nname) ||
+			    !snek_check_formals(&load, nname) ||
+			    !snek_check_code(&load, nname))
+				return false;
+			break;
+		case SNEK_IMPORT_DEL:
+			if (!snek_check_formals(&load, nname))
+				return false;
+			break;
+		case SNEK_IMPORT_MODULE:
+			if (!snek_check_index(&load, nname))
+				return false;
+			break;
+		case SNEK_IMPORT_END:
+			return load.p == load.end;
+		default:
+			return false;
+		}
+	}
+}
+
+/* Run the saved records, just as the parser would have */
+static bool
+snek_load_run(snek_load_t *load)
+{
+	uint8_t		type, len, i;
+	char		name[256];
+	snek_id_t	id;
+	snek_code_t	*code;
+	bool		keyword;
+
+	for (;;) {
+		snek_abort = false;
+		if (!snek_load(load, &type, 1))
+			return false;
+		switch (type) {
+		case SNEK_IMPORT_NAME:
+			if (!snek_load(load, &len, 1) || !snek_load(load, name, len))
+				return false;
+			name[len] = '\0';
+			id = snek_name_id(name, &keyword);
+			if (id == SNEK_ID_NONE || !snek_id_list_add(&snek_module->names, id))
+				return false;
+			break;
+		case SNEK_IMPORT_CODE:
+			code = snek_load_code(load);
+			if (!code)
+				return false;
+			snek_import_defined(code);
+			snek_code_run(code);
+			break;
+		case SNEK_IMPORT_DEF:
+			if (!snek_load_id(load, &id) || !snek_load_formals(load))
+				return false;
+			code = snek_load_code(load);
+			if (!code)
+				return false;
+			if (snek_id_list_find(&snek_module->defined, id) < 0)
+				snek_id_list_add(&snek_module->defined, id);
+			snek_func_t *func = snek_func_alloc(code);
+			if (!func)
+				return false;
+			snek_stack_push(snek_func_to_poly(func));
+			snek_poly_t *ref = snek_id_ref(id, true);
+			snek_poly_t poly = snek_stack_pop();
+			if (ref)
+				*ref = poly;
+			break;
+		case SNEK_IMPORT_DEL:
+			if (!snek_load_formals(load))
+				return false;
+			for (i = 0; i < snek_parse_nformal; i++)
+				if (!snek_id_del(snek_parse_formals[i])) {
+					snek_undefined(snek_parse_formals[i]);
+					break;
+				}
+			break;
+		case SNEK_IMPORT_MODULE:
+			if (!snek_load_id(load, &id))
+				return false;
+			snek_import(id);
+			break;
+		case SNEK_IMPORT_END:
+			return true;
+		default:
+			return false;
+		}
+	}
+}
+
+/* Read all of 'path' into memory */
+static uint8_t *
+snek_import_read(const char *path, size_t *size)
+{
+	FILE	*f = fopen(path, "rb");
+	uint8_t	*data = NULL;
+	long	len;
+
+	if (!f)
+		return NULL;
+	if (fseek(f, 0, SEEK_END) == 0 && (len = ftell(f)) >= 0 && fseek(f, 0, SEEK_SET) == 0) {
+		data = malloc(len + 1);
+		if (data && fread(data, 1, len, f) != (size_t) len) {
+			free(data);
+			data = NULL;
+		}
+		*size = len;
+	}
+	fclose(f);
+	return data;
+}
+
+/*
+ * Run the saved module in 'cache' if it matches the source and passes
+ * the check. Once it has started running, the module can't be run
+ * again, so a later failure is reported and the cache removed.
+ */
+static bool
+snek_import_load(char *path, const char *cache, uint32_t length, uint32_t hash)
+{
+	snek_import_header_t	header;
+	size_t			size;
+	uint8_t			*data = snek_import_read(cache, &size);
+	bool			ret = false;
+
+	if (!data)
+		return false;
+	if (size > sizeof (header)) {
+		snek_load_t	load = { .p = data + sizeof (header), .end = data + size };
+
+		snek_import_header(&header, length, hash,
+				   snek_import_hash(load.p, load.end - load.p));
+		if (memcmp(data, &header, sizeof (header)) == 0 && snek_import_check(load)) {
+			char	*file = snek_file;
+
+			snek_file = path;
+			if (!snek_load_run(&load) && !snek_abort) {
+				snek_error("bad module cache %s", cache);
+				unlink(cache);
+			}
+			snek_file = file;
+			ret = true;
+		}
+	}
+	free(data);
+	return ret;
+}
+
+/* Compile and run 'path', saving the result in 'cache' */
+static void
+snek_import_compile(char *path, const char *cache, uint32_t length, uint32_t hash)
+{
+	snek_import_header_t	header;
+	snek_lex_state_t	lex;
+	FILE			*input = fopen(path, "r");
+	FILE			*outer_input = snek_posix_input;
+	bool			interactive = snek_interactive;
+	bool			failed = snek_parse_failed;
+
+	if (!input) {
+		perror(path);
+		return;
+	}
+	snek_module->save = open_memstream(&snek_module->save_buf, &snek_module->save_size);
+	if (snek_module->save) {
+		snek_import_header(&header, length, hash, 0);
+		snek_save(&header, sizeof (header));
+	}
+
+	snek_lex_save(&lex, path);
+	snek_posix_input = input;
+	snek_interactive = false;
+	snek_parse_failed = false;
+	snek_parse();
+	if (snek_module->save) {
+		snek_save_type(SNEK_IMPORT_END);
+		if (fclose(snek_module->save) != 0)
+			snek_module->save_failed = true;
+		snek_module->save = NULL;
+		if (!snek_parse_failed && !snek_module->save_failed) {
+			snek_import_header(&header, length, hash,
+					   snek_import_hash((uint8_t *) snek_module->save_buf + sizeof (header),
+							    snek_module->save_size - sizeof (header)));
+			memcpy(snek_module->save_buf, &header, sizeof (header));
+			snek_save_file(cache, snek_module->save_buf, snek_module->save_size);
+		}
+		free(snek_module->save_buf);
+	}
+	snek_parse_failed = failed;
+	snek_interactive = interactive;
+	snek_posix_input = outer_input;
+	snek_lex_restore(&lex);
+	fclose(input);
+}
+
+/*
+ * Bind module.name to the value of each name the module defined. Names
+ * live in the pool, so they are looked up again after each allocation
+ */
+static void
+snek_import_alias(snek_id_t module_id)
+{
+	uint32_t	i;
+	bool		keyword;
+
+	for (i = 0; i < snek_module->defined.n; i++) {
+		snek_poly_t	*ref = snek_id_ref(snek_module->defined.ids[i], false);
+		const char	*module = snek_name_string(module_id);
+		const char	*name = snek_name_string(snek_module->defined.ids[i]);
+
+		if (!ref || !module || !name)
+			continue;
+
+		char alias[strlen(module) + strlen(name) + 2];
+
+		sprintf(alias, "%s.%s", module, name);
+		snek_stack_push(*ref);
+		snek_id_t id = snek_name_id(alias, &keyword);
+		ref = id != SNEK_ID_NONE ? snek_id_ref(id, true) : NULL;
+		snek_poly_t value = snek_stack_pop();
+		if (ref)
+			*ref = value;
+	}
+}
+
+static bool
+snek_import_exists(const char *dir, size_t dir_len, const char *file, char **path)
+{
+	*path = malloc(dir_len + strlen(file) + 2);
+	if (!*path)
+		return false;
+	sprintf(*path, "%.*s/%s", (int) dir_len, dir, file);
+	if (access(*path, R_OK) == 0)
+		return true;
+	free(*path);
+	*path = NULL;
+	return false;
+}
+
+/* Look for 'file' beside the current file, then along SNEKPATH */
+static char *
+snek_import_find(const char *file)
+{
+	const char	*slash = strrchr(snek_file, '/');
+	const char	*dirs = getenv("SNEKPATH");
+	char		*path;
+
+	if (slash) {
+		if (snek_import_exists(snek_file, slash - snek_file, file, &path))
+			return path;
+	} else if (snek_import_exists(".", 1, file, &path)) {
+		return path;
+	}
+	while (dirs && *dirs) {
+		size_t	len = strcspn(dirs, ":");
+
+		if (len == 0 ? snek_import_exists(".", 1, file, &path) :
+		    snek_import_exists(dirs, len, file, &path))
+			return path;
+		dirs += len;
+		if (*dirs == ':')
+			dirs++;
+	}
+	return NULL;
+}
+
+void
+snek_import(snek_id_t id)
+{
+	const char	*name = snek_name_string(id);
+	char		*file, *path, *cache;
+	uint8_t		*source;
+	size_t		length, i;
+
+	if (snek_module && snek_module->save) {
+		snek_save_name(id);
+		snek_save_type(SNEK_IMPORT_MODULE);
+		snek_id_t index = snek_save_index(id);
+		snek_save(&index, sizeof (snek_id_t));
+	}
+	if (!name || snek_id_list_find(&snek_imported, id) >= 0)
+		return;
+
+	/* foo.bar is in foo/bar.py */
+	file = malloc(strlen(name) + 4);
+	if (!file)
+		return;
+	for (i = 0; name[i]; i++)
+		file[i] = name[i] == '.' ? '/' : name[i];
+	strcpy(file + i, ".py");
+	path = snek_import_find(file);
+	free(file);
+	if (!path)
+		return;
+
+	source = snek_import_read(path, &length);
+	cache = malloc(strlen(path) + 4);
+	if (source && cache && snek_id_list_add(&snek_imported, id)) {
+		uint32_t	hash = snek_import_hash(source, length);
+		snek_module_t	module = { .save = NULL };
+		snek_module_t	*outer = snek_module;
+
+		/* foo.py is saved in foo.snekc */
+		strcpy(cache, path);
+		strcpy(cache + strlen(cache) - 3, ".snekc");
+
+		snek_module = &module;
+		if (!snek_import_load(path, cache, length, hash))
+			snek_import_compile(path, cache, length, hash);
+		snek_import_alias(id);
+		snek_module = outer;
+		free(module.names.ids);
+		free(module.defined.ids);
+	}
+	free(cache);
+	free(source);
+	free(path);
+}
+
+#if SNEK_IMAGE
+
+/* The modules imported so far, for saving in a heap image */
+uint32_t
+snek_import_modules(const snek_id_t **ids)
+{
+	*ids = snek_imported.ids;
+	return snek_imported.n;
+}
+
+/* Note a module loaded from a heap image as already imported */
+bool
+snek_import_mark(snek_id_t id)
+{
+	return (snek_id_list_find(&snek_imported, id) >= 0 ||
+		snek_id_list_add(&snek_imported, id));
+}
+
+#endif
@@ -14,6 +14,7 @@
 
 #include "snek.h"
 #include <getopt.h>
+#include <time.h>
 #include <readline/readline.h>
 #include <readline/history.h>
 
@@ -22,13 +23,32 @@ FILE	*snek_posix_input;
 static const struct option options[] = {
 	{ .name = "version", .has_arg = 0, .val = 'v' },
 	{ .name = "help", .has_arg = 0, .val = '?' },
+	{ .name = "stats", .has_arg = 0, .val = 's' },
+#ifdef SNEK_DYNAMIC
+	{ .name = "heap", .has_arg = 1, .val = 'h' },
+	{ .name = "heap-limit", .has_arg = 1, .val = 'l' },
+#endif
+#if SNEK_IMAGE
+	{ .name = "image", .has_arg = 1, .val = 'i' },
+	{ .name = "save-image", .has_arg = 1, .val = 'o' },
+#endif
+	{ .name = "serve", .has_arg = 1, .val = 'S' },
+	{ .name = "timeout", .has_arg = 1, .val = 't' },
+	{ .name = "profile", .has_arg = 1, .val = 'p' },
+#if SNEK_TRACE
+	{ .name = "count-ops", .has_arg = 0, .val = 'c' },
+	{ .name = "trace", .has_arg = 1, .val = 'T' },
+#endif
+#if SNEK_ALLOC_PROFILE
+	{ .name = "allocs", .has_arg = 0, .val = 'a' },
+#endif
 	{ 0 },
 };
 
 static void
 usage (char *program, int val)
 {
-	fprintf(stderr, "usage: %s [--version] [--help] <program.py>\n", program);
+	fprintf(stderr, "usage: %s [--version] [--help] [--stats] [--heap <size>] [--heap-limit <size>] [--image <file>] [--save-image <file>] [--serve <socket>] [--timeout <secs>] [--profile <file>] [--count-ops] [--trace <file>] [--allocs] <program.py>\n", program);
 	exit(val);
 }
 
@@ -58,6 +78,45 @@ snek_getc_interactive(void)
 	return c;
 }
 
+#ifdef SNEK_DYNAMIC
+/* Parse a heap size, in bytes or with a k or M suffix */
+static uint32_t
+heap_size(char *program, const char *arg)
+{
+	char		*end;
+	unsigned long	size = strtoul(arg, &end, 0);
+
+	switch (*end) {
+	case 'k':
+	case 'K':
+		size *= 1024;
+		end++;
+		break;
+	case 'm':
+	case 'M':
+		size *= 1024 * 1024;
+		end++;
+		break;
+	}
+	if (end == arg || *end != '\0' || size == 0) {
+		fprintf(stderr, "%s: invalid heap size \"%s\"\n", program, arg);
+		usage(program, 1);
+	}
+	if (size > SNEK_POOL_MAX)
+		size = SNEK_POOL_MAX;
+	return size;
+}
+#endif
+
+uint32_t
+snek_posix_usec(void)
+{
+	struct timespec	ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (uint32_t) ts.tv_sec * 1000000 + ts.tv_nsec / 1000;
+}
+
 int
 snek_getc(FILE *input)
 {
@@ -70,13 +129,76 @@ int
 main (int argc, char **argv)
 {
 	int c;
+#ifdef SNEK_DYNAMIC
+	uint32_t heap = SNEK_POOL;
+#endif
+#if SNEK_IMAGE
+	char *image = NULL;
+	char *save_image = NULL;
+#endif
+	char *serve = NULL;
+	unsigned timeout = 0;
+#if SNEK_TRACE
+	bool count_ops = false;
+	char *trace = NULL;
+#endif
 
-	while ((c = getopt_long(argc, argv, "v?", options, NULL)) != -1) {
+#if SNEK_COUNT_PAIRS
+	atexit(snek_code_pairs_print);
+#endif
+	while ((c = getopt_long(argc, argv, "v?sh:l:i:o:S:t:p:cT:a", options, NULL)) != -1) {
 		switch (c) {
 		case 'v':
 			printf("%s version %s\n", argv[0], SNEK_VERSION);
 			exit(0);
 			break;
+		case 's':
+#if SNEK_STATS
+			/* exit() from a program also prints the summary */
+			atexit(snek_stats_print);
+#endif
+			break;
+#ifdef SNEK_DYNAMIC
+		case 'h':
+			heap = heap_size(argv[0], optarg);
+			break;
+		case 'l':
+			snek_pool_limit = heap_size(argv[0], optarg);
+			break;
+#endif
+#if SNEK_IMAGE
+		case 'i':
+			image = optarg;
+			break;
+		case 'o':
+			save_image = optarg;
+			break;
+#endif
+		case 'S':
+			serve = optarg;
+			break;
+		case 't':
+			timeout = strtoul(optarg, NULL, 0);
+			break;
+		case 'p':
+			if (!snek_profile_start(optarg)) {
+				fprintf(stderr, "%s: cannot start profiling\n", argv[0]);
+				exit(1);
+			}
+			break;
+#if SNEK_TRACE
+		case 'c':
+			count_ops = true;
+			break;
+		case 'T':
+			trace = optarg;
+			break;
+#endif
+#if SNEK_ALLOC_PROFILE
+		case 'a':
+			snek_alloc_profile_start();
+			break;
+#endif
 		case '?':
 			usage(argv[0], 0);
 			break;
@@ -86,6 +208,28 @@ main (int argc, char **argv)
 		}
 	}
 
+#ifdef SNEK_DYNAMIC
+	if (!snek_mem_alloc(heap)) {
+		fprintf(stderr, "%s: cannot allocate heap\n", argv[0]);
+		exit(1);
+	}
+#endif
+#if SNEK_IMAGE
+	if (image && !snek_image_load(image))
+		exit(1);
+#endif
+#if SNEK_TRACE
+	if ((count_ops || trace) && !snek_trace_start(trace)) {
+		fprintf(stderr, "%s: cannot start tracing\n", argv[0]);
+		exit(1);
+	}
+#endif
+
+	if (serve && !argv[optind]) {
+		snek_serve(serve, timeout);
+		return 0;
+	}
+
 	if (argv[optind]) {
 		snek_file = argv[optind];
 		snek_posix_input = fopen(snek_file, "r");
@@ -102,6 +246,13 @@ main (int argc, char **argv)
 
 	bool ret = snek_parse() == snek_parse_success;
 
+#if SNEK_IMAGE
+	if (ret && save_image && !snek_image_save(save_image))
+		ret = false;
+#endif
+	if (ret && serve)
+		snek_serve(serve, timeout);
+
 	if (snek_posix_input == stdin)
 		printf("\n");
 	return ret ? 0 : 1;
@@ -21,6 +21,39 @@ int snek_getc(FILE *input);
 
 #define SNEK_GETC()	snek_getc(snek_posix_input)
 
+uint32_t snek_posix_usec(void);
+
+#define SNEK_STATS_USEC()	snek_posix_usec()
+
+bool snek_image_save(const char *file);
+
+bool snek_image_load(const char *file);
+
+void snek_serve(const char *path, unsigned timeout);
+
+bool snek_profile_start(const char *file);
+
+bool snek_trace_start(const char *file);
+
+void snek_alloc_profile_start(void);
+
 #define SNEK_DEBUG	1
+#define SNEK_DYNAMIC	1
+#define SNEK_MAX_LOCALS	255
+#define SNEK_CACHE	1
+#define SNEK_NAME_HASH	1
+#define SNEK_THREADED	1
+#define SNEK_FUSE	1
+#define SNEK_STRING_CHARS	1
+#define SNEK_STRING_GROW	1
+#define SNEK_COMPILE_INC	128
+#define SNEK_COMPILE_SHIFT	0
+#define SNEK_COMPILE_KEEP	1024
+#define SNEK_STATS	1
+#define SNEK_IMPORT	1
+#define SNEK_IMAGE	1
+#define SNEK_PROFILE	1
+#define SNEK_TRACE	1
+#define SNEK_ALLOC_PROFILE	1
 
 #endif /* _SNEK_POSIX_H_ */
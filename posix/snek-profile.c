@@ -0,0 +1,337 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+#include "snek.h"
+#include <signal.h>
+#include <sys/time.h>
+
+/*
+ * 'snek --profile file' samples the running program from a SIGPROF
+ * timer. Each sample records the current line and, for each active
+ * call, the function and the line it is running, found by walking
+ * the frames. Identical stacks are counted together in a table set
+ * aside when profiling starts, as the handler can't allocate.
+ *
+ * At exit, the stacks are written to 'file' in the folded format read
+ * by flame graph tools, and a per-line summary goes to stderr. The
+ * frames can't be walked while the heap is moving, so those samples
+ * are only counted, as <collect>, like those taken while parsing.
+ * Samples which don't fit in the table are dropped.
+ */
+
+#define SNEK_PROFILE_USEC	1000
+#define SNEK_PROFILE_DEPTH	32
+#define SNEK_PROFILE_STACKS	4096
+
+/* Names for the frames that aren't functions found in the globals */
+#define SNEK_PROFILE_TOP	SNEK_ID_NONE
+#define SNEK_PROFILE_UNKNOWN	((snek_id_t) SNEK_OFFSET_NONE)
+
+typedef struct snek_profile_frame {
+	snek_id_t	func;
+	snek_offset_t	line;
+} snek_profile_frame_t;
+
+typedef struct snek_profile_stack {
+	uint32_t		count;
+	uint8_t			depth;
+	bool			truncated;
+	snek_profile_frame_t	frames[SNEK_PROFILE_DEPTH];	/* outermost first */
+} snek_profile_stack_t;
+
+static const char		*snek_profile_file;
+static snek_profile_stack_t	*snek_profile_stacks;
+static uint32_t			snek_profile_samples;
+static uint32_t			snek_profile_dropped;
+static uint32_t			snek_profile_parsing;
+static uint32_t			snek_profile_collecting;
+
+static bool
+snek_profile_valid(snek_offset_t offset)
+{
+	return (SNEK_POOL_BASE <= offset && offset < SNEK_POOL_BASE + SNEK_POOL_SIZE &&
+		(offset & (SNEK_ALLOC_ROUND - 1)) == 0);
+}
+
+/* The global name of the function running 'code' */
+static snek_id_t
+snek_profile_func(snek_offset_t code)
+{
+	snek_offset_t	i;
+
+	if (!snek_globals)
+		return SNEK_PROFILE_UNKNOWN;
+	for (i = 0; i < snek_globals->nvariables; i++) {
+		snek_poly_t	v = snek_globals->variables[i].value;
+
+		if (snek_poly_type(v) == snek_func &&
+		    snek_poly_to_func(v)->code == code)
+			return snek_globals->variables[i].id;
+	}
+	return SNEK_PROFILE_UNKNOWN;
+}
+
+/* The line holding the instruction at 'ip' */
+static snek_offset_t
+snek_profile_line(snek_code_t *code, snek_offset_t ip)
+{
+	snek_offset_t	i = 0, line = 0;
+	snek_op_t	op;
+
+	while (i < ip && i < code->size) {
+		op = code->code[i++] & ~snek_op_push;
+		if (op == snek_op_line)
+			memcpy(&line, &code->code[i], sizeof (snek_offset_t));
+		i += snek_op_extra_size(op);
+	}
+	return line;
+}
+
+static uint32_t
+snek_profile_hash(const snek_profile_stack_t *stack)
+{
+	const uint8_t	*b = (const uint8_t *) stack->frames;
+	size_t		len = stack->depth * sizeof (snek_profile_frame_t);
+	uint32_t	h = 2166136261u ^ stack->truncated;
+
+	while (len--)
+		h = (h ^ *b++) * 16777619u;
+	return h;
+}
+
+static void
+snek_profile_count(const snek_profile_stack_t *sample)
+{
+	uint32_t		i = snek_profile_hash(sample);
+	uint32_t		n;
+	snek_profile_stack_t	*stack;
+
+	for (n = 0; n < SNEK_PROFILE_STACKS; n++, i++) {
+		stack = &snek_profile_stacks[i % SNEK_PROFILE_STACKS];
+		if (stack->count == 0) {
+			*stack = *sample;
+			stack->count = 1;
+			return;
+		}
+		if (stack->depth == sample->depth &&
+		    stack->truncated == sample->truncated &&
+		    memcmp(stack->frames, sample->frames,
+			   sample->depth * sizeof (snek_profile_frame_t)) == 0)
+		{
+			stack->count++;
+			return;
+		}
+	}
+	snek_profile_dropped++;
+}
+
+static void
+snek_profile_sample(int sig)
+{
+	snek_profile_stack_t	sample;
+	snek_profile_frame_t	frames[SNEK_PROFILE_DEPTH];
+	snek_frame_t		*frame = snek_frame;
+	snek_offset_t		code;
+	uint8_t			depth = 0;
+
+	(void) sig;
+	snek_profile_samples++;
+	if (snek_mem_moving) {
+		snek_profile_collecting++;
+		return;
+	}
+	if (!snek_code) {
+		snek_profile_parsing++;
+		return;
+	}
+
+	/* Walk from the running code out to the top level */
+	code = snek_pool_offset(snek_code);
+	frames[depth].line = snek_line;
+	for (;;) {
+		if (!frame) {
+			frames[depth++].func = SNEK_PROFILE_TOP;
+			break;
+		}
+		frames[depth++].func = snek_profile_func(code);
+		code = frame->code;
+		if (depth == SNEK_PROFILE_DEPTH || !snek_profile_valid(code)) {
+			break;
+		}
+		frames[depth].line = snek_profile_line(snek_pool_addr(code), frame->ip);
+		if (snek_offset_is_none(frame->prev)) {
+			frame = NULL;
+		} else if (snek_profile_valid(frame->prev)) {
+			frame = snek_pool_addr(frame->prev);
+		} else {
+			break;
+		}
+	}
+
+	memset(&sample, '\0', sizeof (sample));
+	sample.depth = depth;
+	sample.truncated = frames[depth - 1].func != SNEK_PROFILE_TOP;
+	for (uint8_t d = 0; d < depth; d++)
+		sample.frames[d] = frames[depth - 1 - d];
+	snek_profile_count(&sample);
+}
+
+static void
+snek_profile_name(FILE *f, const snek_profile_frame_t *frame)
+{
+	const char	*name = NULL;
+
+	if (frame->func == SNEK_PROFILE_TOP)
+		name = "<module>";
+	else if (frame->func != SNEK_PROFILE_UNKNOWN)
+		name = snek_name_string(frame->func);
+	fprintf(f, "%s:%d", name ? name : "<function>", frame->line);
+}
+
+typedef struct snek_profile_line {
+	snek_profile_frame_t	frame;
+	uint32_t		self;
+	uint32_t		total;
+} snek_profile_line_t;
+
+static int
+snek_profile_line_cmp(const void *a, const void *b)
+{
+	const snek_profile_line_t	*la = a, *lb = b;
+
+	if (la->self != lb->self)
+		return la->self < lb->self ? 1 : -1;
+	if (la->total != lb->total)
+		return la->total < lb->total ? 1 : -1;
+	return (int) la->frame.line - (int) lb->frame.line;
+}
+
+static snek_profile_line_t *
+snek_profile_find(snek_profile_line_t *lines, uint32_t *nline, const snek_profile_frame_t *frame)
+{
+	uint32_t	i;
+
+	for (i = 0; i < *nline; i++)
+		if (lines[i].frame.func == frame->func && lines[i].frame.line == frame->line)
+			return &lines[i];
+	lines[i].frame = *frame;
+	lines[i].self = lines[i].total = 0;
+	++*nline;
+	return &lines[i];
+}
+
+/* Print the time spent on each line, and in the calls it makes */
+static void
+snek_profile_lines(void)
+{
+	snek_profile_line_t	*lines = calloc(SNEK_PROFILE_STACKS * SNEK_PROFILE_DEPTH, sizeof (snek_profile_line_t));
+	uint32_t		nline = 0, s, i;
+	uint8_t			d, e;
+
+	if (!lines)
+		return;
+	for (s = 0; s < SNEK_PROFILE_STACKS; s++) {
+		snek_profile_stack_t *stack = &snek_profile_stacks[s];
+
+		if (!stack->count)
+			continue;
+		for (d = 0; d < stack->depth; d++) {
+			/* Recursive calls only count once */
+			for (e = 0; e < d; e++)
+				if (memcmp(&stack->frames[e], &stack->frames[d], sizeof (snek_profile_frame_t)) == 0)
+					break;
+			if (e < d)
+				continue;
+			snek_profile_line_t *line = snek_profile_find(lines, &nline, &stack->frames[d]);
+			line->total += stack->count;
+			if (d == stack->depth - 1)
+				line->self += stack->count;
+		}
+	}
+	qsort(lines, nline, sizeof (snek_profile_line_t), snek_profile_line_cmp);
+
+	fprintf(stderr, "profile       %10lu samples, %lu parsing, %lu collecting, %lu dropped\n",
+		(unsigned long) snek_profile_samples,
+		(unsigned long) snek_profile_parsing,
+		(unsigned long) snek_profile_collecting,
+		(unsigned long) snek_profile_dropped);
+	fprintf(stderr, "%10s %10s  %s\n", "self", "total", "line");
+	for (i = 0; i < nline; i++) {
+		fprintf(stderr, "%10lu %10lu  ", (unsigned long) lines[i].self, (unsigned long) lines[i].total);
+		snek_profile_name(stderr, &lines[i].frame);
+		fprintf(stderr, "\n");
+	}
+	free(lines);
+}
+
+static void
+snek_profile_finish(void)
+{
+	struct itimerval	off = { 0 };
+	FILE			*f;
+	uint32_t		s;
+	uint8_t			d;
+
+	setitimer(ITIMER_PROF, &off, NULL);
+	signal(SIGPROF, SIG_IGN);
+
+	f = fopen(snek_profile_file, "w");
+	if (!f) {
+		perror(snek_profile_file);
+		return;
+	}
+	for (s = 0; s < SNEK_PROFILE_STACKS; s++) {
+		snek_profile_stack_t *stack = &snek_profile_stacks[s];
+
+		if (!stack->count)
+			continue;
+		if (stack->truncated)
+			fprintf(f, "...;");
+		for (d = 0; d < stack->depth; d++) {
+			if (d)
+				putc(';', f);
+			snek_profile_name(f, &stack->frames[d]);
+		}
+		fprintf(f, " %lu\n", (unsigned long) stack->count);
+	}
+	if (snek_profile_parsing)
+		fprintf(f, "<parse> %lu\n", (unsigned long) snek_profile_parsing);
+	if (snek_profile_collecting)
+		fprintf(f, "<collect> %lu\n", (unsigned long) snek_profile_collecting);
+	if (fclose(f) != 0)
+		perror(snek_profile_file);
+	snek_profile_lines();
+}
+
+/* Start sampling, writing the results to 'file' at exit */
+bool
+snek_profile_start(const char *file)
+{
+	struct sigaction	sa = {
+		.sa_handler = snek_profile_sample,
+		.sa_flags = SA_RESTART,
+	};
+	struct itimerval	timer = {
+		.it_interval = { .tv_usec = SNEK_PROFILE_USEC },
+		.it_value = { .tv_usec = SNEK_PROFILE_USEC },
+	};
+
+	snek_profile_stacks = calloc(SNEK_PROFILE_STACKS, sizeof (snek_profile_stack_t));
+	if (!snek_profile_stacks)
+		return false;
+	snek_profile_file = file;
+	atexit(snek_profile_finish);
+	return (sigaction(SIGPROF, &sa, NULL) == 0 &&
+		setitimer(ITIMER_PROF, &timer, NULL) == 0);
+}
@@ -0,0 +1,196 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+#include "snek.h"
+#include <errno.h>
+#include <signal.h>
+#include <unistd.h>
+#include <arpa/inet.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <sys/wait.h>
+
+/*
+ * snek --serve listens on a unix socket, forking a copy of itself for
+ * each connection so that every job starts from the state left by
+ * the prelude. A client sends:
+ *
+ *	one byte holding the length of the job's name, along with its
+ *	standard output and standard error file descriptors
+ *	the name
+ *	the program, ending when the client shuts down its side
+ *
+ * and gets back the four byte exit status, in network order, once
+ * the program finishes. Jobs killed by a signal report 128 plus the
+ * signal number; jobs which run too long are killed and report
+ * SNEK_SERVE_TIMEOUT.
+ */
+
+#define SNEK_SERVE_TIMEOUT	124
+
+static int
+snek_serve_fds(int conn, int *out, int *err, uint8_t *len)
+{
+	char		control[CMSG_SPACE(2 * sizeof (int))];
+	struct iovec	iov = { .iov_base = len, .iov_len = 1 };
+	struct msghdr	msg = {
+		.msg_iov = &iov,
+		.msg_iovlen = 1,
+		.msg_control = control,
+		.msg_controllen = sizeof (control),
+	};
+	struct cmsghdr	*cmsg;
+
+	if (recvmsg(conn, &msg, 0) != 1)
+		return -1;
+	cmsg = CMSG_FIRSTHDR(&msg);
+	if (!cmsg || cmsg->cmsg_level != SOL_SOCKET || cmsg->cmsg_type != SCM_RIGHTS ||
+	    cmsg->cmsg_len != CMSG_LEN(2 * sizeof (int)))
+		return -1;
+	memcpy(out, CMSG_DATA(cmsg), sizeof (int));
+	memcpy(err, CMSG_DATA(cmsg) + sizeof (int), sizeof (int));
+	return 0;
+}
+
+/* Run one job in this process, which never returns */
+static void
+snek_serve_run(int conn)
+{
+	int			out, err;
+	uint8_t			len;
+	char			name[256];
+	size_t			got = 0;
+	ssize_t			n;
+	snek_lex_state_t	lex;
+
+	if (snek_serve_fds(conn, &out, &err, &len) < 0)
+		_exit(1);
+	while (got < len) {
+		n = read(conn, name + got, len - got);
+		if (n <= 0)
+			_exit(1);
+		got += n;
+	}
+	name[len] = '\0';
+
+	if (dup2(out, 1) < 0 || dup2(err, 2) < 0)
+		_exit(1);
+	close(out);
+	close(err);
+
+	snek_posix_input = fdopen(conn, "r");
+	if (!snek_posix_input)
+		_exit(1);
+	/* Start the lexer over at the top of the new program */
+	snek_lex_save(&lex, name);
+	snek_interactive = false;
+	exit(snek_parse() == snek_parse_success ? 0 : 1);
+}
+
+static void
+snek_serve_alarm(int sig)
+{
+	(void) sig;
+}
+
+/*
+ * Handle one connection in a child of the server: run the job in a
+ * child of our own so that its exit status can be sent back however
+ * it ends
+ */
+static void
+snek_serve_job(int conn, unsigned timeout)
+{
+	struct sigaction	sa = { .sa_handler = snek_serve_alarm };
+	pid_t			pid;
+	int			status;
+	bool			killed = false;
+	uint32_t		ret;
+
+	signal(SIGCHLD, SIG_DFL);
+	pid = fork();
+	if (pid == 0)
+		snek_serve_run(conn);
+	if (pid < 0)
+		_exit(1);
+
+	/* No SA_RESTART, so the alarm interrupts waitpid */
+	sigaction(SIGALRM, &sa, NULL);
+	alarm(timeout);
+	while (waitpid(pid, &status, 0) < 0) {
+		if (errno != EINTR)
+			_exit(1);
+		kill(pid, SIGKILL);
+		killed = true;
+	}
+	alarm(0);
+
+	if (killed)
+		ret = SNEK_SERVE_TIMEOUT;
+	else if (WIFEXITED(status))
+		ret = WEXITSTATUS(status);
+	else
+		ret = 128 + WTERMSIG(status);
+	ret = htonl(ret);
+	if (write(conn, &ret, sizeof (ret)) < 0)
+		_exit(1);
+	_exit(0);
+}
+
+/* Accept jobs on 'path' forever, killing any that run for more than 'timeout' seconds */
+void
+snek_serve(const char *path, unsigned timeout)
+{
+	struct sockaddr_un	addr = { .sun_family = AF_UNIX };
+	int			sock, conn;
+
+	if (strlen(path) >= sizeof (addr.sun_path)) {
+		fprintf(stderr, "%s: socket name too long\n", path);
+		exit(1);
+	}
+	strcpy(addr.sun_path, path);
+	sock = socket(AF_UNIX, SOCK_STREAM, 0);
+	unlink(path);
+	if (sock < 0 ||
+	    bind(sock, (struct sockaddr *) &addr, sizeof (addr)) < 0 ||
+	    listen(sock, SOMAXCONN) < 0)
+	{
+		perror(path);
+		exit(1);
+	}
+
+	/* Children are reaped automatically */
+	signal(SIGCHLD, SIG_IGN);
+	fflush(stdout);
+	fflush(stderr);
+	for (;;) {
+		conn = accept(sock, NULL, NULL);
+		if (conn < 0) {
+			if (errno == EINTR)
+				continue;
+			perror(path);
+			exit(1);
+		}
+		switch (fork()) {
+		case 0:
+			close(sock);
+			snek_serve_job(conn, timeout);
+			break;
+		case -1:
+			perror("fork");
+			break;
+		}
+		close(conn);
+	}
+}
@@ -0,0 +1,230 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+#include "snek.h"
+
+#if SNEK_TRACE
+
+/*
+ * 'snek --count-ops' counts every instruction run, by opcode and by
+ * opcode and line, printing the busiest of each at exit. Push forms
+ * are counted separately. The line is the one running, as kept in
+ * snek_line, which goes back to the caller's line when a call returns.
+ *
+ * 'snek --trace file' counts the same way and also logs each
+ * instruction to 'file' for snek-trace to pick apart. The log starts
+ * with a header:
+ *
+ *	"snekt\0", version, sizeof (snek_offset_t), number of opcodes
+ *	the name of each opcode, as a length byte and the characters
+ *
+ * followed by one byte per instruction. Whenever the line changes,
+ * SNEK_TRACE_LINE and the new line number come first.
+ */
+
+#define SNEK_TRACE_VERSION	1
+#define SNEK_TRACE_LINE		0xff	/* not a valid opcode, push or not */
+#define SNEK_TRACE_NOP		(snek_op_local_int_assign + 1)
+#define SNEK_TRACE_PRINT	32
+#define SNEK_TRACE_LINES	1024
+
+typedef struct snek_trace_line {
+	uint32_t	count;
+	snek_offset_t	line;
+	uint8_t		op;
+} snek_trace_line_t;
+
+bool				snek_tracing;
+static uint32_t			snek_trace_ops[256];
+static snek_trace_line_t	*snek_trace_lines;
+static uint32_t			snek_trace_nline;
+static uint32_t			snek_trace_size;
+static uint32_t			snek_trace_dropped;
+static const char		*snek_trace_name;
+static FILE			*snek_trace_file;
+static snek_offset_t		snek_trace_line;
+
+static uint32_t
+snek_trace_hash(snek_offset_t line, uint8_t op)
+{
+	return ((uint32_t) line * 2654435761u) ^ op;
+}
+
+static snek_trace_line_t *
+snek_trace_find(snek_trace_line_t *lines, uint32_t size, snek_offset_t line, uint8_t op)
+{
+	uint32_t	i = snek_trace_hash(line, op);
+
+	for (;;) {
+		snek_trace_line_t *l = &lines[i++ & (size - 1)];
+
+		if (!l->count || (l->line == line && l->op == op))
+			return l;
+	}
+}
+
+/* Double the table once it is three quarters full */
+static bool
+snek_trace_grow(void)
+{
+	uint32_t		size = snek_trace_size ? snek_trace_size * 2 : SNEK_TRACE_LINES;
+	snek_trace_line_t	*lines = calloc(size, sizeof (snek_trace_line_t));
+	uint32_t		i;
+
+	if (!lines)
+		return false;
+	for (i = 0; i < snek_trace_size; i++) {
+		snek_trace_line_t *l = &snek_trace_lines[i];
+
+		if (l->count)
+			*snek_trace_find(lines, size, l->line, l->op) = *l;
+	}
+	free(snek_trace_lines);
+	snek_trace_lines = lines;
+	snek_trace_size = size;
+	return true;
+}
+
+void
+snek_trace_op(uint8_t op)
+{
+	snek_trace_line_t	*l;
+
+	snek_trace_ops[op]++;
+
+	if (snek_trace_nline * 4 >= snek_trace_size * 3 && !snek_trace_grow()) {
+		snek_trace_dropped++;
+	} else {
+		l = snek_trace_find(snek_trace_lines, snek_trace_size, snek_line, op);
+		if (!l->count++) {
+			l->line = snek_line;
+			l->op = op;
+			snek_trace_nline++;
+		}
+	}
+
+	if (snek_trace_file) {
+		if (snek_line != snek_trace_line) {
+			putc(SNEK_TRACE_LINE, snek_trace_file);
+			fwrite(&snek_line, sizeof (snek_offset_t), 1, snek_trace_file);
+			snek_trace_line = snek_line;
+		}
+		putc(op, snek_trace_file);
+	}
+}
+
+static void
+snek_trace_op_print(uint8_t op)
+{
+	const char *name = snek_op_names[op & ~snek_op_push];
+
+	fprintf(stderr, "  %s%s", name ? name : "?", (op & snek_op_push) ? "^" : "");
+}
+
+static int
+snek_trace_line_cmp(const void *a, const void *b)
+{
+	const snek_trace_line_t	*la = a, *lb = b;
+
+	if (la->count != lb->count)
+		return la->count < lb->count ? 1 : -1;
+	return (int) la->line - (int) lb->line;
+}
+
+static void
+snek_trace_finish(void)
+{
+	uint32_t	total = 0, i, n;
+	int		op;
+
+	snek_tracing = false;
+	if (snek_trace_file && fclose(snek_trace_file) != 0)
+		perror(snek_trace_name);
+	snek_trace_file = NULL;
+
+	for (op = 0; op < 256; op++)
+		total += snek_trace_ops[op];
+	fprintf(stderr, "instructions  %10lu, %lu lines not counted\n",
+		(unsigned long) total, (unsigned long) snek_trace_dropped);
+
+	fprintf(stderr, "%10s  %s\n", "count", "op");
+	for (n = 0; n < SNEK_TRACE_PRINT; n++) {
+		uint32_t	max = 0;
+		int		max_op = 0;
+
+		for (op = 0; op < 256; op++)
+			if (snek_trace_ops[op] > max) {
+				max = snek_trace_ops[op];
+				max_op = op;
+			}
+		if (!max)
+			break;
+		fprintf(stderr, "%10lu", (unsigned long) max);
+		snek_trace_op_print(max_op);
+		fprintf(stderr, "\n");
+		snek_trace_ops[max_op] = 0;
+	}
+
+	/* Pack the counted lines at the start of the table to sort them */
+	for (i = 0, n = 0; i < snek_trace_size; i++)
+		if (snek_trace_lines[i].count)
+			snek_trace_lines[n++] = snek_trace_lines[i];
+	qsort(snek_trace_lines, n, sizeof (snek_trace_line_t), snek_trace_line_cmp);
+	fprintf(stderr, "%10s %6s  %s\n", "count", "line", "op");
+	for (i = 0; i < n && i < SNEK_TRACE_PRINT; i++) {
+		fprintf(stderr, "%10lu %6d", (unsigned long) snek_trace_lines[i].count,
+			snek_trace_lines[i].line);
+		snek_trace_op_print(snek_trace_lines[i].op);
+		fprintf(stderr, "\n");
+	}
+}
+
+/*
+ * Start counting instructions, logging them to 'file' as well unless
+ * it is NULL
+ */
+bool
+snek_trace_start(const char *file)
+{
+	uint8_t	header[8] = { 's', 'n', 'e', 'k', 't', '\0',
+			      SNEK_TRACE_VERSION, sizeof (snek_offset_t) };
+	uint8_t	nop = SNEK_TRACE_NOP;
+	int	op;
+
+	if (!snek_trace_grow())
+		return false;
+	if (file) {
+		snek_trace_name = file;
+		snek_trace_file = fopen(file, "wb");
+		if (!snek_trace_file) {
+			perror(file);
+			return false;
+		}
+		fwrite(header, sizeof (header), 1, snek_trace_file);
+		putc(nop, snek_trace_file);
+		for (op = 0; op < nop; op++) {
+			const char *name = snek_op_names[op];
+			uint8_t len = name ? strlen(name) : 0;
+
+			putc(len, snek_trace_file);
+			if (len)
+				fwrite(name, 1, len, snek_trace_file);
+		}
+	}
+	atexit(snek_trace_finish);
+	snek_tracing = true;
+	return true;
+}
+
+#endif
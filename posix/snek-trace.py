@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Summarize an instruction log written by 'snek --trace': how often
+# each instruction ran, on which lines, and which sequences of
+# instructions ran most often, the candidates for fusing.
+#
+
+import sys
+import argparse
+import collections
+
+SNEK_TRACE_VERSION = 1
+SNEK_TRACE_LINE = 0xFF
+SNEK_OP_PUSH = 0x80
+
+
+class SnekTrace:
+    def __init__(self, data):
+        if data[:6] != b"snekt\0" or data[6] != SNEK_TRACE_VERSION:
+            raise ValueError("not a snek trace")
+        self.offset_size = data[7]
+        nop = data[8]
+        pos = 9
+        self.names = []
+        for op in range(nop):
+            n = data[pos]
+            self.names += [data[pos + 1 : pos + 1 + n].decode() or "?"]
+            pos += 1 + n
+        self.data = data[pos:]
+
+    def name(self, op):
+        base = op & ~SNEK_OP_PUSH
+        name = self.names[base] if base < len(self.names) else "?"
+        if op & SNEK_OP_PUSH:
+            name += "^"
+        return name
+
+    # Yield (line, op) for each instruction run
+    def ops(self):
+        data = self.data
+        size = self.offset_size
+        line = 0
+        pos = 0
+        while pos < len(data):
+            op = data[pos]
+            pos += 1
+            if op == SNEK_TRACE_LINE:
+                line = int.from_bytes(data[pos : pos + size], sys.byteorder)
+                pos += size
+            else:
+                yield line, op
+
+
+def histogram(title, counts, top, label):
+    total = sum(counts.values())
+    print("%s, %d total" % (title, total))
+    for key, count in counts.most_common(top):
+        print("%10d %5.1f%%  %s" % (count, count * 100.0 / total, label(key)))
+    print()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--top", type=int, default=20, help="Entries in each histogram")
+    arg_parser.add_argument(
+        "--length", type=int, default=3, help="Longest sequence of instructions to count"
+    )
+    arg_parser.add_argument("trace", help="File written by snek --trace")
+    args = arg_parser.parse_args()
+
+    with open(args.trace, "rb") as f:
+        try:
+            trace = SnekTrace(f.read())
+        except (ValueError, IndexError):
+            print("%s: not a snek trace" % args.trace, file=sys.stderr)
+            sys.exit(1)
+
+    ops = collections.Counter()
+    lines = collections.Counter()
+    line_ops = collections.Counter()
+    sequences = [collections.Counter() for n in range(args.length + 1)]
+    recent = collections.deque(maxlen=args.length)
+    for line, op in trace.ops():
+        ops[op] += 1
+        lines[line] += 1
+        line_ops[(line, op)] += 1
+        recent.append(op)
+        for n in range(2, len(recent) + 1):
+            sequences[n][tuple(recent)[-n:]] += 1
+
+    histogram("instructions", ops, args.top, trace.name)
+    histogram("lines", lines, args.top, lambda line: "line %d" % line)
+    histogram(
+        "instructions by line",
+        line_ops,
+        args.top,
+        lambda key: "line %-5d %s" % (key[0], trace.name(key[1])),
+    )
+    for n in range(2, args.length + 1):
+        histogram(
+            "sequences of %d" % n,
+            sequences[n],
+            args.top,
+            lambda seq: " ".join(trace.name(op) for op in seq),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,9 @@
 #
 
 import sys
+import os
 import argparse
+import tokenize
 
 builtin_id = 1
 
@@ -23,6 +25,8 @@ class SnekBuiltin:
     id = 0
     nformal = 0
     keyword = False
+    filename = ""
+    sim = False
     def __init__(self, name, param):
         global builtin_id
         self.name = name
@@ -57,22 +61,97 @@ class SnekBuiltin:
 
 headers=[]
 builtins = []
+dropped_builtins = []
 
 def add_builtin(name, id):
     global builtins
     builtins += [SnekBuiltin(name, id)]
 
-def load_builtins(filename):
+#
+# Builtins from a simulated file are implemented by stubs which
+# forward to snek_sim_call, so the file's own headers are skipped
+#
+def load_builtins(filename, sim=False):
     global headers
     f = open(filename)
     for line in f.readlines():
         line = line.rstrip()
         if line[0] == '#':
-            if len(line) > 1 and line[1] != ' ':
+            if len(line) > 1 and line[1] != ' ' and not sim:
                 headers += [line]
         else:
             bits = line.split(",")
             add_builtin(bits[0].strip(), bits[1].strip())
+            builtins[-1].filename = filename
+            builtins[-1].sim = sim
+
+#
+# The names a snek program mentions, found with the python tokenizer so
+# that strings and comments are skipped. Dotted names like eeprom.write
+# are returned whole as well as in pieces.
+#
+def source_names(filename):
+    names = set()
+    dotted = None
+    dot = False
+    with open(filename, 'rb') as f:
+        try:
+            for token in tokenize.tokenize(f.readline):
+                if token.type == tokenize.NAME:
+                    if dot and dotted:
+                        dotted += "." + token.string
+                    else:
+                        dotted = token.string
+                    names |= {dotted, token.string}
+                    dot = False
+                elif token.type == tokenize.OP and token.string == '.':
+                    dot = True
+                else:
+                    dotted = None
+                    dot = False
+        except (tokenize.TokenError, SyntaxError) as e:
+            print("%s: %s" % (filename, e), file=sys.stderr)
+            sys.exit(1)
+    return names
+
+#
+# Builtins which are kept even when no program names them: print
+# and reset are what people type at the prompt, and snekde drives
+# the eeprom through eeprom.show, eeprom.write and eeprom.load
+#
+always_builtins = {"print", "reset", "eeprom.write", "eeprom.load", "eeprom.show"}
+
+#
+# Drop builtin functions which are not named in any of the
+# program sources, nor in always_builtins or 'keep', and renumber
+# the survivors so that the function table stays dense. Keywords
+# and the name-only (-2) entries are always kept as the parser and
+# C code refer to them.
+#
+def trim_builtins(sources, keep=()):
+    global builtins, builtin_id, dropped_builtins
+    used = always_builtins | set(keep)
+    for source in sources:
+        used |= source_names(source)
+    dropped = []
+    kept = []
+    for name in builtins:
+        if is_func(name) and name.name not in used:
+            dropped += [name]
+        else:
+            kept += [name]
+    builtins = kept
+    dropped_builtins = dropped
+    builtin_id = 1
+    for name in builtins:
+        if not name.keyword:
+            name.id = builtin_id
+            builtin_id += 1
+
+def dump_link_list(fp):
+    for name in sorted(builtins):
+        if is_func(name):
+            print("%s" % name.func_name(), file=fp)
 
 def dump_headers(fp):
     for line in headers:
@@ -113,7 +192,9 @@ def max_args():
     return max
 
 def dump_decls(fp):
-    for name in sorted(builtins):
+    # Dropped builtins are still declared so that their
+    # implementations continue to compile cleanly
+    for name in sorted(builtins + dropped_builtins):
         if name.keyword or name.nformal == -2:
             continue
         print("extern snek_poly_t", file=fp)
@@ -129,6 +210,37 @@ def dump_decls(fp):
                     print(", ", end='', file=fp)
         print(");", file=fp)
         print(file=fp)
+    if any(name.sim for name in builtins):
+        print("extern snek_poly_t", file=fp)
+        print("snek_sim_call(snek_id_t id, uint8_t nargs, snek_poly_t *args);", file=fp)
+        print(file=fp)
+
+def dump_stubs(fp):
+    print("/* Generated by snek-builtin.py. Forwards simulated builtins to snek_sim_call */", file=fp)
+    print(file=fp)
+    print("#include \"snek.h\"", file=fp)
+    for name in sorted(builtins):
+        if not name.sim or not is_func(name):
+            continue
+        print(file=fp)
+        print("snek_poly_t", file=fp)
+        print("%s(" % name.func_name(), file=fp, end='')
+        if name.nformal == -1:
+            print("uint8_t nposition, uint8_t nnamed, snek_poly_t *args)", file=fp)
+            print("{", file=fp)
+            print("\t(void) nnamed;", file=fp)
+            print("\treturn snek_sim_call(%s, nposition, args);" % name.cpp_name(), file=fp)
+        elif name.nformal == 0:
+            print("void)", file=fp)
+            print("{", file=fp)
+            print("\treturn snek_sim_call(%s, 0, NULL);" % name.cpp_name(), file=fp)
+        else:
+            formals = ["a%d" % a for a in range(name.nformal)]
+            print("%s)" % ", ".join(["snek_poly_t %s" % a for a in formals]), file=fp)
+            print("{", file=fp)
+            print("\treturn snek_sim_call(%s, %d, (snek_poly_t []) { %s });" %
+                  (name.cpp_name(), name.nformal, ", ".join(formals)), file=fp)
+        print("}", file=fp)
 
 def dump_builtins(fp):
     print("const snek_builtin_t SNEK_BUILTIN_DECLARE(snek_builtins)[] = {", file=fp)
@@ -152,23 +264,120 @@ def dump_cpp(fp):
     print("#define SNEK_BUILTIN_END %d" % (builtin_id), file=fp)
 
 
+def name_size(name):
+    return len(name.name) + 2
+
+def is_func(name):
+    return not name.keyword and name.nformal != -2
+
+def align(value, alignment):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+def builtin_entry_size(pointer_size, pointer_align):
+    return align(1, pointer_align) + pointer_size
+
+def dump_report(fp, files, pointer_size, pointer_align, budget):
+    entry_size = builtin_entry_size(pointer_size, pointer_align)
+    names_total = 0
+    for name in builtins:
+        names_total += name_size(name)
+
+    # The function table is indexed by id, so it extends to the
+    # largest id of any builtin with a function, including the
+    # holes left by the -2 entries below that id.
+    max_id = 0
+    for name in builtins:
+        if is_func(name) and name.id > max_id:
+            max_id = name.id
+    table_total = max_id * entry_size
+
+    print("Builtin table footprint (pointer size %d, alignment %d)" %
+          (pointer_size, pointer_align), file=fp)
+    print(file=fp)
+    print("%-32s %8s %8s %8s" % ("file", "names", "funcs", "bytes"), file=fp)
+    for filename in files:
+        names = 0
+        funcs = 0
+        for name in builtins:
+            if name.filename != filename:
+                continue
+            names += name_size(name)
+            if is_func(name):
+                funcs += 1
+        print("%-32s %8d %8d %8d" % (filename, names, funcs, names + funcs * entry_size), file=fp)
+    print(file=fp)
+    print("%-32s %8d" % ("snek_builtin_names", names_total), file=fp)
+    print("%-32s %8d (%d entries of %d bytes)" % ("snek_builtins", table_total, max_id, entry_size), file=fp)
+    total = names_total + table_total
+    print("%-32s %8d" % ("total", total), file=fp)
+    if names_total >= 256:
+        print("note: snek_builtin_names exceeds 255 bytes, name indices are 16 bits", file=fp)
+    if budget is not None:
+        if total > budget:
+            print("over budget: %d > %d bytes" % (total, budget), file=fp)
+            return False
+        print("within budget: %d <= %d bytes" % (total, budget), file=fp)
+    return True
+
 def builtin_main():
 
     parser = argparse.ArgumentParser(description="Construct Snek builtin data.")
     parser.add_argument('builtins', metavar='F', nargs='+',
                         help='input files describing builtins')
     parser.add_argument('-o', '--output', dest='output', help='output file')
+    parser.add_argument('--used', dest='used', action='append', default=[],
+                        help='only include builtins named in this snek source (repeatable)')
+    parser.add_argument('--keep', dest='keep', action='append', default=[],
+                        help='also include this builtin when trimming with --used (repeatable)')
+    parser.add_argument('--link-list', dest='link_list',
+                        help='write the names of the retained builtin functions to this file')
+    parser.add_argument('--sim', dest='sim', action='append', default=[],
+                        help='builtin file implemented by the simulator (repeatable)')
+    parser.add_argument('--stubs', action='store_true',
+                        help='generate C stubs for the simulated builtins instead of a header')
+    parser.add_argument('--report', action='store_true',
+                        help='report table sizes instead of generating a header')
+    parser.add_argument('--pointer-size', dest='pointer_size', type=int, default=8,
+                        help='target function pointer size in bytes (default 8)')
+    parser.add_argument('--pointer-align', dest='pointer_align', type=int, default=None,
+                        help='target function pointer alignment (default pointer size)')
+    parser.add_argument('--budget', dest='budget', type=int, default=None,
+                        help='fail when the tables exceed this many bytes')
 
     args=parser.parse_args()
 
+    sim = [os.path.realpath(b) for b in args.sim]
     for b in args.builtins:
-        load_builtins(b)
+        load_builtins(b, os.path.realpath(b) in sim)
+
+    if args.used:
+        trim_builtins(args.used, args.keep)
+
+    if args.link_list:
+        with open(args.link_list, mode='w') as lp:
+            dump_link_list(lp)
 
     fp = sys.stdout
 
     if args.output:
         fp = open(args.output, mode='w')
 
+    if args.stubs:
+        dump_stubs(fp)
+        return
+
+    if args.report:
+        if dropped_builtins:
+            print("dropped %d unused builtins: %s" %
+                  (len(dropped_builtins), " ".join([name.name for name in sorted(dropped_builtins)])),
+                  file=fp)
+        pointer_align = args.pointer_align
+        if pointer_align is None:
+            pointer_align = args.pointer_size
+        if not dump_report(fp, args.builtins, args.pointer_size, pointer_align, args.budget):
+            sys.exit(1)
+        return
+
     print("#ifdef SNEK_BUILTIN_DATA", file=fp)
     print("#undef SNEK_BUILTIN_DATA", file=fp)
     print("#ifndef SNEK_BUILTIN_NAMES_DECLARE", file=fp)
@@ -14,7 +14,7 @@
 
 #include "snek.h"
 
-static uint8_t
+uint8_t
 snek_op_extra_size(snek_op_t op)
 {
 	switch (op) {
@@ -26,8 +26,10 @@ snek_op_extra_size(snek_op_t op)
 	case snek_op_list:
 	case snek_op_tuple:
 		return sizeof (snek_offset_t);
-	case snek_op_id:
 	case snek_op_global:
+	case snek_op_name:
+		return sizeof (snek_id_t);
+	case snek_op_id:
 	case snek_op_assign:
 	case snek_op_assign_named:
 	case snek_op_assign_plus:
@@ -42,7 +44,10 @@ snek_op_extra_size(snek_op_t op)
 	case snek_op_assign_lxor:
 	case snek_op_assign_lshift:
 	case snek_op_assign_rshift:
-		return sizeof (snek_id_t);
+		return sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	case snek_op_local:
+	case snek_op_assign_local:
+		return sizeof (snek_offset_t) + SNEK_CACHE_SIZE;
 	case snek_op_call:
 		return sizeof (snek_offset_t);
 	case snek_op_slice:
@@ -54,9 +59,27 @@ snek_op_extra_size(snek_op_t op)
 	case snek_op_line:
 		return sizeof (snek_offset_t);
 	case snek_op_range_start:
+		return sizeof (snek_offset_t) + sizeof (uint8_t);
 	case snek_op_range_step:
 	case snek_op_in_step:
-		return sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof (snek_id_t);
+		return sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	case snek_op_in_start:
+	case snek_op_in_end:
+		return sizeof (uint8_t);
+	case snek_op_int_binary:
+		return sizeof (uint8_t) + sizeof (int8_t);
+	case snek_op_compare_branch:
+		return sizeof (snek_offset_t) + sizeof (uint8_t);
+	case snek_op_int_compare_branch:
+		return sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof (int8_t);
+	case snek_op_id_array:
+		return sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	case snek_op_local_array:
+		return sizeof (snek_offset_t) + SNEK_CACHE_SIZE;
+	case snek_op_id_int_assign:
+		return sizeof (snek_id_t) + SNEK_CACHE_SIZE + sizeof (uint8_t) + sizeof (int8_t);
+	case snek_op_local_int_assign:
+		return sizeof (snek_offset_t) + SNEK_CACHE_SIZE + sizeof (uint8_t) + sizeof (int8_t);
 	default:
 		return 0;
 	}
@@ -68,7 +91,7 @@ snek_op_extra_size(snek_op_t op)
 #define dbg(a, args...) fprintf(stderr, a, ##args)
 #define stddbg stderr
 
-#if defined(DEBUG_COMPILE) || defined(DEBUG_EXEC)
+#if defined(DEBUG_COMPILE) || defined(DEBUG_EXEC) || SNEK_COUNT_PAIRS || SNEK_TRACE
 
 const char * const snek_op_names[] = {
 	[snek_op_plus] = "plus",
@@ -103,6 +126,7 @@ const char * const snek_op_names[] = {
 	[snek_op_list] = "list",
 	[snek_op_tuple] = "tuple",
 	[snek_op_id] = "id",
+	[snek_op_local] = "local",
 
 
 	[snek_op_not] = "not",
@@ -129,8 +153,10 @@ const char * const snek_op_names[] = {
 
 	[snek_op_assign] = "assign",
 	[snek_op_assign_named] = "assign_named",
+	[snek_op_assign_local] = "assign_local",
 
 	[snek_op_global] = "global",
+	[snek_op_name] = "name",
 
 	[snek_op_branch] = "branch",
 	[snek_op_branch_true] = "branch_true",
@@ -138,12 +164,26 @@ const char * const snek_op_names[] = {
 	[snek_op_forward] = "forward",
 	[snek_op_range_start] = "range_start",
 	[snek_op_range_step] = "range_step",
+	[snek_op_in_start] = "in_start",
 	[snek_op_in_step] = "in_step",
+	[snek_op_in_end] = "in_end",
 	[snek_op_null] = "null",
 	[snek_op_nop] = "nop",
 	[snek_op_line] = "line",
+
+	[snek_op_int_binary] = "int_binary",
+	[snek_op_compare_branch] = "compare_branch",
+	[snek_op_int_compare_branch] = "int_compare_branch",
+	[snek_op_id_array] = "id_array",
+	[snek_op_local_array] = "local_array",
+	[snek_op_id_int_assign] = "id_int_assign",
+	[snek_op_local_int_assign] = "local_int_assign",
 };
 
+#endif
+
+#if defined(DEBUG_COMPILE) || defined(DEBUG_EXEC)
+
 static snek_offset_t
 snek_code_dump_instruction(snek_code_t *code, snek_offset_t ip)
 {
@@ -169,7 +209,7 @@ snek_code_dump_instruction(snek_code_t *code, snek_offset_t ip)
 		break;
 	case snek_op_string:
 		memcpy(&o, &code->code[ip], sizeof(snek_offset_t));
-		dbg("%s\n", (char *) snek_pool_addr(o));
+		dbg("%s\n", snek_poly_to_string(snek_offset_to_poly(o, snek_string)));
 		break;
 	case snek_op_list:
 	case snek_op_tuple:
@@ -177,7 +217,9 @@ snek_code_dump_instruction(snek_code_t *code, snek_offset_t ip)
 		dbg("%u\n", o);
 		break;
 	case snek_op_id:
+	case snek_op_id_array:
 	case snek_op_global:
+	case snek_op_name:
 	case snek_op_assign:
 	case snek_op_assign_named:
 	case snek_op_assign_plus:
@@ -203,6 +245,43 @@ snek_code_dump_instruction(snek_code_t *code, snek_offset_t ip)
 		} else
 			dbg("<array>\n");
 		break;
+	case snek_op_local:
+	case snek_op_local_array:
+		memcpy(&o, &code->code[ip], sizeof(snek_offset_t));
+		dbg("slot %d\n", o);
+		break;
+	case snek_op_int_binary:
+		memcpy(&i8, &code->code[ip + 1], sizeof(int8_t));
+		dbg("%s %d\n", snek_op_names[code->code[ip]], i8);
+		break;
+	case snek_op_id_int_assign:
+	case snek_op_local_int_assign:
+		if (op == snek_op_id_int_assign) {
+			memcpy(&id, &code->code[ip], sizeof (snek_id_t));
+			dbg("%s", snek_name_string(id));
+			ip += sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+		} else {
+			memcpy(&o, &code->code[ip], sizeof (snek_offset_t));
+			dbg("slot %d", o);
+			ip += sizeof (snek_offset_t) + SNEK_CACHE_SIZE;
+		}
+		memcpy(&i8, &code->code[ip + 1], sizeof(int8_t));
+		dbg(" %s %d\n", snek_op_names[code->code[ip]], i8);
+		break;
+	case snek_op_compare_branch:
+	case snek_op_int_compare_branch:
+		memcpy(&o, &code->code[ip], sizeof (snek_offset_t));
+		dbg("%s", snek_op_names[code->code[ip + sizeof (snek_offset_t)]]);
+		if (op == snek_op_int_compare_branch) {
+			memcpy(&i8, &code->code[ip + sizeof (snek_offset_t) + 1], sizeof(int8_t));
+			dbg(" %d", i8);
+		}
+		dbg(" %d\n", o);
+		break;
+	case snek_op_assign_local:
+		memcpy(&o, &code->code[ip], sizeof(snek_offset_t));
+		dbg("%s slot %d\n", snek_op_names[o >> 8], o & 0xff);
+		break;
 	case snek_op_call:
 		memcpy(&o, &code->code[ip], sizeof(snek_offset_t));
 		dbg("%d actuals\n", o);
@@ -221,6 +300,14 @@ snek_code_dump_instruction(snek_code_t *code, snek_offset_t ip)
 		dbg("%d\n", o);
 		break;
 	case snek_op_range_start:
+		memcpy(&o, &code->code[ip], sizeof (snek_offset_t));
+		memcpy(&u8, &code->code[ip + sizeof (snek_offset_t)], sizeof(uint8_t));
+		dbg("%d %d\n", o, u8);
+		break;
+	case snek_op_in_start:
+	case snek_op_in_end:
+		dbg("%d\n", code->code[ip]);
+		break;
 	case snek_op_in_step:
 	case snek_op_range_step:
 		memcpy(&o, &code->code[ip], sizeof (snek_offset_t));
@@ -253,24 +340,64 @@ snek_offset_t		snek_compile_prev, snek_compile_prev_prev;
 
 static snek_offset_t	compile_alloc;
 
-#define COMPILE_INC	32
-
 static void
 compile_extend(snek_offset_t n, void *data)
 {
 	if (snek_compile_size + n > compile_alloc) {
-		uint8_t *new_compile = snek_alloc(compile_alloc + COMPILE_INC);
-		if (!new_compile)
-			return;
-		memcpy(new_compile, snek_compile, snek_compile_size);
-		compile_alloc += COMPILE_INC;
-		snek_compile = new_compile;
+		snek_offset_t	need = snek_compile_size + n;
+		snek_offset_t	alloc = compile_alloc + (compile_alloc >> SNEK_COMPILE_SHIFT);
+
+		if (alloc < compile_alloc + SNEK_COMPILE_INC)
+			alloc = compile_alloc + SNEK_COMPILE_INC;
+		if (alloc < need)
+			alloc = need;
+
+		/* Grow in place when the buffer is at the top of the heap */
+		if (!snek_compile || !snek_alloc_grow(snek_compile, compile_alloc, alloc)) {
+			snek_alloc_kind(code);
+			uint8_t *new_compile = snek_try_alloc(alloc);
+			if (!new_compile) {
+				alloc = need;
+				snek_alloc_kind(code);
+				new_compile = snek_alloc(alloc);
+				if (!new_compile)
+					return;
+			}
+			memcpy(new_compile, snek_compile, snek_compile_size);
+			snek_compile = new_compile;
+		}
+		compile_alloc = alloc;
 	}
 	if (data)
 		memcpy(snek_compile + snek_compile_size, data, n);
 	snek_compile_size += n;
 }
 
+#if SNEK_OPTIMIZE
+/*
+ * Make room for 'n' bytes past the end of the code without adding
+ * them. Unlike compile_extend, running out of memory isn't an error.
+ */
+static uint8_t *
+compile_room(snek_offset_t n)
+{
+	snek_offset_t	need = snek_compile_size + n;
+
+	if (need > compile_alloc) {
+		if (!snek_alloc_grow(snek_compile, compile_alloc, need)) {
+			snek_alloc_kind(code);
+			uint8_t *new_compile = snek_try_alloc(need);
+			if (!new_compile)
+				return NULL;
+			memcpy(new_compile, snek_compile, snek_compile_size);
+			snek_compile = new_compile;
+		}
+		compile_alloc = need;
+	}
+	return snek_compile + snek_compile_size;
+}
+#endif
+
 void
 snek_code_delete_prev(void)
 {
@@ -309,7 +436,7 @@ snek_code_add_string(char *string)
 	snek_code_add_op(snek_op_string);
 	strpos = snek_compile_size;
 	compile_extend(sizeof (snek_offset_t), NULL);
-	s = snek_pool_offset(snek_stack_pop_string());
+	s = snek_poly_to_offset(snek_stack_pop());
 	memcpy(snek_compile + strpos, &s, sizeof (snek_offset_t));
 }
 
@@ -320,6 +447,18 @@ snek_code_add_op_offset(snek_op_t op, snek_offset_t o)
 	compile_extend(sizeof (snek_offset_t), &o);
 }
 
+void
+snek_code_add_op_id(snek_op_t op, snek_id_t id)
+{
+	snek_code_add_op_offset(op, id);
+#if SNEK_CACHE
+	if (op != snek_op_global && op != snek_op_name) {
+		static const snek_cache_t empty = { .version = 0 };
+		compile_extend(sizeof (snek_cache_t), (void *) &empty);
+	}
+#endif
+}
+
 void
 snek_code_add_forward(snek_forward_t forward)
 {
@@ -343,41 +482,77 @@ snek_code_add_slice(bool has_start, bool has_end, bool has_stride)
 	compile_extend(1, &param);
 }
 
+/*
+ * Each loop keeps its state in SNEK_LOOP_STATE slots, found at
+ * for_depth * SNEK_LOOP_STATE in top-level code. Function code gives
+ * them frame slots under these names, which no program can use.
+ */
 static snek_id_t
-snek_for_tmp(uint8_t for_depth, uint8_t i)
+snek_for_tmp(uint8_t state)
 {
-	return SNEK_OFFSET_NONE - 1 - (for_depth * 2 + i);
+	return SNEK_OFFSET_NONE - 1 - state;
+}
+
+static uint8_t
+snek_code_loop_state(uint8_t for_depth)
+{
+	if (for_depth >= 256 / SNEK_LOOP_STATE)
+		snek_error("loops nested too deeply");
+	return for_depth * SNEK_LOOP_STATE;
+}
+
+static void
+snek_code_add_loop_var(snek_id_t id)
+{
+	compile_extend(sizeof (snek_id_t), &id);
+#if SNEK_CACHE
+	static const snek_cache_t empty = { .version = 0 };
+	compile_extend(sizeof (snek_cache_t), (void *) &empty);
+#endif
 }
 
 void
 snek_code_add_in_range(snek_id_t id, snek_offset_t nactual, uint8_t for_depth)
 {
+	uint8_t state = snek_code_loop_state(for_depth);
+
 	snek_code_add_op(snek_op_range_start);
 	compile_extend(sizeof (snek_offset_t), &nactual);
-	compile_extend(sizeof(uint8_t), &for_depth);
-	compile_extend(sizeof (snek_id_t), &id);
+	compile_extend(sizeof(uint8_t), &state);
 
 	snek_code_add_op(snek_op_range_step);
 	compile_extend(sizeof(snek_offset_t), NULL);
-	compile_extend(sizeof(uint8_t), &for_depth);
-	compile_extend(sizeof (snek_id_t), &id);
+	compile_extend(sizeof(uint8_t), &state);
+	snek_code_add_loop_var(id);
 }
 
 void
 snek_code_add_in_enum(snek_id_t id, uint8_t for_depth)
 {
-	snek_id_t	list;
-	snek_id_t	i;
+	uint8_t state = snek_code_loop_state(for_depth);
 
-	list = snek_for_tmp(for_depth, 0);
-	i = snek_for_tmp(for_depth, 1);
-	snek_code_add_op_id(snek_op_assign, list);
-	snek_code_add_number(0.0f);
-	snek_code_add_op_id(snek_op_assign, i);
+	snek_code_add_op(snek_op_in_start);
+	compile_extend(sizeof(uint8_t), &state);
 	snek_code_add_op(snek_op_in_step);
 	compile_extend(sizeof(snek_offset_t), NULL);
-	compile_extend(sizeof(uint8_t), &for_depth);
-	compile_extend(sizeof(snek_id_t), &id);
+	compile_extend(sizeof(uint8_t), &state);
+	snek_code_add_loop_var(id);
+}
+
+/*
+ * A 'for ... in' loop left through 'break' still holds the iterable
+ * in its state. Where the breaks land, add in_end to let go of it.
+ */
+void
+snek_code_add_loop_end(snek_offset_t top_off)
+{
+	uint8_t	state;
+
+	if ((snek_compile[top_off] & ~snek_op_push) != snek_op_in_step)
+		return;
+	state = snek_compile[top_off + 1 + sizeof (snek_offset_t)];
+	snek_code_add_op(snek_op_in_end);
+	compile_extend(sizeof(uint8_t), &state);
 }
 
 void
@@ -386,10 +561,12 @@ snek_code_patch_branch(snek_offset_t branch, snek_offset_t target)
 	memcpy(snek_compile + branch + 1, &target, sizeof (snek_offset_t));
 }
 
-void
+/* Returns whether any forward was patched */
+bool
 snek_code_patch_forward(snek_offset_t start, snek_offset_t stop, snek_forward_t forward, snek_offset_t target)
 {
 	snek_offset_t ip = start;
+	bool patched = false;
 
 	while (ip < stop) {
 		snek_op_t op = snek_compile[ip++];
@@ -402,6 +579,7 @@ snek_code_patch_forward(snek_offset_t start, snek_offset_t stop, snek_forward_t
 			if ((snek_forward_t) f == forward) {
 				snek_compile[ip-1] = snek_op_branch | push;
 				memcpy(&snek_compile[ip], &target, sizeof(snek_offset_t));
+				patched = true;
 			}
 			break;
 		default:
@@ -409,14 +587,539 @@ snek_code_patch_forward(snek_offset_t start, snek_offset_t stop, snek_forward_t
 		}
 		ip += snek_op_extra_size(op);
 	}
+	return patched;
+}
+
+#if SNEK_OPTIMIZE
+
+/*
+ * Rewrite the finished code in place. Instructions are never grown;
+ * bytes no longer needed are overwritten with nops, which are
+ * squeezed out at the end while adjusting branch targets to match.
+ */
+
+static snek_poly_t
+snek_binary(snek_poly_t a, snek_op_t op, snek_poly_t b, bool inplace);
+
+static bool
+snek_op_is_branch(snek_op_t op)
+{
+	switch (op) {
+	case snek_op_branch:
+	case snek_op_branch_true:
+	case snek_op_branch_false:
+	case snek_op_range_step:
+	case snek_op_in_step:
+	case snek_op_compare_branch:
+	case snek_op_int_compare_branch:
+		return true;
+	default:
+		return false;
+	}
+}
+
+static snek_offset_t
+snek_opt_next(snek_offset_t ip)
+{
+	return ip + 1 + snek_op_extra_size(snek_compile[ip] & ~snek_op_push);
+}
+
+/* skip nops which don't push */
+static snek_offset_t
+snek_opt_skip(snek_offset_t ip)
+{
+	while (ip < snek_compile_size && snek_compile[ip] == snek_op_nop)
+		ip++;
+	return ip;
+}
+
+static snek_offset_t
+snek_opt_target(snek_offset_t ip)
+{
+	snek_offset_t	target;
+
+	memcpy(&target, &snek_compile[ip + 1], sizeof (snek_offset_t));
+	return target;
+}
+
+static void
+snek_opt_set_target(snek_offset_t ip, snek_offset_t target)
+{
+	memcpy(&snek_compile[ip + 1], &target, sizeof (snek_offset_t));
+}
+
+/*
+ * One bit for each byte of code, set where some branch lands. It
+ * sits past the code in the compile buffer, which stays put as
+ * nothing is allocated while optimizing. NULL when there wasn't room,
+ * in which case the branches are searched each time.
+ */
+static uint8_t	*snek_opt_map;
+
+/*
+ * Mark where each branch lands. Passes which move branch targets
+ * must call this again afterwards; deleting branches leaves extra
+ * marks, which only stop some optimizations
+ */
+static void
+snek_opt_find_targets(void)
+{
+	snek_offset_t	ip, target;
+
+	if (!snek_opt_map)
+		return;
+	memset(snek_opt_map, '\0', (snek_compile_size + 7) >> 3);
+	for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip)) {
+		if (snek_op_is_branch(snek_compile[ip] & ~snek_op_push)) {
+			target = snek_opt_target(ip);
+			if (target < snek_compile_size)
+				snek_opt_map[target >> 3] |= 1 << (target & 7);
+		}
+	}
+}
+
+/* Does any branch land in [start, end)? */
+static bool
+snek_opt_targets(snek_offset_t start, snek_offset_t end)
+{
+	snek_offset_t	ip, target;
+
+	if (snek_opt_map) {
+		for (ip = start; ip < end; ip++)
+			if (snek_opt_map[ip >> 3] & (1 << (ip & 7)))
+				return true;
+		return false;
+	}
+	for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip)) {
+		if (snek_op_is_branch(snek_compile[ip] & ~snek_op_push)) {
+			target = snek_opt_target(ip);
+			if (start <= target && target < end)
+				return true;
+		}
+	}
+	return false;
+}
+
+static void
+snek_opt_delete(snek_offset_t start, snek_offset_t end)
+{
+	memset(&snek_compile[start], snek_op_nop, end - start);
+}
+
+static bool
+snek_opt_number(snek_offset_t ip, float *f)
+{
+	switch (snek_compile[ip] & ~snek_op_push) {
+	case snek_op_int:
+		*f = (int8_t) snek_compile[ip + 1];
+		return true;
+	case snek_op_num:
+		memcpy(f, &snek_compile[ip + 1], sizeof (float));
+		return true;
+	default:
+		return false;
+	}
+}
+
+/* Replace [start, end) with a number, if there's room */
+static bool
+snek_opt_set_number(snek_offset_t start, snek_offset_t end, float f, uint8_t push)
+{
+	int8_t		i8 = (int8_t) f;
+	bool		is_int = (float) i8 == f && !(f == 0 && signbit(f));
+	snek_offset_t	size = 1 + (is_int ? sizeof (int8_t) : sizeof (float));
+
+	if ((snek_offset_t) (end - start) < size)
+		return false;
+	if (is_int) {
+		snek_compile[start] = snek_op_int | push;
+		snek_compile[start + 1] = (uint8_t) i8;
+	} else {
+		snek_compile[start] = snek_op_num | push;
+		memcpy(&snek_compile[start + 1], &f, sizeof (float));
+	}
+	snek_opt_delete(start + size, end);
+	return true;
+}
+
+/*
+ * Evaluate numeric unary and binary operations on constants
+ */
+static bool
+snek_opt_fold(snek_offset_t ip)
+{
+	snek_offset_t	op_ip, end;
+	snek_op_t	op;
+	float		a, b;
+
+	if (!snek_opt_number(ip, &a))
+		return false;
+	op_ip = snek_opt_skip(snek_opt_next(ip));
+	if (op_ip >= snek_compile_size)
+		return false;
+	op = snek_compile[op_ip] & ~snek_op_push;
+	if (op == snek_op_uminus || op == snek_op_lnot) {
+		if (snek_compile[ip] & snek_op_push)
+			return false;
+		if (op == snek_op_uminus)
+			a = -a;
+		else
+			a = ~(uint32_t) a;
+	} else {
+		if (!(snek_compile[ip] & snek_op_push) || !snek_opt_number(op_ip, &b))
+			return false;
+		if (snek_compile[op_ip] & snek_op_push)
+			return false;
+		op_ip = snek_opt_skip(snek_opt_next(op_ip));
+		if (op_ip >= snek_compile_size)
+			return false;
+		op = snek_compile[op_ip] & ~snek_op_push;
+		if (op < snek_op_plus || snek_op_rshift < op)
+			return false;
+		if ((op == snek_op_div || op == snek_op_mod) && (int32_t) b == 0)
+			return false;
+		a = snek_poly_to_float(snek_binary(snek_float_to_poly(a), op,
+						   snek_float_to_poly(b), false));
+	}
+	end = snek_opt_next(op_ip);
+	if (snek_opt_targets(ip + 1, end))
+		return false;
+	return snek_opt_set_number(ip, end, a, snek_compile[op_ip] & snek_op_push);
+}
+
+/*
+ * Is snek_a overwritten at ip before anything looks at it?
+ */
+static bool
+snek_opt_a_dead(snek_offset_t ip)
+{
+	for (;;) {
+		ip = snek_opt_skip(ip);
+		if (ip >= snek_compile_size)
+			return false;
+		switch (snek_compile[ip] & ~snek_op_push) {
+		case snek_op_line:
+			ip = snek_opt_next(ip);
+			break;
+		case snek_op_num:
+		case snek_op_int:
+		case snek_op_string:
+		case snek_op_id:
+		case snek_op_null:
+			return true;
+		default:
+			return false;
+		}
+	}
+}
+
+/*
+ * Replace 'not' followed by a conditional branch with the opposite
+ * branch, when nothing uses the value of the 'not' afterwards
+ */
+static void
+snek_opt_invert(snek_offset_t ip)
+{
+	snek_offset_t	branch;
+	snek_op_t	op;
+
+	if (snek_compile[ip] != snek_op_not)
+		return;
+	branch = snek_opt_skip(snek_opt_next(ip));
+	if (branch >= snek_compile_size)
+		return;
+	op = snek_compile[branch];
+	if (op != snek_op_branch_true && op != snek_op_branch_false)
+		return;
+	if (snek_opt_targets(ip + 1, branch + 1))
+		return;
+	if (!snek_opt_a_dead(snek_opt_target(branch)) ||
+	    !snek_opt_a_dead(snek_opt_next(branch)))
+		return;
+	snek_compile[branch] = op == snek_op_branch_true ? snek_op_branch_false : snek_op_branch_true;
+	snek_opt_delete(ip, ip + 1);
+}
+
+#define SNEK_OPT_MAX_HOPS	8
+
+/*
+ * Send branches which land on an unconditional branch, or on another
+ * branch taken for the same value, straight to the final target
+ */
+static void
+snek_opt_thread(snek_offset_t ip)
+{
+	snek_op_t	op = snek_compile[ip] & ~snek_op_push;
+	snek_offset_t	target, t;
+	uint8_t		hops;
+
+	if (op != snek_op_branch && op != snek_op_branch_true && op != snek_op_branch_false)
+		return;
+	target = snek_opt_target(ip);
+	for (hops = 0; hops < SNEK_OPT_MAX_HOPS; hops++) {
+		t = snek_opt_skip(target);
+		if (t >= snek_compile_size)
+			break;
+		if (snek_compile[t] != snek_op_branch &&
+		    (op == snek_op_branch || snek_compile[t] != op))
+			break;
+		target = snek_opt_target(t);
+	}
+	snek_opt_set_target(ip, target);
+}
+
+/*
+ * Remove code following an unconditional branch which no branch
+ * lands in, and branches to the following instruction
+ */
+static void
+snek_opt_dead(snek_offset_t ip)
+{
+	snek_op_t	op = snek_compile[ip];
+	snek_offset_t	next = snek_opt_next(ip);
+	snek_offset_t	o, o_next;
+
+	if ((op & ~snek_op_push) == snek_op_branch) {
+		for (o = next; o < snek_compile_size && !snek_opt_targets(o, o + 1); o = o_next) {
+			o_next = snek_opt_next(o);
+			snek_opt_delete(o, o_next);
+		}
+	}
+	if ((op == snek_op_branch || op == snek_op_branch_true || op == snek_op_branch_false) &&
+	    snek_opt_skip(next) == snek_opt_skip(snek_opt_target(ip)))
+		snek_opt_delete(ip, next);
+}
+
+#if SNEK_FUSE
+
+static bool
+snek_op_is_compare(snek_op_t op)
+{
+	return op <= snek_op_le;
+}
+
+/*
+ * Replace [start, end) with a fused instruction made from op, the
+ * push flag of the last instruction replaced, and the operand
+ * bytes, if nothing branches inside
+ */
+static void
+snek_opt_set_fused(snek_offset_t start, snek_offset_t end, snek_op_t op, const uint8_t *operand)
+{
+	snek_offset_t	last, size = snek_op_extra_size(op);
+
+	if (snek_opt_targets(start + 1, end))
+		return;
+	for (last = start; snek_opt_skip(snek_opt_next(last)) < end; last = snek_opt_skip(snek_opt_next(last)))
+		;
+	snek_compile[start] = op | (snek_compile[last] & snek_op_push);
+	memmove(&snek_compile[start + 1], operand, size);
+	snek_opt_delete(start + 1 + size, end);
+}
+
+/*
+ * Fuse
+ *
+ *	int, binary op			-> int_binary
+ *	compare, branch_false		-> compare_branch
+ *	int, compare, branch_false	-> int_compare_branch
+ *	id, array			-> id_array
+ *	id^ x, int, binary op, assign x	-> id_int_assign
+ */
+static void
+snek_opt_fuse(snek_offset_t ip)
+{
+	snek_op_t	op = snek_compile[ip];
+	snek_offset_t	second, third, fourth;
+	snek_op_t	second_op;
+	uint8_t		operand[sizeof (snek_id_t) + SNEK_CACHE_SIZE + 2];
+
+	if (op == (snek_op_id | snek_op_push)) {
+		second = snek_opt_skip(snek_opt_next(ip));
+		if (second >= snek_compile_size || snek_compile[second] != snek_op_int)
+			return;
+		third = snek_opt_skip(snek_opt_next(second));
+		if (third >= snek_compile_size || snek_compile[third] > snek_op_rshift)
+			return;
+		fourth = snek_opt_skip(snek_opt_next(third));
+		if (fourth >= snek_compile_size ||
+		    (snek_compile[fourth] & ~snek_op_push) != snek_op_assign ||
+		    memcmp(&snek_compile[fourth + 1], &snek_compile[ip + 1], sizeof (snek_id_t)) != 0)
+			return;
+		memcpy(operand, &snek_compile[ip + 1], sizeof (snek_id_t) + SNEK_CACHE_SIZE);
+		operand[sizeof (snek_id_t) + SNEK_CACHE_SIZE] = snek_compile[third];
+		operand[sizeof (snek_id_t) + SNEK_CACHE_SIZE + 1] = snek_compile[second + 1];
+		snek_opt_set_fused(ip, snek_opt_next(fourth), snek_op_id_int_assign, operand);
+		return;
+	}
+	if (op != snek_op_int && op != snek_op_id && !snek_op_is_compare(op))
+		return;
+	second = snek_opt_skip(snek_opt_next(ip));
+	if (second >= snek_compile_size)
+		return;
+	second_op = snek_compile[second];
+	switch (op) {
+	case snek_op_int:
+		if ((second_op & ~snek_op_push) > snek_op_rshift)
+			return;
+		third = snek_opt_skip(snek_opt_next(second));
+		if (snek_op_is_compare(second_op) && third < snek_compile_size &&
+		    snek_compile[third] == snek_op_branch_false)
+		{
+			memcpy(operand, &snek_compile[third + 1], sizeof (snek_offset_t));
+			operand[sizeof (snek_offset_t)] = second_op;
+			operand[sizeof (snek_offset_t) + 1] = snek_compile[ip + 1];
+			snek_opt_set_fused(ip, snek_opt_next(third), snek_op_int_compare_branch, operand);
+		} else {
+			operand[0] = second_op & ~snek_op_push;
+			operand[1] = snek_compile[ip + 1];
+			snek_opt_set_fused(ip, snek_opt_next(second), snek_op_int_binary, operand);
+		}
+		break;
+	case snek_op_id:
+		if ((second_op & ~snek_op_push) != snek_op_array)
+			return;
+		snek_opt_set_fused(ip, snek_opt_next(second), snek_op_id_array, &snek_compile[ip + 1]);
+		break;
+	default:
+		if (second_op != snek_op_branch_false)
+			return;
+		memcpy(operand, &snek_compile[second + 1], sizeof (snek_offset_t));
+		operand[sizeof (snek_offset_t)] = op;
+		snek_opt_set_fused(ip, snek_opt_next(second), snek_op_compare_branch, operand);
+		break;
+	}
+}
+
+#endif
+
+/*
+ * Where each marked target ends up once the nops are squeezed out,
+ * as (old, new) pairs in order of the old offset. It follows the map,
+ * with room for a pair for every branch.
+ */
+static uint8_t	*snek_opt_moves;
+
+/* Find the new offset for the branch target at 'target' */
+static snek_offset_t
+snek_opt_moved(snek_offset_t target, snek_offset_t nmove)
+{
+	snek_offset_t	l = 0, r = nmove, m;
+	snek_offset_t	move[2];
+
+	while (l < r) {
+		m = (l + r) >> 1;
+		memcpy(move, &snek_opt_moves[m * sizeof (move)], sizeof (move));
+		if (move[0] == target)
+			return move[1];
+		if (move[0] < target)
+			l = m + 1;
+		else
+			r = m;
+	}
+	return target;
+}
+
+static void
+snek_opt_squeeze(void)
+{
+	snek_offset_t	ip, next, o, to, target, removed;
+
+	if (snek_opt_map) {
+		snek_offset_t	nmove = 0;
+		snek_offset_t	move[2];
+
+		snek_opt_find_targets();
+		removed = 0;
+		for (ip = 0; ip < snek_compile_size; ip = next) {
+			next = snek_opt_next(ip);
+			if (snek_opt_map[ip >> 3] & (1 << (ip & 7))) {
+				move[0] = ip;
+				move[1] = ip - removed;
+				memcpy(&snek_opt_moves[nmove++ * sizeof (move)], move, sizeof (move));
+			}
+			if (snek_compile[ip] == snek_op_nop)
+				removed++;
+		}
+		for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip)) {
+			if (!snek_op_is_branch(snek_compile[ip] & ~snek_op_push))
+				continue;
+			target = snek_opt_target(ip);
+			if (target >= snek_compile_size)
+				snek_opt_set_target(ip, target - removed);
+			else
+				snek_opt_set_target(ip, snek_opt_moved(target, nmove));
+		}
+	} else {
+		for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip)) {
+			if (!snek_op_is_branch(snek_compile[ip] & ~snek_op_push))
+				continue;
+			target = snek_opt_target(ip);
+			removed = 0;
+			for (o = 0; o < target; o = snek_opt_next(o))
+				if (snek_compile[o] == snek_op_nop)
+					removed++;
+			snek_opt_set_target(ip, target - removed);
+		}
+	}
+	for (ip = 0, to = 0; ip < snek_compile_size; ip = next) {
+		next = snek_opt_next(ip);
+		if (snek_compile[ip] != snek_op_nop) {
+			memmove(&snek_compile[to], &snek_compile[ip], next - ip);
+			to += next - ip;
+		}
+	}
+	snek_compile_size = to;
+}
+
+static void
+snek_code_optimize(void)
+{
+	snek_offset_t	ip, nbranch = 0;
+	snek_offset_t	map_size = (snek_compile_size + 7) >> 3;
+	bool		folded;
+
+	for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip))
+		if (snek_op_is_branch(snek_compile[ip] & ~snek_op_push))
+			nbranch++;
+	snek_opt_map = compile_room(map_size + nbranch * 2 * sizeof (snek_offset_t));
+	if (snek_opt_map)
+		snek_opt_moves = snek_opt_map + map_size;
+	snek_opt_find_targets();
+	do {
+		folded = false;
+		for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip))
+			if (snek_opt_fold(ip))
+				folded = true;
+	} while (folded);
+	for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip))
+		snek_opt_invert(ip);
+	for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip))
+		snek_opt_thread(ip);
+	snek_opt_find_targets();
+	for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip))
+		snek_opt_dead(ip);
+#if SNEK_FUSE
+	snek_opt_find_targets();
+	for (ip = 0; ip < snek_compile_size; ip = snek_opt_next(ip))
+		snek_opt_fuse(ip);
+#endif
+	snek_opt_squeeze();
+	snek_opt_map = NULL;
 }
 
+#endif
+
 snek_code_t *
 snek_code_finish(void)
 {
 	if (snek_compile_size == 0)
 		return NULL;
 	snek_code_patch_forward(0, snek_compile_size, snek_forward_return, snek_code_current());
+#if SNEK_OPTIMIZE
+	snek_code_optimize();
+#endif
+	snek_alloc_kind(code);
 	snek_code_t *code = snek_alloc(sizeof (snek_code_t) + snek_compile_size);
 
 	if (code) {
@@ -427,11 +1130,173 @@ snek_code_finish(void)
 #endif
 	}
 	snek_compile_size = 0;
-	compile_alloc = 0;
-	snek_compile = NULL;
+	/*
+	 * Trim the buffer, leaving the collector to reclaim the rest. A
+	 * small one is kept to compile the next piece of code into.
+	 */
+	if (compile_alloc > SNEK_COMPILE_KEEP)
+		compile_alloc = SNEK_COMPILE_KEEP;
+	if (compile_alloc == 0)
+		snek_compile = NULL;
 	return code;
 }
 
+static bool
+snek_code_add_local(snek_id_t id)
+{
+	uint8_t	i;
+
+	for (i = 0; i < snek_parse_nlocal; i++)
+		if (snek_parse_formals[i] == id)
+			return true;
+	if (snek_parse_nlocal == SNEK_MAX_LOCALS) {
+		snek_error("too many locals");
+		return false;
+	}
+	snek_parse_formals[snek_parse_nlocal++] = id;
+	return true;
+}
+
+static snek_soffset_t
+snek_code_find_local(snek_id_t id)
+{
+	uint8_t	i;
+
+	for (i = 0; i < snek_parse_nlocal; i++)
+		if (snek_parse_formals[i] == id)
+			return i;
+	return -1;
+}
+
+/*
+ * Give each formal and each name assigned in a function body a
+ * slot in the frame, appending the locals to snek_parse_formals.
+ * References to those names are rewritten in place to index the
+ * frame directly; the new instructions are the same size.
+ */
+bool
+snek_code_resolve_locals(snek_code_t *code)
+{
+	snek_offset_t	ip;
+	snek_op_t	op;
+	snek_id_t	id;
+	snek_offset_t	o;
+	snek_soffset_t	slot;
+	uint8_t		state, i;
+
+	snek_parse_nlocal = snek_parse_nformal;
+	for (ip = 0; ip < code->size; ip += snek_op_extra_size(op)) {
+		op = code->code[ip++] & ~snek_op_push;
+		switch (op) {
+		case snek_op_assign_plus:
+		case snek_op_assign_minus:
+		case snek_op_assign_times:
+		case snek_op_assign_divide:
+		case snek_op_assign_div:
+		case snek_op_assign_mod:
+		case snek_op_assign_pow:
+		case snek_op_assign_land:
+		case snek_op_assign_lor:
+		case snek_op_assign_lxor:
+		case snek_op_assign_lshift:
+		case snek_op_assign_rshift:
+		case snek_op_assign:
+		case snek_op_assign_named:
+		case snek_op_id_int_assign:
+			memcpy(&id, &code->code[ip], sizeof (snek_id_t));
+			if (id != SNEK_ID_NONE && !snek_code_add_local(id))
+				return false;
+			break;
+		case snek_op_in_start:
+		case snek_op_range_start:
+			state = code->code[ip + (op == snek_op_range_start ? sizeof (snek_offset_t) : 0)];
+			for (i = 0; i < SNEK_LOOP_STATE; i++)
+				if (!snek_code_add_local(snek_for_tmp(state + i)))
+					return false;
+			break;
+		case snek_op_range_step:
+		case snek_op_in_step:
+			memcpy(&id, &code->code[ip + sizeof (snek_offset_t) + sizeof (uint8_t)], sizeof (snek_id_t));
+			if (!snek_code_add_local(id))
+				return false;
+			break;
+		default:
+			break;
+		}
+	}
+
+	for (ip = 0; ip < code->size; ip += snek_op_extra_size(op)) {
+		uint8_t *c = &code->code[ip++];
+		op = *c & ~snek_op_push;
+		switch (op) {
+		case snek_op_id:
+			memcpy(&id, &code->code[ip], sizeof (snek_id_t));
+			slot = snek_code_find_local(id);
+			if (slot < 0)
+				break;
+			*c = snek_op_local | (*c & snek_op_push);
+			o = slot;
+			memcpy(&code->code[ip], &o, sizeof (snek_offset_t));
+			break;
+		case snek_op_id_array:
+			memcpy(&id, &code->code[ip], sizeof (snek_id_t));
+			slot = snek_code_find_local(id);
+			if (slot < 0)
+				break;
+			*c = snek_op_local_array | (*c & snek_op_push);
+			o = slot;
+			memcpy(&code->code[ip], &o, sizeof (snek_offset_t));
+			break;
+		case snek_op_id_int_assign:
+			memcpy(&id, &code->code[ip], sizeof (snek_id_t));
+			*c = snek_op_local_int_assign | (*c & snek_op_push);
+			o = snek_code_find_local(id);
+			memcpy(&code->code[ip], &o, sizeof (snek_offset_t));
+			break;
+		case snek_op_assign_plus:
+		case snek_op_assign_minus:
+		case snek_op_assign_times:
+		case snek_op_assign_divide:
+		case snek_op_assign_div:
+		case snek_op_assign_mod:
+		case snek_op_assign_pow:
+		case snek_op_assign_land:
+		case snek_op_assign_lor:
+		case snek_op_assign_lxor:
+		case snek_op_assign_lshift:
+		case snek_op_assign_rshift:
+		case snek_op_assign:
+		case snek_op_assign_named:
+			memcpy(&id, &code->code[ip], sizeof (snek_id_t));
+			if (id == SNEK_ID_NONE)
+				break;
+			*c = snek_op_assign_local | (*c & snek_op_push);
+			o = (op << 8) | snek_code_find_local(id);
+			memcpy(&code->code[ip], &o, sizeof (snek_offset_t));
+			break;
+		case snek_op_in_start:
+		case snek_op_in_end:
+			code->code[ip] = snek_code_find_local(snek_for_tmp(code->code[ip]));
+			break;
+		case snek_op_range_start:
+		case snek_op_range_step:
+		case snek_op_in_step:
+			/* loop state and variable become frame slots */
+			state = code->code[ip + sizeof (snek_offset_t)];
+			code->code[ip + sizeof (snek_offset_t)] = snek_code_find_local(snek_for_tmp(state));
+			if (op == snek_op_range_start)
+				break;
+			memcpy(&id, &code->code[ip + sizeof (snek_offset_t) + sizeof (uint8_t)], sizeof (snek_id_t));
+			o = snek_code_find_local(id);
+			memcpy(&code->code[ip + sizeof (snek_offset_t) + sizeof (uint8_t)], &o, sizeof (snek_offset_t));
+			break;
+		default:
+			break;
+		}
+	}
+	return true;
+}
+
 snek_offset_t
 snek_code_line(snek_code_t *code)
 {
@@ -522,17 +1387,47 @@ snek_stack_pop_soffset(void)
 	return (snek_soffset_t) snek_stack_pop_float();
 }
 
+static snek_poly_t *
+snek_id_ref_site(snek_id_t id, bool insert, snek_offset_t site);
+
+/*
+ * Set the loop variable of a range_step or in_step instruction,
+ * which is a frame slot in function code and a global otherwise
+ */
+static bool
+snek_loop_assign(snek_offset_t ip, snek_poly_t value)
+{
+	snek_offset_t	var;
+	snek_poly_t	*ref;
+
+	ip += sizeof (snek_offset_t) + sizeof (uint8_t);
+	memcpy(&var, &snek_code->code[ip], sizeof (snek_id_t));
+	if (snek_frame) {
+		snek_variable_t *v = &snek_frame->variables[var];
+		if (!snek_is_global(v->value)) {
+			v->value = value;
+			return true;
+		}
+		var = v->id;
+	}
+	snek_stack_push(value);
+	ref = snek_id_ref_site(var, true, ip + sizeof (snek_id_t));
+	value = snek_stack_pop();
+	if (!ref)
+		return false;
+	*ref = value;
+	return true;
+}
+
 static void
 snek_range_start(snek_offset_t ip)
 {
 	/* Fetch params from instruction */
 	snek_offset_t	nactual;
-	snek_id_t	id;
-	uint8_t		for_depth;
+	uint8_t		slot;
 
 	memcpy(&nactual, &snek_code->code[ip], sizeof(snek_offset_t));
-	memcpy(&id, &snek_code->code[ip + sizeof(snek_offset_t) + sizeof (uint8_t)], sizeof (snek_id_t));
-	memcpy(&for_depth, &snek_code->code[ip + sizeof(snek_offset_t)], sizeof (uint8_t));
+	memcpy(&slot, &snek_code->code[ip + sizeof(snek_offset_t)], sizeof (uint8_t));
 
 	float current = 0.0f;
 	float limit = 0.0f;
@@ -561,70 +1456,54 @@ snek_range_start(snek_offset_t ip)
 		return;
 	}
 
-	/* Assign initial value (current - step) */
-
-	snek_poly_t	*id_ref = snek_id_ref(id, true);
-	if(!id_ref)
+	snek_variable_t *state = snek_loop_state(slot, true);
+	if (!state)
 		return;
-	*id_ref = snek_float_to_poly(current - step);
 
-	/* Save limit */
-	snek_poly_t	*limit_ref = snek_id_ref(snek_for_tmp(for_depth, 0), true);
-	if (!limit_ref)
-		return;
-	*limit_ref = snek_float_to_poly(limit);
-
-	/* Save step */
-	snek_poly_t	*step_ref = snek_id_ref(snek_for_tmp(for_depth, 1), true);
-	if (!step_ref)
-		return;
-	*step_ref = snek_float_to_poly(step);
-
-	return;
+	/* The first step moves to current */
+	state[0].value = snek_float_to_poly(current - step);
+	state[1].value = snek_float_to_poly(limit);
+	state[2].value = snek_float_to_poly(step);
 }
 
 static bool
 snek_range_step(snek_offset_t ip)
 {
-	uint8_t		for_depth;
-	snek_id_t	id;
-
-	memcpy(&for_depth, &snek_code->code[ip + sizeof(snek_offset_t)], sizeof (uint8_t));
-	memcpy(&id, &snek_code->code[ip + sizeof(snek_offset_t) + sizeof (uint8_t)], sizeof (snek_id_t));
+	snek_variable_t *state = snek_loop_state(snek_code->code[ip + sizeof(snek_offset_t)], false);
 
-	snek_poly_t	*id_ref = snek_id_ref(id, false);
-	snek_poly_t	*limit_ref = snek_id_ref(snek_for_tmp(for_depth, 0), false);
-	snek_poly_t	*step_ref = snek_id_ref(snek_for_tmp(for_depth, 1), false);
+	float step = snek_poly_to_float(state[2].value);
+	float value = snek_poly_to_float(state[0].value) + step;
+	float limit = snek_poly_to_float(state[1].value);
 
-	if (!id_ref || !limit_ref || !step_ref)
+	if (step > 0 ? value >= limit : value <= limit)
 		return false;
+	state[0].value = snek_float_to_poly(value);
+	return snek_loop_assign(ip, snek_float_to_poly(value));
+}
 
-	float step = snek_poly_get_float(*step_ref);
-	float value = snek_poly_get_float(*id_ref) + step;
-	*id_ref = snek_float_to_poly(value);
+static void
+snek_in_start(snek_offset_t ip)
+{
+	snek_variable_t *state = snek_loop_state(snek_code->code[ip], true);
 
-	float limit = snek_poly_get_float(*limit_ref);
-	if (step > 0 ? value >= limit : value <= limit)
-		return false;
-	return true;
+	if (!state)
+		return;
+	state[0].value = snek_a;
+	state[1].value = snek_float_to_poly(0.0f);
 }
 
 static bool
 snek_in_step(snek_offset_t ip)
 {
-	uint8_t	for_depth;
-	snek_id_t id;
-	snek_poly_t *ref;
-
-	memcpy(&for_depth, &snek_code->code[ip + sizeof(snek_offset_t)], sizeof(uint8_t));
+	uint8_t		slot = snek_code->code[ip + sizeof(snek_offset_t)];
+	snek_variable_t *state = snek_loop_state(slot, false);
 
 	/* Get current index, save next index */
-	snek_poly_t *i_ref = snek_id_ref(snek_for_tmp(for_depth, 1), false);
-	snek_soffset_t i = snek_poly_get_soffset(*i_ref);
-	*i_ref = snek_float_to_poly(i + 1);
+	snek_soffset_t i = snek_poly_to_float(state[1].value);
+	state[1].value = snek_float_to_poly(i + 1);
 
 	/* Fetch iterable */
-	snek_poly_t array = *snek_id_ref(snek_for_tmp(for_depth, 0), false);
+	snek_poly_t array = state[0].value;
 
 	/* Compute current value */
 	snek_poly_t value = SNEK_NULL;
@@ -640,20 +1519,13 @@ snek_in_step(snek_offset_t ip)
 		snek_error("not iterable: %p", array);
 		return true;
 	}
-	/* End of iteration */
-	if (snek_is_null(value))
+	/* End of iteration, let go of the iterable */
+	if (snek_is_null(value)) {
+		snek_loop_state(slot, false)[0].value = SNEK_NULL;
 		return false;
+	}
 
-	/* Update value */
-	memcpy(&id, &snek_code->code[ip + sizeof(snek_offset_t) + sizeof (uint8_t)], sizeof (snek_id_t));
-
-	snek_stack_push(value);
-	ref = snek_id_ref(id, true);
-	value = snek_stack_pop();
-	if (!ref)
-		return false;
-	*ref = value;
-	return true;
+	return snek_loop_assign(ip, value);
 }
 
 static snek_poly_t
@@ -777,6 +1649,11 @@ snek_binary(snek_poly_t a, snek_op_t op, snek_poly_t b, bool inplace)
 			break;
 		case snek_op_plus:
 			if (at == snek_string && bt == snek_string) {
+#if SNEK_STRING_GROW
+				if (inplace)
+					ret = snek_string_append(a, snek_poly_to_string(b));
+				else
+#endif
 				ret = snek_string_cat(snek_poly_to_string(a),
 						      snek_poly_to_string(b));
 			} else if (at == snek_list && bt == snek_list) {
@@ -887,8 +1764,19 @@ snek_undefined(snek_id_t id)
 	snek_error("undefined: %s", snek_name_string(id));
 }
 
+static snek_poly_t *
+snek_id_ref_site(snek_id_t id, bool insert, snek_offset_t site)
+{
+#if SNEK_CACHE
+	return snek_global_ref_cache(id, insert, site);
+#else
+	(void) site;
+	return snek_id_ref(id, insert);
+#endif
+}
+
 static void
-snek_assign(snek_id_t id, snek_op_t op)
+snek_assign(snek_id_t id, snek_op_t op, snek_offset_t site)
 {
 	snek_poly_t *ref;
 
@@ -899,7 +1787,7 @@ snek_assign(snek_id_t id, snek_op_t op)
 	}
 	for (;;) {
 		if (id != SNEK_ID_NONE) {
-			ref = snek_id_ref(id, true);
+			ref = snek_id_ref_site(id, true, site);
 			if (!ref) {
 				snek_undefined(id);
 				return;
@@ -932,11 +1820,44 @@ snek_assign(snek_id_t id, snek_op_t op)
 		if (id == SNEK_ID_NONE)
 			snek_stackp += 2;
 		snek_a = snek_binary(*ref, op - (snek_op_assign_plus - snek_op_plus), snek_a, true);
+#if SNEK_STRING_GROW
+		/* list elements can be read without snek_string_grow_read */
+		if (id == SNEK_ID_NONE)
+			snek_string_grow = SNEK_NULL;
+#endif
 		op = snek_op_assign;
 	}
 	*ref = snek_a;
 }
 
+static void
+snek_assign_local(snek_offset_t o, snek_offset_t site)
+{
+	uint8_t		slot = o & 0xff;
+	snek_op_t	op = o >> 8;
+	snek_variable_t	*v = &snek_frame->variables[slot];
+
+	if (snek_is_global(v->value)) {
+		snek_assign(v->id, op, site);
+		return;
+	}
+	if (op == snek_op_assign_named) {
+		if (!snek_is_unset(v->value))
+			return;
+		op = snek_op_assign;
+	}
+	if (op != snek_op_assign) {
+		if (snek_is_unset(v->value)) {
+			snek_undefined(v->id);
+			return;
+		}
+		snek_a = snek_binary(v->value, op - (snek_op_assign_plus - snek_op_plus), snek_a, true);
+		/* the frame may have moved */
+		v = &snek_frame->variables[slot];
+	}
+	v->value = snek_a;
+}
+
 static void
 snek_call_builtin(const snek_builtin_t *builtin, uint8_t nposition, uint8_t nnamed)
 {
@@ -989,198 +1910,290 @@ snek_run_move(void)
 	snek_run_do(snek_poly_move);
 }
 
+static void
+snek_run_id(snek_id_t id, snek_offset_t site)
+{
+	snek_poly_t *ref = snek_id_ref_site(id, false, site);
+
+	if (ref) {
+		snek_a = *ref;
+		snek_string_grow_read(snek_a);
+	} else if (id < SNEK_BUILTIN_END)
+		snek_a = snek_builtin_id_to_poly(id);
+	else
+		snek_undefined(id);
+}
+
+#if SNEK_COUNT_PAIRS
+
+/*
+ * Count each pair of adjacent instructions as executed, push forms
+ * separately, to find sequences worth fusing
+ */
+
+static uint32_t	snek_pair_count[256][256];
+static uint8_t	snek_pair_prev;
+
+#define SNEK_RUN_COUNT(op)	(snek_pair_count[snek_pair_prev][op]++, snek_pair_prev = (op))
+
+#define SNEK_PAIRS_PRINT	32
+
+static void
+snek_pair_op_print(uint8_t op)
+{
+	const char *name = snek_op_names[op & ~snek_op_push];
+
+	fprintf(stderr, " %s%s", name ? name : "?", (op & snek_op_push) ? "^" : "");
+}
+
+void
+snek_code_pairs_print(void)
+{
+	int	n, a, b;
+
+	for (n = 0; n < SNEK_PAIRS_PRINT; n++) {
+		uint32_t	max = 0;
+		int		max_a = 0, max_b = 0;
+
+		for (a = 0; a < 256; a++)
+			for (b = 0; b < 256; b++)
+				if (snek_pair_count[a][b] > max) {
+					max = snek_pair_count[a][b];
+					max_a = a;
+					max_b = b;
+				}
+		if (!max)
+			break;
+		fprintf(stderr, "%10lu", (unsigned long) max);
+		snek_pair_op_print(max_a);
+		snek_pair_op_print(max_b);
+		fprintf(stderr, "\n");
+		snek_pair_count[max_a][max_b] = 0;
+	}
+}
+
+#else
+#define SNEK_RUN_COUNT(op)
+#endif
+
+#if SNEK_THREADED && defined(DEBUG_EXEC)
+#undef SNEK_THREADED
+#define SNEK_THREADED 0
+#endif
+
+#if SNEK_THREADED
+
+/*
+ * Direct-threaded dispatch. Each instruction, and separately its
+ * push form, gets a handler which jumps straight to the handler for
+ * the next instruction. snek_abort is only checked where it matters:
+ * before calls and assignments, at loop heads and on backward
+ * branches, so that a run stops within a bounded number of steps of
+ * an error or interrupt without testing after every instruction.
+ */
+
+#define _SNEK_RUN_LABEL(name, push)	snek_run_ ## name ## _ ## push
+#define SNEK_RUN_LABEL(name, push)	_SNEK_RUN_LABEL(name, push)
+#define SNEK_RUN_OP(name)		SNEK_RUN_LABEL(name, SNEK_RUN_PUSH):
+#define SNEK_RUN_CODE			((snek_op_t) (op & ~snek_op_push))
+#define SNEK_RUN_CHECK			do { if (snek_abort) goto abort; } while (0)
+
+#if SNEK_TRACE
+/*
+ * While tracing, every entry in the table points at snek_run_trace,
+ * which records the instruction before going on to its handler
+ */
+#define SNEK_RUN_TABLE			snek_run_table
+#else
+#define SNEK_RUN_TABLE			snek_run_dispatch
+#endif
+
+#define SNEK_RUN_DISPATCH do {					\
+		if (ip >= snek_code->size)			\
+			goto snek_run_return;			\
+		op = snek_code->code[ip++];			\
+		SNEK_RUN_COUNT(op);				\
+		snek_stats_add(ops, 1);				\
+		goto *SNEK_RUN_TABLE[op];			\
+	} while (0)
+
+#define SNEK_RUN_NEXT do {					\
+		if (SNEK_RUN_PUSH) {				\
+			if (snek_stackp == SNEK_STACK)		\
+				goto snek_run_overflow;		\
+			snek_stack[snek_stackp++] = snek_a;	\
+		}						\
+		SNEK_RUN_DISPATCH;				\
+	} while (0)
+
+#define SNEK_RUN_ENTER			SNEK_RUN_DISPATCH
+
+#define SNEK_RUN_BRANCH(target) do {				\
+		if ((target) <= ip)				\
+			SNEK_RUN_CHECK;				\
+		ip = (target);					\
+	} while (0)
+
+#define SNEK_RUN_ENTRY(name)							\
+	[snek_op_ ## name] = &&SNEK_RUN_LABEL(name, 0),				\
+	[snek_op_ ## name | snek_op_push] = &&SNEK_RUN_LABEL(name, 1)
+
+#else
+
+#define SNEK_RUN_OP(name)		case snek_op_ ## name:
+#define SNEK_RUN_CODE			op
+#define SNEK_RUN_CHECK
+#define SNEK_RUN_NEXT			break
+#define SNEK_RUN_ENTER			do { push = false; goto snek_run_done; } while (0)
+#define SNEK_RUN_BRANCH(target)		(ip = (target))
+
+#endif
+
 snek_poly_t
 snek_code_run(snek_code_t *code_in)
 {
 	snek_code = code_in;
 
-	snek_poly_t	*ref = NULL;
 	snek_id_t	id;
 	snek_offset_t	ip = 0;
 	snek_offset_t	o;
+	snek_op_t	op;
+
+#if SNEK_THREADED
+	static const void * const snek_run_dispatch[256] = {
+		SNEK_RUN_ENTRY(eq),
+		SNEK_RUN_ENTRY(ne),
+		SNEK_RUN_ENTRY(gt),
+		SNEK_RUN_ENTRY(lt),
+		SNEK_RUN_ENTRY(ge),
+		SNEK_RUN_ENTRY(le),
+		SNEK_RUN_ENTRY(is),
+		SNEK_RUN_ENTRY(is_not),
+		SNEK_RUN_ENTRY(in),
+		SNEK_RUN_ENTRY(not_in),
+		SNEK_RUN_ENTRY(array),
+		SNEK_RUN_ENTRY(plus),
+		SNEK_RUN_ENTRY(minus),
+		SNEK_RUN_ENTRY(times),
+		SNEK_RUN_ENTRY(divide),
+		SNEK_RUN_ENTRY(div),
+		SNEK_RUN_ENTRY(mod),
+		SNEK_RUN_ENTRY(pow),
+		SNEK_RUN_ENTRY(land),
+		SNEK_RUN_ENTRY(lor),
+		SNEK_RUN_ENTRY(lxor),
+		SNEK_RUN_ENTRY(lshift),
+		SNEK_RUN_ENTRY(rshift),
+		SNEK_RUN_ENTRY(assign_plus),
+		SNEK_RUN_ENTRY(assign_minus),
+		SNEK_RUN_ENTRY(assign_times),
+		SNEK_RUN_ENTRY(assign_divide),
+		SNEK_RUN_ENTRY(assign_div),
+		SNEK_RUN_ENTRY(assign_mod),
+		SNEK_RUN_ENTRY(assign_pow),
+		SNEK_RUN_ENTRY(assign_land),
+		SNEK_RUN_ENTRY(assign_lor),
+		SNEK_RUN_ENTRY(assign_lxor),
+		SNEK_RUN_ENTRY(assign_lshift),
+		SNEK_RUN_ENTRY(assign_rshift),
+		SNEK_RUN_ENTRY(assign),
+		SNEK_RUN_ENTRY(assign_named),
+		SNEK_RUN_ENTRY(assign_local),
+		SNEK_RUN_ENTRY(num),
+		SNEK_RUN_ENTRY(int),
+		SNEK_RUN_ENTRY(string),
+		SNEK_RUN_ENTRY(list),
+		SNEK_RUN_ENTRY(tuple),
+		SNEK_RUN_ENTRY(id),
+		SNEK_RUN_ENTRY(local),
+		SNEK_RUN_ENTRY(not),
+		SNEK_RUN_ENTRY(uminus),
+		SNEK_RUN_ENTRY(lnot),
+		SNEK_RUN_ENTRY(call),
+		SNEK_RUN_ENTRY(slice),
+		SNEK_RUN_ENTRY(global),
+		SNEK_RUN_ENTRY(name),
+		SNEK_RUN_ENTRY(branch),
+		SNEK_RUN_ENTRY(branch_true),
+		SNEK_RUN_ENTRY(branch_false),
+		SNEK_RUN_ENTRY(forward),
+		SNEK_RUN_ENTRY(range_start),
+		SNEK_RUN_ENTRY(range_step),
+		SNEK_RUN_ENTRY(in_start),
+		SNEK_RUN_ENTRY(in_step),
+		SNEK_RUN_ENTRY(in_end),
+		SNEK_RUN_ENTRY(line),
+		SNEK_RUN_ENTRY(null),
+		SNEK_RUN_ENTRY(nop),
+#if SNEK_FUSE
+		SNEK_RUN_ENTRY(int_binary),
+		SNEK_RUN_ENTRY(compare_branch),
+		SNEK_RUN_ENTRY(int_compare_branch),
+		SNEK_RUN_ENTRY(id_array),
+		SNEK_RUN_ENTRY(local_array),
+		SNEK_RUN_ENTRY(id_int_assign),
+		SNEK_RUN_ENTRY(local_int_assign),
+#endif
+	};
+#if SNEK_TRACE
+	static const void * const snek_run_trace_dispatch[256] = {
+		[0 ... 255] = &&snek_run_trace,
+	};
+	const void * const *snek_run_table = snek_tracing ? snek_run_trace_dispatch : snek_run_dispatch;
+#endif
+
+	if (!snek_code)
+		goto abort;
+	SNEK_RUN_DISPATCH;
+
+#if SNEK_TRACE
+snek_run_trace:
+	snek_trace_op(op);
+	goto *snek_run_dispatch[op];
+#endif
 
+#define SNEK_RUN_PUSH	0
+#include "snek-run.h"
+#undef SNEK_RUN_PUSH
+#define SNEK_RUN_PUSH	1
+#include "snek-run.h"
+#undef SNEK_RUN_PUSH
+
+snek_run_overflow:
+	snek_error("stack overflow");
+	goto abort;
+
+snek_run_return:
+	ip = snek_frame_pop();
+	if (snek_code) {
+		SNEK_RUN_CHECK;
+		op = snek_code->code[ip];
+		ip += sizeof (snek_offset_t) + 1;
+		if ((op & snek_op_push) != 0)
+			snek_stack_push(snek_a);
+		SNEK_RUN_DISPATCH;
+	}
+#else
 	while (snek_code) {
 		while (ip < snek_code->size) {
 #ifdef DEBUG_EXEC
 			snek_code_dump_instruction(snek_code, ip);
 #endif
-			snek_op_t op = snek_code->code[ip++];
+			op = snek_code->code[ip++];
+			SNEK_RUN_COUNT(op);
+			snek_stats_add(ops, 1);
+#if SNEK_TRACE
+			if (snek_tracing)
+				snek_trace_op(op);
+#endif
 			bool push = (op & snek_op_push) != 0;
 			op &= ~snek_op_push;
 			switch(op) {
-			case snek_op_eq:
-			case snek_op_ne:
-			case snek_op_gt:
-			case snek_op_lt:
-			case snek_op_ge:
-			case snek_op_le:
-
-			case snek_op_is:
-			case snek_op_is_not:
-			case snek_op_in:
-			case snek_op_not_in:
-
-			case snek_op_array:
-
-			case snek_op_plus:
-			case snek_op_minus:
-			case snek_op_times:
-			case snek_op_divide:
-			case snek_op_div:
-			case snek_op_mod:
-			case snek_op_pow:
-			case snek_op_land:
-			case snek_op_lor:
-			case snek_op_lxor:
-			case snek_op_lshift:
-			case snek_op_rshift:
-				snek_a = snek_binary(snek_stack_pick(0), op, snek_a, false);
-				snek_stack_drop(1);
-				break;
-
-			case snek_op_assign_plus:
-			case snek_op_assign_minus:
-			case snek_op_assign_times:
-			case snek_op_assign_divide:
-			case snek_op_assign_div:
-			case snek_op_assign_mod:
-			case snek_op_assign_pow:
-			case snek_op_assign_land:
-			case snek_op_assign_lor:
-			case snek_op_assign_lxor:
-			case snek_op_assign_lshift:
-			case snek_op_assign_rshift:
-
-			case snek_op_assign:
-			case snek_op_assign_named:
-				memcpy(&id, &snek_code->code[ip], sizeof (snek_id_t));
-				ip += sizeof (snek_id_t);
-				snek_assign(id, op);
-				break;
-
-			case snek_op_num:
-				memcpy(&snek_a.f, &snek_code->code[ip], sizeof(float));
-				ip += sizeof(float);
-				break;
-			case snek_op_int:
-				snek_a.f = (int8_t) snek_code->code[ip];
-				ip += 1;
-				break;
-			case snek_op_string:
-				memcpy(&o, &snek_code->code[ip], sizeof(snek_offset_t));
-				ip += sizeof (snek_offset_t);
-				snek_a = snek_offset_to_poly(o, snek_string);
-				break;
-			case snek_op_list:
-			case snek_op_tuple:
-				memcpy(&o, &snek_code->code[ip], sizeof(snek_offset_t));
-				ip += sizeof (snek_offset_t);
-				snek_a = snek_list_imm(o, op == snek_op_tuple);
-				break;
-			case snek_op_id:
-				memcpy(&id, &snek_code->code[ip], sizeof(snek_id_t));
-				ip += sizeof (snek_id_t);
-				ref = snek_id_ref(id, false);
-				if (ref) {
-					snek_a = *ref;
-					break;
-				}
-				if (id < SNEK_BUILTIN_END) {
-					snek_a = snek_builtin_id_to_poly(id);
-					break;
-				}
-				snek_undefined(id);
-				break;
-			case snek_op_not:
-				snek_a = snek_bool_to_poly(!snek_poly_true(snek_a));
-				break;
-			case snek_op_uminus:
-				snek_a = snek_float_to_poly(-snek_poly_get_float(snek_a));
-				break;
-			case snek_op_lnot:
-				snek_a = snek_float_to_poly(~(uint32_t) snek_poly_get_float(snek_a));
-				break;
-			case snek_op_call:
-				memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
-				snek_offset_t nposition = (o & 0xff);
-				snek_offset_t nnamed = (o >> 8);
-				snek_offset_t nstack = nposition + (nnamed<<1);
-				snek_a = snek_stack_pick(nstack);
-				switch (snek_poly_type(snek_a)) {
-				case snek_func:
-					if (!snek_func_push(nposition, nnamed, ip - 1))
-						break;
-					snek_a = snek_stack_pop();	/* get function back */
-					snek_code = snek_pool_addr(snek_poly_to_func(snek_a)->code);
-					ip = 0;
-					push = false;	/* will pick up push on return */
-					goto done_func;
-				case snek_builtin:
-					snek_call_builtin(snek_poly_to_builtin(snek_a), nposition, nnamed);
-					break;
-				default:
-					snek_error("not a func: %p", snek_a);
-					break;
-				}
-				ip += sizeof (snek_offset_t);
-				snek_stack_drop(nstack + 1);
-			done_func:
-				break;
-			case snek_op_slice:
-				snek_slice(snek_code->code[ip]);
-				ip++;
-				break;
-			case snek_op_global:
-				memcpy(&id, &snek_code->code[ip], sizeof (snek_id_t));
-				ip += sizeof (snek_id_t);
-				snek_frame_mark_global(id);
-				break;
-			case snek_op_branch:
-				memcpy(&ip, &snek_code->code[ip], sizeof (snek_offset_t));
-				break;
-			case snek_op_branch_true:
-				if (snek_poly_true(snek_a))
-					memcpy(&ip, &snek_code->code[ip], sizeof (snek_offset_t));
-				else
-					ip += sizeof (snek_offset_t);
-				break;
-			case snek_op_branch_false:
-				if (!snek_poly_true(snek_a))
-					memcpy(&ip, &snek_code->code[ip], sizeof (snek_offset_t));
-				else
-					ip += sizeof (snek_offset_t);
-				break;
-			case snek_op_forward:
-				snek_error("not in loop");
-				break;
-			case snek_op_range_start:
-				snek_range_start(ip);
-				ip += sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof(snek_id_t);
-				break;
-			case snek_op_range_step:
-				if (!snek_range_step(ip))
-					memcpy(&ip, &snek_code->code[ip], sizeof (snek_offset_t));
-				else
-					ip += sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof(snek_id_t);
-				break;
-			case snek_op_in_step:
-				if (!snek_in_step(ip))
-					memcpy(&ip, &snek_code->code[ip], sizeof (snek_offset_t));
-				else
-					ip += sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof (snek_id_t);
-				break;
-			case snek_op_line:
-				memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
-				ip += sizeof (snek_offset_t);
-				snek_line = o;
-				break;
-			case snek_op_null:
-				snek_a = SNEK_NULL;
-				break;
-			case snek_op_nop:
-			case snek_op_push:
+#include "snek-run.h"
+			default:
 				break;
 			}
+		snek_run_done:
 			if (snek_abort)
 				goto abort;
 			if (push)
@@ -1196,12 +2209,13 @@ snek_code_run(snek_code_t *code_in)
 		}
 		ip = snek_frame_pop();
 		if (snek_code) {
-			snek_op_t op = snek_code->code[ip];
+			op = snek_code->code[ip];
 			ip += sizeof (snek_offset_t) + 1;
 			if ((op & snek_op_push) != 0)
 				snek_stack_push(snek_a);
 		}
 	}
+#endif
 abort:
 	/* Clear references to run objects */
 	snek_code = NULL;
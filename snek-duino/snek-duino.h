@@ -26,6 +26,13 @@
 #define VALUE_STACK_SIZE	16
 #define PARSE_STACK_SIZE	64
 #define SNEK_STACK		16
+#define SNEK_MAX_LOCALS		16
+#define SNEK_COMPILE_INC	16
+#define SNEK_COMPILE_SHIFT	1	/* grow by half, memory is tight */
+#define SNEK_COMPILE_KEEP	0
+#ifndef SNEK_NAME_HASH
+#define SNEK_NAME_HASH		0	/* 1 to index names by hash */
+#endif
 #define PARSE_TABLE_DECLARATION(t) 	PROGMEM t
 #define PARSE_TABLE_FETCH_TOKEN(a)	((token_key_t) pgm_read_byte(a))
 #define PARSE_TABLE_FETCH_INDEX(a)	((uint8_t) pgm_read_byte(a))
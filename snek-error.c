@@ -38,6 +38,9 @@ snek_error_name(const char *format, ...)
 	va_list		args;
 	char		c;
 
+	/* Only report the first error */
+	if (snek_abort)
+		return SNEK_NULL;
 	snek_abort = true;
 	va_start(args, format);
 	fprintf(stderr, "%s:%d ", snek_file, snek_line);
@@ -77,6 +80,7 @@ snek_error_range(snek_soffset_t o)
 void
 snek_panic(const char *message)
 {
+	snek_abort = false;
 	snek_error("%s\n", message);
 	abort();
 }
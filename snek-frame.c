@@ -16,84 +16,134 @@
 
 snek_frame_t	*snek_globals;
 snek_frame_t	*snek_frame;
+snek_frame_t	*snek_loops;
+snek_offset_t	snek_globals_version = 1;
 
-static snek_frame_t *snek_pick_frame(bool globals)
+/* Zero is never a valid version so that new caches always miss */
+static void
+snek_globals_changed(void)
 {
-	if (globals)
-		return snek_globals;
-	return snek_frame;
+	if (++snek_globals_version == 0)
+		snek_globals_version = 1;
 }
 
-static snek_frame_t *
-snek_frame_realloc(bool globals, snek_offset_t nvariables)
+/*
+ * Function frames grow one variable at a time; only names which
+ * weren't given a slot at compile time end up being added here
+ */
+static snek_variable_t *
+snek_variable_insert(void)
 {
-	snek_frame_t *frame = snek_alloc(sizeof (snek_frame_t) +
-					 nvariables * sizeof (snek_variable_t));
+	snek_frame_t	*frame;
+	snek_offset_t	nvariables = snek_frame->nvariables + 1;
 
+	snek_alloc_kind(frame);
+	frame = snek_alloc(sizeof (snek_frame_t) + nvariables * sizeof (snek_variable_t));
 	if (!frame)
 		return NULL;
-
-	snek_frame_t *old_frame = snek_pick_frame(globals);
-	*frame = *old_frame;
+	memcpy(frame, snek_frame, sizeof (snek_frame_t) +
+	       snek_frame->nvariables * sizeof (snek_variable_t));
 	frame->nvariables = nvariables;
-	return frame;
+	snek_frame = frame;
+	return &frame->variables[nvariables-1];
 }
 
 static snek_variable_t *
-snek_variable_insert(bool globals)
+snek_variable_lookup(snek_id_t id, bool insert)
 {
-	snek_frame_t	*old_frame = snek_pick_frame(globals);
-	snek_frame_t	*frame;
-	snek_offset_t	nvariables = old_frame->nvariables + 1;
+	snek_offset_t	i;
 
-	frame = snek_frame_realloc(globals, old_frame->nvariables + 1);
-	if (!frame)
+	for (i = 0; i < snek_frame->nvariables; i++) {
+		if (snek_frame->variables[i].id == id) {
+			/* unassigned local slots are only found when storing */
+			if (!insert && snek_is_unset(snek_frame->variables[i].value))
+				return NULL;
+			return &snek_frame->variables[i];
+		}
+	}
+	if (!insert)
 		return NULL;
-	old_frame = snek_pick_frame(globals);
-	memcpy(frame->variables,
-	       old_frame->variables,
-	       old_frame->nvariables * sizeof (snek_variable_t));
-
-	if (globals)
-		snek_globals = frame;
-	else
-		snek_frame = frame;
-	return &frame->variables[nvariables-1];
+
+	snek_variable_t *v = snek_variable_insert();
+	if (!v)
+		return NULL;
+
+	v->id = id;
+	return v;
 }
 
-static void
-snek_variable_delete(snek_offset_t i)
+/*
+ * The globals are kept sorted by id, with spare space at the end
+ * so that adding a name usually doesn't reallocate the frame
+ */
+
+#ifndef SNEK_GLOBALS_GROW
+#define SNEK_GLOBALS_GROW(n)	((n) + ((n) >> 1) + 4)
+#endif
+
+static snek_offset_t
+snek_global_find(snek_id_t id)
 {
-	snek_frame_t	*frame;
+	snek_offset_t	lo = 0, hi = snek_globals->nvariables;
+
+	while (lo < hi) {
+		snek_offset_t	mid = (lo + hi) >> 1;
 
-	frame = snek_frame_realloc(true, snek_globals->nvariables - 1);
-	memcpy(&frame->variables[0],
-	       &snek_globals->variables[0],
-	       i * sizeof (snek_variable_t));
-	memcpy(&frame->variables[i],
-	       &snek_globals->variables[i+1],
-	       snek_globals->nvariables - i - 1);
+		if (snek_globals->variables[mid].id < id)
+			lo = mid + 1;
+		else
+			hi = mid;
+	}
+	return lo;
+}
+
+static bool
+snek_globals_grow(void)
+{
+	snek_offset_t	nalloc = SNEK_GLOBALS_GROW(snek_globals ? snek_globals->nalloc : 0);
+	snek_frame_t	*globals;
+
+	snek_alloc_kind(frame);
+	globals = snek_alloc(sizeof (snek_frame_t) + nalloc * sizeof (snek_variable_t));
+	if (!globals)
+		return false;
+	if (snek_globals) {
+		memcpy(globals, snek_globals, sizeof (snek_frame_t) +
+		       snek_globals->nvariables * sizeof (snek_variable_t));
+	} else {
+		globals->prev = SNEK_OFFSET_NONE;
+		globals->code = SNEK_OFFSET_NONE;
+		globals->nvariables = 0;
+	}
+	globals->nalloc = nalloc;
+	snek_globals = globals;
+	return true;
 }
 
 static snek_variable_t *
-snek_variable_lookup(bool globals, snek_id_t id, bool insert)
+snek_global_lookup(snek_id_t id, bool insert)
 {
-	snek_offset_t	i;
-	snek_frame_t	*frame;
+	snek_offset_t	i = 0;
 
-	frame = snek_pick_frame(globals);
-	for (i = 0; i < frame->nvariables; i++) {
-		if (frame->variables[i].id == id)
-			return &frame->variables[i];
+	if (snek_globals) {
+		i = snek_global_find(id);
+		if (i < snek_globals->nvariables && snek_globals->variables[i].id == id)
+			return &snek_globals->variables[i];
 	}
 	if (!insert)
 		return NULL;
 
-	snek_variable_t *v = snek_variable_insert(globals);
-	if (!v)
-		return NULL;
+	if (!snek_globals || snek_globals->nvariables == snek_globals->nalloc)
+		if (!snek_globals_grow())
+			return NULL;
 
+	snek_variable_t *v = &snek_globals->variables[i];
+
+	memmove(v + 1, v, (snek_globals->nvariables - i) * sizeof (snek_variable_t));
+	snek_globals->nvariables++;
+	snek_globals_changed();
 	v->id = id;
+	v->value = SNEK_NULL;
 	return v;
 }
 
@@ -102,19 +152,46 @@ snek_frame_lookup(snek_id_t id, bool insert)
 {
 	snek_variable_t	*v = NULL;
 
-	if (snek_frame && (v = snek_variable_lookup(false, id, insert))) {
+	if (snek_frame && (v = snek_variable_lookup(id, insert))) {
 		if (!snek_is_global(v->value))
 			return v;
 	}
-	if (insert && !snek_globals) {
-		snek_globals = snek_alloc(sizeof (snek_frame_t));
-		snek_globals->prev = SNEK_OFFSET_NONE;
-		snek_globals->code = SNEK_OFFSET_NONE;
+	return snek_global_lookup(id, insert);
+}
+
+#if SNEK_CACHE
+/*
+ * Names referenced by id in function code are never locals, so
+ * the cache only needs to track the globals. 'site' is the
+ * location of the cache within snek_code.
+ */
+snek_poly_t *
+snek_global_ref_cache(snek_id_t id, bool insert, snek_offset_t site)
+{
+	snek_cache_t	cache;
+	snek_variable_t	*v;
+
+	memcpy(&cache, &snek_code->code[site], sizeof (snek_cache_t));
+	if (cache.version == snek_globals_version) {
+		if (snek_offset_is_none(cache.index)) {
+			if (!insert)
+				return NULL;
+		} else if (cache.index < snek_globals->nvariables) {
+			/* The version may have wrapped, so check the index too */
+			v = &snek_globals->variables[cache.index];
+			if (v->id == id)
+				return &v->value;
+		}
 	}
-	if (snek_globals && (v = snek_variable_lookup(true, id, insert)))
-		return v;
-	return v;
+	v = snek_global_lookup(id, insert);
+	cache.version = snek_globals_version;
+	cache.index = v ? (snek_offset_t) (v - snek_globals->variables) : SNEK_OFFSET_NONE;
+	memcpy(&snek_code->code[site], &cache, sizeof (snek_cache_t));
+	if (!v)
+		return NULL;
+	return &v->value;
 }
+#endif
 
 bool
 snek_frame_mark_global(snek_id_t id)
@@ -122,7 +199,7 @@ snek_frame_mark_global(snek_id_t id)
 	if (snek_frame) {
 		snek_variable_t *v;
 
-		v = snek_variable_lookup(false, id, true);
+		v = snek_variable_lookup(id, true);
 		if (!v)
 			return false;
 		v->value = SNEK_GLOBAL;
@@ -135,12 +212,14 @@ snek_frame_push(snek_offset_t ip, snek_offset_t nformal)
 {
 	snek_frame_t *f;
 
+	snek_alloc_kind(frame);
 	f = snek_alloc(sizeof (snek_frame_t) + nformal * sizeof (snek_variable_t));
 	if (!f)
 		return false;
 	f->nvariables = nformal;
 	f->code = snek_pool_offset(snek_code);
 	f->ip = ip;
+	f->line = snek_line;
 	f->prev = snek_pool_offset(snek_frame);
 	snek_frame = f;
 	return true;
@@ -156,12 +235,42 @@ snek_frame_pop(void)
 
 	snek_offset_t ip = snek_frame->ip;
 
+	snek_line = snek_frame->line;
 	snek_code = snek_pool_addr(snek_frame->code);
 	snek_frame = snek_pool_addr(snek_frame->prev);
 
 	return ip;
 }
 
+/*
+ * Return the state slots of a loop. Function code has them in its
+ * frame; top-level code, which never runs with a frame, keeps them
+ * in snek_loops, grown as loops start
+ */
+snek_variable_t *
+snek_loop_state(uint8_t slot, bool start)
+{
+	snek_frame_t	*frame;
+	snek_offset_t	nvariables = slot + SNEK_LOOP_STATE;
+
+	if (snek_frame)
+		return &snek_frame->variables[slot];
+	if (start && (!snek_loops || snek_loops->nvariables < nvariables)) {
+		snek_alloc_kind(frame);
+		frame = snek_alloc(sizeof (snek_frame_t) + nvariables * sizeof (snek_variable_t));
+		if (!frame)
+			return NULL;
+		frame->prev = SNEK_OFFSET_NONE;
+		frame->code = SNEK_OFFSET_NONE;
+		frame->nvariables = nvariables;
+		if (snek_loops)
+			memcpy(frame->variables, snek_loops->variables,
+			       snek_loops->nvariables * sizeof (snek_variable_t));
+		snek_loops = frame;
+	}
+	return &snek_loops->variables[slot];
+}
+
 snek_poly_t *
 snek_id_ref(snek_id_t id, bool insert)
 {
@@ -174,7 +283,7 @@ snek_id_ref(snek_id_t id, bool insert)
 bool
 snek_id_is_local(snek_id_t id)
 {
-	return snek_variable_lookup(false, id, false) != NULL;
+	return snek_frame && snek_variable_lookup(id, false) != NULL;
 }
 
 bool
@@ -182,13 +291,17 @@ snek_id_del(snek_id_t id)
 {
 	snek_offset_t i;
 
-	for (i = 0; i < snek_globals->nvariables; i++)
-		if (snek_globals->variables[i].id == id) {
-			snek_variable_delete(i);
-			return true;
-		}
-
-	return false;
+	if (!snek_globals)
+		return false;
+	i = snek_global_find(id);
+	if (i == snek_globals->nvariables || snek_globals->variables[i].id != id)
+		return false;
+	snek_globals->nvariables--;
+	snek_globals_changed();
+	memmove(&snek_globals->variables[i],
+		&snek_globals->variables[i+1],
+		(snek_globals->nvariables - i) * sizeof (snek_variable_t));
+	return true;
 }
 
 static snek_offset_t
@@ -244,3 +357,18 @@ const snek_mem_t SNEK_MEM_DECLARE(snek_frame_mem) = {
 	.move = snek_frame_move,
 	SNEK_MEM_DECLARE_NAME("frame")
 };
+
+static snek_offset_t
+snek_globals_size(void *addr)
+{
+	snek_frame_t *frame = addr;
+
+	return sizeof (snek_frame_t) + frame->nalloc * sizeof (snek_variable_t);
+}
+
+const snek_mem_t SNEK_MEM_DECLARE(snek_globals_mem) = {
+	.size = snek_globals_size,
+	.mark = snek_frame_mark,
+	.move = snek_frame_move,
+	SNEK_MEM_DECLARE_NAME("globals")
+};
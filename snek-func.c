@@ -19,24 +19,35 @@ snek_func_alloc(snek_code_t *code)
 {
 	snek_func_t *func;
 
+	if (!snek_code_resolve_locals(code))
+		return NULL;
 	snek_code_stash(code);
-	func = snek_alloc(sizeof (snek_func_t) + snek_parse_nformal * sizeof (snek_id_t));
+	snek_alloc_kind(func);
+	func = snek_alloc(sizeof (snek_func_t) + snek_parse_nlocal * sizeof (snek_id_t));
 	code = snek_code_fetch();
 	if (!func)
 		return NULL;
 	func->code = snek_pool_offset(code);
 	func->nformal = snek_parse_nformal;
-	memcpy(func->formals, snek_parse_formals, snek_parse_nformal * sizeof (snek_id_t));
+	func->nlocal = snek_parse_nlocal;
+	memcpy(func->locals, snek_parse_formals, snek_parse_nlocal * sizeof (snek_id_t));
 	return func;
 }
 
+static snek_soffset_t
+snek_func_local(snek_func_t *func, snek_id_t id)
+{
+	snek_offset_t i;
+
+	for (i = 0; i < func->nlocal; i++)
+		if (func->locals[i] == id)
+			return i;
+	return -1;
+}
+
 bool
 snek_func_push(uint8_t nposition, uint8_t nnamed, snek_offset_t ip)
 {
-	uint8_t nparam = nposition + nnamed;
-	if (!snek_frame_push(ip, nparam))
-		return false;
-
 	snek_func_t *func = snek_poly_to_func(snek_a);
 
 	if (nposition != func->nformal)
@@ -45,19 +56,43 @@ snek_func_push(uint8_t nposition, uint8_t nnamed, snek_offset_t ip)
 		return false;
 	}
 
-	snek_variable_t *v = &snek_frame->variables[nparam];
+	/*
+	 * Named actuals must name a local of the function; this
+	 * means any other name referenced in the body is a global
+	 */
+	uint8_t n;
+
+	for (n = 0; n < nnamed; n++) {
+		snek_id_t id = snek_poly_get_soffset(snek_stack_pick(n * 2 + 1));
+		if (snek_func_local(func, id) < 0) {
+			snek_error("unexpected argument: %s", snek_name_string(id));
+			return false;
+		}
+	}
+
+	if (!snek_frame_push(ip, func->nlocal))
+		return false;
+
+	func = snek_poly_to_func(snek_a);
+
+	snek_variable_t *v = snek_frame->variables;
+	snek_offset_t i;
+
+	for (i = 0; i < func->nlocal; i++) {
+		v[i].id = func->locals[i];
+		v[i].value = SNEK_UNSET;
+	}
 
 	while (nnamed--) {
-		v--;
-		v->value = snek_stack_pop();
-		v->id = snek_stack_pop_soffset();
+		snek_poly_t value = snek_stack_pop();
+		snek_id_t id = snek_stack_pop_soffset();
+
+		v[snek_func_local(func, id)].value = value;
 	}
 	/* Pop the arguments off the stack, assigning in reverse order */
-	while (nposition--) {
-		v--;
-		v->id = func->formals[nposition];
-		v->value = snek_stack_pop();
-	}
+	while (nposition--)
+		v[nposition].value = snek_stack_pop();
+	snek_stats_add(calls, 1);
 	return true;
 }
 
@@ -66,7 +101,7 @@ snek_func_size(void *addr)
 {
 	snek_func_t *func = addr;
 
-	return (snek_offset_t) sizeof (snek_func_t) + func->nformal * (snek_offset_t) sizeof (snek_id_t);
+	return (snek_offset_t) sizeof (snek_func_t) + func->nlocal * (snek_offset_t) sizeof (snek_id_t);
 }
 
 void
@@ -17,6 +17,7 @@ start		: command @{ snek_parse_middle = false; }@ start
 command		: @{ snek_print_val = snek_interactive; }@ stat
 			@{
 				snek_code_t *code = snek_code_finish();
+				snek_import_code(code);
 				snek_poly_t p = snek_code_run(code);
 				if (snek_abort)
 					return parse_return_error;
@@ -35,6 +36,8 @@ command		: @{ snek_print_val = snek_interactive; }@ stat
 	 		}@
 		  OP opt-formals CP COLON suite
 			@{
+				snek_id_t	id = value_pop().id;
+
 				if (snek_compile[snek_compile_prev] == snek_op_forward)
 					snek_code_delete_prev();
 				else
@@ -42,11 +45,11 @@ command		: @{ snek_print_val = snek_interactive; }@ stat
 				snek_code_t	*code = snek_code_finish();
 				if (!code)
 					break;
+				snek_import_def(id, code);
 				snek_func_t	*func = snek_func_alloc(code);
 				if (!func)
 					break;
 				snek_poly_t	poly = snek_func_to_poly(func);
-				snek_id_t	id = value_pop().id;
 
 				snek_stack_push(poly);
 				snek_poly_t *ref = snek_id_ref(id, true);
@@ -61,6 +64,7 @@ command		: @{ snek_print_val = snek_interactive; }@ stat
 		  formals
 			@{
 				uint8_t i;
+				snek_import_del();
 				for (i = 0; i < snek_parse_nformal; i++)
 					if (!snek_id_del(snek_parse_formals[i])) {
 						snek_undefined(snek_parse_formals[i]);
@@ -68,6 +72,10 @@ command		: @{ snek_print_val = snek_interactive; }@ stat
 					}
 			}@
 		| IMPORT NAME
+			@{
+				if (snek_parse_import_name(snek_token_val.id))
+					return parse_return_success;
+			}@
 		;
 opt-formals	: formals
 		|
@@ -239,7 +247,8 @@ while-stat	:
 				snek_code_patch_branch(while_off, while_else_stat_off);
 				snek_code_patch_branch(loop_end_off, top_off);
 				snek_code_patch_forward(while_off, loop_end_off, snek_forward_continue, top_off);
-				snek_code_patch_forward(while_off, loop_end_off, snek_forward_break, snek_code_current());
+				if (snek_code_patch_forward(while_off, loop_end_off, snek_forward_break, snek_code_current()))
+					snek_code_add_loop_end(top_off);
 			}@
 		;
 while-else-stat	: ELSE COLON suite
@@ -556,7 +565,7 @@ actual-p	: ASSIGN
 					return parse_return_syntax;
 				memcpy(&id, prev + 1, sizeof (snek_id_t));
 				snek_code_delete_prev();
-				snek_code_add_number(id);
+				snek_code_add_op_id(snek_op_name, id);
 				snek_code_set_push(snek_code_prev_insn());
 			}@
 		  expr
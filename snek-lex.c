@@ -39,7 +39,7 @@ static uint8_t snek_lex_len;
 
 #define RETURN_OP(_op, ret) do { snek_token_val.op = (_op); RETURN (ret); } while(0)
 
-static char ungetbuf[5];
+static char ungetbuf[SNEK_LEX_UNGET];
 static uint8_t ungetcount;
 
 #ifndef SNEK_GETC
@@ -249,10 +249,10 @@ string(char q)
 	for (;;) {
 		c = lexchar();
 		if (c == q) {
-			char *ret = snek_alloc(snek_lex_len + 1);
+			char *ret = snek_string_alloc(snek_lex_len);
 			if (!ret)
 				RETURN(TOKEN_NONE);
-			strcpy(ret, snek_lex_text);
+			memcpy(ret, snek_lex_text, snek_lex_len);
 			snek_token_val.string = ret;
 			RETURN(STRING);
 		}
@@ -528,3 +528,39 @@ snek_lex(void)
 		RETURN(NAME);
 	}
 }
+
+#if SNEK_IMPORT
+
+/* Save the lexer state, then start reading 'file' from the beginning */
+void
+snek_lex_save(snek_lex_state_t *state, char *file)
+{
+	state->file = snek_file;
+	state->line = snek_lex_line;
+	state->midline = snek_lex_midline;
+	state->exdent = snek_lex_exdent;
+	state->indent = snek_lex_indent;
+	state->ungetcount = ungetcount;
+	memcpy(state->ungetbuf, ungetbuf, ungetcount);
+
+	snek_file = file;
+	snek_lex_line = 1;
+	snek_lex_midline = false;
+	snek_lex_exdent = false;
+	snek_lex_indent = 0;
+	ungetcount = 0;
+}
+
+void
+snek_lex_restore(const snek_lex_state_t *state)
+{
+	snek_file = state->file;
+	snek_lex_line = state->line;
+	snek_lex_midline = state->midline;
+	snek_lex_exdent = state->exdent;
+	snek_lex_indent = state->indent;
+	ungetcount = state->ungetcount;
+	memcpy(ungetbuf, state->ungetbuf, ungetcount);
+}
+
+#endif
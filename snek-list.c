@@ -30,7 +30,18 @@ snek_list_resize(snek_list_t *list, snek_offset_t size)
 
 	snek_offset_t alloc = snek_list_readonly(list) ? size : snek_list_alloc(size);
 
+	/* The elements may be at the top of the heap with room to grow */
+	if (list->data && snek_alloc_grow(snek_pool_addr(list->data),
+					  list->alloc * sizeof (snek_poly_t),
+					  alloc * sizeof (snek_poly_t)))
+	{
+		list->size = size;
+		list->alloc = alloc;
+		return list;
+	}
+
 	snek_stack_push_list(list);
+	snek_alloc_kind(list);
 	snek_poly_t *data = snek_alloc(alloc * sizeof (snek_poly_t));
 	list = snek_stack_pop_list();
 
@@ -53,6 +64,7 @@ snek_list_make(snek_offset_t size, bool readonly)
 {
 	snek_list_t	*list;
 
+	snek_alloc_kind(list);
 	list = snek_alloc(sizeof (snek_list_t));
 	if (!list)
 		return NULL;
@@ -18,8 +18,9 @@
 #ifdef SNEK_DYNAMIC
 uint8_t 	*snek_pool  __attribute__((aligned(SNEK_ALLOC_ROUND)));
 uint32_t	snek_pool_size;
+uint32_t	snek_pool_limit = SNEK_POOL_MAX;
 #else
-uint8_t	snek_pool[SNEK_POOL] __attribute__((aligned(SNEK_ALLOC_ROUND)));
+uint8_t	snek_pool[SNEK_POOL_BASE + SNEK_POOL] __attribute__((aligned(SNEK_ALLOC_ROUND)));
 #endif
 
 struct snek_root {
@@ -35,19 +36,34 @@ static snek_code_t		*stash_code;
 #define SNEK_ROOT_ADDR(n) ((n)->addr)
 #endif
 
+#if SNEK_PROFILE
+volatile bool	snek_mem_moving;
+#endif
+
 static const struct snek_root	SNEK_ROOT_DECLARE(snek_root)[] = {
 	{
 		.type = &snek_name_mem,
 		.addr = (void **) (void *) &snek_names,
 	},
+#if SNEK_NAME_HASH
+	/* must follow snek_names, which keeps the names alive */
 	{
-		.type = &snek_frame_mem,
+		.type = &snek_name_hash_mem,
+		.addr = (void **) (void *) &snek_name_hash,
+	},
+#endif
+	{
+		.type = &snek_globals_mem,
 		.addr = (void **) (void *) &snek_globals,
 	},
 	{
 		.type = &snek_frame_mem,
 		.addr = (void **) (void *) &snek_frame,
 	},
+	{
+		.type = &snek_frame_mem,
+		.addr = (void **) (void *) &snek_loops,
+	},
 	{
 		.type = &snek_code_mem,
 		.addr = (void **) (void *) &stash_code,
@@ -68,7 +84,10 @@ static const struct snek_root	SNEK_ROOT_DECLARE(snek_root)[] = {
 
 #define SNEK_ROOT	(sizeof (snek_root) / sizeof (snek_root[0]))
 
-#define SNEK_BUSY_SIZE		((SNEK_POOL + 31) / 32)
+/* Offsets just past the end of the heap */
+#define SNEK_POOL_END		(SNEK_POOL_BASE + SNEK_POOL_SIZE)
+
+#define SNEK_BUSY_SIZE		((SNEK_POOL_END + 31) / 32)
 #define SNEK_NCHUNK_EST(pool)	((pool) / 64)
 
 struct snek_chunk {
@@ -82,29 +101,86 @@ struct snek_chunk {
 #ifdef SNEK_DYNAMIC
 static uint8_t	*snek_busy;
 static struct snek_chunk *snek_chunk;
-static snek_offset_t	SNEK_NCHUNK;
+static snek_soffset_t	SNEK_NCHUNK;
 
 typedef snek_soffset_t snek_chunk_t;
+typedef snek_offset_t snek_uchunk_t;
 
-bool
-snek_mem_alloc(snek_poly_t pool_size)
+/*
+ * Make the pool 'pool_size' bytes long, moving it if necessary. The
+ * busy bitmap and chunk array are only used during a collection, so
+ * they are simply replaced.
+ */
+static bool
+snek_mem_resize(uint32_t pool_size)
 {
-	snek_poly_t	busy_size = (pool_size + 31) / 32;
-
-	snek_pool = malloc(pool_size +
-				busy_size +
-				busy_size +
-				busy_size +
-				SNEK_NCHUNK_EST(pool_size) * sizeof (struct snek_chunk));
-	if (!snek_pool)
+	uint8_t			*busy = malloc((SNEK_POOL_BASE + pool_size + 31) / 32);
+	struct snek_chunk	*chunk = malloc(SNEK_NCHUNK_EST(pool_size) * sizeof (struct snek_chunk));
+	uintptr_t		old = (uintptr_t) snek_pool;
+	uint8_t			*pool;
+
+	if (!busy || !chunk) {
+		free(busy);
+		free(chunk);
 		return false;
-	snek_busy = snek_pool + pool_size;
-	snek_chunk = (struct snek_chunk *) (((uintptr_t)(snek_busy + busy_size) + 7) & ~7);
+	}
+	snek_mem_set_moving(true);
+#if SNEK_DEBUG
+	/* Always move the pool, so that stale pointers show up */
+	pool = malloc(SNEK_POOL_BASE + pool_size);
+	if (pool && snek_pool) {
+		memcpy(pool, snek_pool, SNEK_POOL_END);
+		memset(snek_pool, 0x55, SNEK_POOL_END);
+		free(snek_pool);
+	}
+#else
+	pool = realloc(snek_pool, SNEK_POOL_BASE + pool_size);
+#endif
+	if (!pool) {
+		free(busy);
+		free(chunk);
+		snek_mem_set_moving(false);
+		return false;
+	}
+	snek_pool = pool;
+	free(snek_busy);
+	snek_busy = busy;
+	free(snek_chunk);
+	snek_chunk = chunk;
 	snek_pool_size = pool_size;
 	SNEK_NCHUNK = SNEK_NCHUNK_EST(pool_size);
+
+	/* Everything in the pool uses offsets, except for the roots */
+	if (old) {
+		snek_offset_t i;
+		for (i = 0; i < (snek_offset_t) SNEK_ROOT; i++) {
+			void **a = SNEK_ROOT_ADDR(&snek_root[i]);
+			if (SNEK_ROOT_TYPE(&snek_root[i]) && a && *a)
+				*a = snek_pool + ((uintptr_t) *a - old);
+		}
+	}
+#if SNEK_STRING_CHARS
+	else
+		snek_string_chars_fill();
+#endif
+	snek_mem_set_moving(false);
 	return true;
 }
 
+static uint32_t
+snek_mem_limit(void)
+{
+	return snek_pool_limit < SNEK_POOL_MAX ? snek_pool_limit : SNEK_POOL_MAX;
+}
+
+bool
+snek_mem_alloc(uint32_t pool_size)
+{
+	if (pool_size > snek_mem_limit())
+		pool_size = snek_mem_limit();
+	return snek_mem_resize(pool_size & ~(SNEK_ALLOC_ROUND - 1));
+}
+
 #else
 
 #define SNEK_NCHUNK SNEK_NCHUNK_EST(SNEK_POOL)
@@ -124,14 +200,14 @@ typedef snek_offset_t snek_uchunk_t;
 
 static snek_offset_t	snek_note_list = SNEK_OFFSET_NONE;
 
-static snek_offset_t	snek_top;
+static snek_offset_t	snek_top = SNEK_POOL_BASE;
 
 /* Offset of an address within the pool. */
 static snek_offset_t pool_offset(const void *addr) {
 #if SNEK_DEBUG
 	if (addr == NULL)
 		snek_panic("null in pool_offset");
-	if ((uint8_t *) addr < snek_pool || &snek_pool[SNEK_POOL] <= (uint8_t *) addr)
+	if ((uint8_t *) addr < snek_pool || &snek_pool[SNEK_POOL_END] <= (uint8_t *) addr)
 		snek_panic("out of bounds in pool_offset");
 	if (((uintptr_t) addr & (SNEK_ALLOC_ROUND-1)) != 0)
 		snek_panic("unaligned addr in pool_offset");
@@ -144,7 +220,7 @@ static void *pool_addr(snek_offset_t offset) {
 #if SNEK_DEBUG
 	if (snek_offset_is_none(offset))
 		snek_panic("none in pool_addr");
-	if (offset >= SNEK_POOL)
+	if (offset >= SNEK_POOL_END)
 		snek_panic("out of bounds in pool_addr");
 	if ((offset & (SNEK_ALLOC_ROUND-1)) != 0)
 		snek_panic("unaligned offset in pool_addr");
@@ -172,7 +248,18 @@ bool
 snek_is_pool_addr(const void *addr)
 {
 	const uint8_t *a = addr;
-	return (snek_pool <= a) && (a < snek_pool + SNEK_POOL);
+	return (snek_pool + SNEK_POOL_BASE <= a) && (a < snek_pool + SNEK_POOL_END);
+}
+
+/*
+ * Does 'addr' move along with the pool? This includes the
+ * one-character strings, which the collector doesn't touch
+ */
+bool
+snek_is_pool_moving(const void *addr)
+{
+	const uint8_t *a = addr;
+	return (snek_pool <= a) && (a < snek_pool + SNEK_POOL_END);
 }
 
 static snek_offset_t
@@ -228,7 +315,7 @@ static void
 note_chunk(snek_offset_t offset, snek_offset_t size)
 {
 	snek_chunk_t chunk;
-	snek_offset_t end;
+	snek_chunk_t end;
 
 	if (offset < chunk_low || chunk_high <= offset)
 		return;
@@ -360,6 +447,11 @@ snek_collect(uint8_t style)
 	snek_offset_t	top;
 
 	debug_memory("Collect...\n");
+	snek_mem_set_moving(true);
+#if SNEK_STRING_GROW
+	/* Objects may move or be freed */
+	snek_string_grow = SNEK_NULL;
+#endif
 	/* The first time through, we're doing a full collect */
 	if (snek_last_top == 0)
 		style = SNEK_COLLECT_FULL;
@@ -372,11 +464,23 @@ snek_collect(uint8_t style)
 	if (style == SNEK_COLLECT_FULL)
 		snek_collect_counts = 0;
 
+#if SNEK_STATS
+	uint32_t start = SNEK_STATS_USEC();
+	if (style == SNEK_COLLECT_FULL)
+		snek_stats.collect_full++;
+	else
+		snek_stats.collect_incremental++;
+#endif
+
 	if (style == SNEK_COLLECT_FULL) {
-		chunk_low = top = 0;
+		chunk_low = top = SNEK_POOL_BASE;
 	} else {
 		chunk_low = top = snek_last_top;
 	}
+#if SNEK_ALLOC_PROFILE
+	if (snek_alloc_profiling)
+		snek_alloc_note_collect(chunk_low);
+#endif
 	for (;;) {
 		/* Find the sizes of the first chunk of objects to move */
 		reset_chunks();
@@ -394,6 +498,10 @@ snek_collect(uint8_t style)
 			if (snek_chunk[c].old_offset > top)
 				break;
 
+#if SNEK_ALLOC_PROFILE
+			if (snek_alloc_profiling)
+				snek_alloc_note_live(top, top, size);
+#endif
 			top += size;
 		}
 
@@ -423,10 +531,15 @@ snek_collect(uint8_t style)
 			       snek_chunk[c].old_offset, top, size);
 
 			snek_chunk[c].new_offset = top;
+#if SNEK_ALLOC_PROFILE
+			if (snek_alloc_profiling)
+				snek_alloc_note_live(snek_chunk[c].old_offset, top, size);
+#endif
 
 			memmove(&snek_pool[top],
 				&snek_pool[snek_chunk[c].old_offset],
 				size);
+			snek_stats_add(moved_bytes, size);
 
 			top += size;
 		}
@@ -451,9 +564,15 @@ snek_collect(uint8_t style)
 	snek_top = top;
 	if (style == SNEK_COLLECT_FULL)
 		snek_last_top = top;
+#if SNEK_ALLOC_PROFILE
+	if (snek_alloc_profiling)
+		snek_alloc_note_done();
+#endif
+	snek_stats_add(collect_usec, SNEK_STATS_USEC() - start);
+	snek_mem_set_moving(false);
 
-	debug_memory("%d free\n", SNEK_POOL - snek_top);
-	return SNEK_POOL - snek_top;
+	debug_memory("%d free\n", SNEK_POOL_END - snek_top);
+	return SNEK_POOL_END - snek_top;
 }
 
 /*
@@ -495,8 +614,14 @@ type_name(const struct snek_mem *type)
 		return "compile";
 	if (type == &snek_frame_mem)
 		return "frame";
+	if (type == &snek_globals_mem)
+		return "globals";
 	if (type == &snek_name_mem)
 		return "name";
+#if SNEK_NAME_HASH
+	if (type == &snek_name_hash_mem)
+		return "name hash";
+#endif
 	snek_type_t t = (type - _snek_mems) + 1;
 	switch (t) {
 	case snek_list:
@@ -585,6 +710,12 @@ snek_poly_mark(snek_poly_t p)
 
 	addr = snek_ref(p);
 
+#if SNEK_STRING_CHARS
+	/* One-character strings in the table past the pool never move */
+	if (!snek_is_pool_addr(addr))
+		return true;
+#endif
+
 	if (type == snek_list) {
 		debug_memory("\tmark list %d\n", pool_offset(addr));
 	}
@@ -692,6 +823,12 @@ snek_poly_move(snek_poly_t *ref)
 
 	orig_addr = addr = snek_ref(p);
 
+#if SNEK_STRING_CHARS
+	/* One-character strings in the table past the pool never move */
+	if (!snek_is_pool_addr(addr))
+		return true;
+#endif
+
 	if (type == snek_list) {
 		debug_memory("\tmove list %d\n", pool_offset(addr));
 	}
@@ -712,26 +849,211 @@ snek_poly_move(snek_poly_t *ref)
 	return ret;
 }
 
+#if SNEK_STATS
+static void
+snek_stats_peak(void)
+{
+	snek_offset_t	heap = snek_top - SNEK_POOL_BASE;
+
+	if (heap > snek_stats.peak_heap)
+		snek_stats.peak_heap = heap;
+}
+#endif
+
+#ifdef SNEK_DYNAMIC
+/*
+ * Grow the pool to make room for 'size' more bytes, at least doubling
+ * it to keep the number of moves down
+ */
+static bool
+snek_mem_grow(snek_offset_t size)
+{
+	uint32_t	need = snek_top - SNEK_POOL_BASE + size;
+	uint32_t	pool_size = snek_pool_size * 2;
+
+	if (pool_size < need)
+		pool_size = need;
+	if (pool_size > snek_mem_limit())
+		pool_size = snek_mem_limit() & ~(SNEK_ALLOC_ROUND - 1);
+	if (pool_size < need || pool_size <= snek_pool_size)
+		return false;
+	debug_memory("Grow pool from %d to %d\n", snek_pool_size, pool_size);
+	return snek_mem_resize(pool_size);
+}
+#endif
+
+/*
+ * Allocate without reporting failure, for storage the caller can
+ * do without
+ */
 void *
-snek_alloc(snek_offset_t size)
+snek_try_alloc(snek_offset_t size)
 {
 	void	*addr;
 
 	size = snek_size_round(size);
-	if (SNEK_POOL - snek_top < size &&
-	    snek_collect(SNEK_COLLECT_INCREMENTAL) < size &&
-	    snek_collect(SNEK_COLLECT_FULL) < size)
+	if (SNEK_POOL_END - snek_top < size &&
+	    snek_collect(SNEK_COLLECT_INCREMENTAL) < size)
 	{
-		snek_error("out of memory");
-		return NULL;
+		snek_offset_t	avail = snek_collect(SNEK_COLLECT_FULL);
+
+#ifdef SNEK_DYNAMIC
+		/*
+		 * Grow when the heap is still short, or so nearly full that
+		 * another collection would soon be needed
+		 */
+		if (avail < size + (SNEK_POOL_SIZE >> 2) && snek_mem_grow(size))
+			avail = SNEK_POOL_END - snek_top;
+#endif
+		if (avail < size) {
+#if SNEK_NAME_HASH
+			/* The name index can be rebuilt later */
+			if (!snek_name_hash)
+				return NULL;
+			snek_name_hash = NULL;
+			if (snek_collect(SNEK_COLLECT_FULL) < size)
+#endif
+				return NULL;
+		}
 	}
 	addr = pool_addr(snek_top);
 	memset(addr, '\0', size);
 	debug_memory("Alloc %d size %d\n", snek_top, size);
 	snek_top += size;
+#if SNEK_ALLOC_PROFILE
+	if (snek_alloc_profiling)
+		snek_alloc_note(pool_offset(addr), size);
+#endif
+#if SNEK_STATS
+	snek_stats.allocs++;
+	snek_stats.alloc_bytes += size;
+	snek_stats_peak();
+#endif
+	return addr;
+}
+
+void *
+snek_alloc(snek_offset_t size)
+{
+	void	*addr = snek_try_alloc(size);
+
+	if (!addr)
+		snek_error("out of memory");
 	return addr;
 }
 
+/*
+ * Extend the most recently allocated object from 'size' to
+ * 'new_size' bytes without moving it. Fails when the object isn't at
+ * the top of the heap, when it lies below the region an incremental
+ * collection compacts, or when the space isn't free.
+ */
+bool
+snek_alloc_grow(void *addr, snek_offset_t size, snek_offset_t new_size)
+{
+	snek_offset_t	offset;
+
+	if (!snek_is_pool_addr(addr))
+		return false;
+	offset = pool_offset(addr);
+	size = snek_size_round(size);
+	new_size = snek_size_round(new_size);
+	if (offset + size != snek_top || offset < snek_last_top ||
+	    SNEK_POOL_END - offset < new_size)
+		return false;
+	if (new_size > size) {
+		memset(pool_addr(snek_top), '\0', new_size - size);
+		debug_memory("Grow %d size %d to %d\n", offset, size, new_size);
+		snek_top = offset + new_size;
+#if SNEK_ALLOC_PROFILE
+		if (snek_alloc_profiling)
+			snek_alloc_note_grow(offset, new_size - size);
+#endif
+#if SNEK_STATS
+		snek_stats.alloc_bytes += new_size - size;
+		snek_stats_peak();
+#endif
+	}
+	return true;
+}
+
+#if SNEK_IMAGE
+
+/*
+ * An image is the number of roots, the top of the heap, the roots and
+ * then the pool up to the top. Everything within the pool refers to
+ * other objects by offset, so it works wherever the pool ends up.
+ * Typed roots are saved as offsets, the others as poly values.
+ */
+bool
+snek_mem_save(bool (*put)(const void *data, uint32_t size, void *closure), void *closure)
+{
+	uint32_t	nroot = SNEK_ROOT;
+	uint32_t	roots[SNEK_ROOT];
+	uint32_t	top;
+	snek_offset_t	i;
+
+	snek_collect(SNEK_COLLECT_FULL);
+	for (i = 0; i < (snek_offset_t) SNEK_ROOT; i++) {
+		void **a = SNEK_ROOT_ADDR(&snek_root[i]);
+		if (SNEK_ROOT_TYPE(&snek_root[i]))
+			roots[i] = *a ? pool_offset(*a) : SNEK_OFFSET_NONE;
+		else
+			roots[i] = ((snek_poly_t *) a)->u;
+	}
+	top = snek_top;
+	return (put(&nroot, sizeof (nroot), closure) &&
+		put(&top, sizeof (top), closure) &&
+		put(roots, sizeof (roots), closure) &&
+		put(snek_pool, top, closure));
+}
+
+/*
+ * Replace the heap with a saved image. When this fails after reading
+ * the roots, the heap is left in pieces.
+ */
+bool
+snek_mem_load(bool (*get)(void *data, uint32_t size, void *closure), void *closure)
+{
+	uint32_t	nroot, top;
+	uint32_t	roots[SNEK_ROOT];
+	snek_offset_t	i;
+
+	if (!get(&nroot, sizeof (nroot), closure) || nroot != SNEK_ROOT ||
+	    !get(&top, sizeof (top), closure) ||
+	    top < SNEK_POOL_BASE || (top & (SNEK_ALLOC_ROUND - 1)) != 0)
+		return false;
+#ifdef SNEK_DYNAMIC
+	if (top > SNEK_POOL_END && !snek_mem_alloc(top - SNEK_POOL_BASE))
+		return false;
+#endif
+	if (top > SNEK_POOL_END)
+		return false;
+	if (!get(roots, sizeof (roots), closure) ||
+	    !get(snek_pool, top, closure))
+		return false;
+	for (i = 0; i < (snek_offset_t) SNEK_ROOT; i++) {
+		void **a = SNEK_ROOT_ADDR(&snek_root[i]);
+		if (SNEK_ROOT_TYPE(&snek_root[i]))
+			*a = snek_pool_addr((snek_offset_t) roots[i]);
+		else
+			((snek_poly_t *) a)->u = roots[i];
+	}
+	snek_top = top;
+	snek_last_top = top;
+	snek_note_list = SNEK_OFFSET_NONE;
+#if SNEK_ALLOC_PROFILE
+	if (snek_alloc_profiling)
+		snek_alloc_note_reset();
+#endif
+#if SNEK_STATS
+	snek_stats_peak();
+#endif
+	return true;
+}
+
+#endif
+
 void
 snek_code_stash(snek_code_t *code)
 {
@@ -17,6 +17,10 @@
 snek_name_t *snek_names;
 snek_id_t   snek_id = SNEK_BUILTIN_END;
 
+#if SNEK_NAME_HASH
+snek_name_hash_t *snek_name_hash;
+#endif
+
 #define SNEK_BUILTIN_DATA
 #include "snek-builtin.h"
 
@@ -77,6 +81,82 @@ snek_name_string_builtin(snek_id_t id)
 	return NULL;
 }
 
+#if SNEK_NAME_HASH
+
+#define SNEK_NAME_HASH_MIN	16
+
+static snek_offset_t
+snek_name_hash_value(const char *name)
+{
+	snek_offset_t	h = 0;
+
+	while (*name)
+		h = h * 31 + (uint8_t) *name++;
+	return h;
+}
+
+static snek_name_bucket_t *
+snek_name_hash_bucket(snek_name_hash_t *hash, const char *name)
+{
+	snek_offset_t		mask = hash->nbucket - 1;
+	snek_offset_t		i = snek_name_hash_value(name) & mask;
+	snek_name_bucket_t	*b;
+
+	for (;;) {
+		b = &hash->bucket[i];
+		if (b->id == SNEK_ID_NONE)
+			return b;
+		if (!strcmp(((snek_name_t *) snek_pool_addr(b->name))->name, name))
+			return b;
+		i = (i + 1) & mask;
+	}
+}
+
+static void
+snek_name_hash_insert(snek_name_hash_t *hash, snek_name_t *n, snek_id_t id)
+{
+	snek_name_bucket_t *b = snek_name_hash_bucket(hash, n->name);
+
+	b->name = snek_pool_offset(n);
+	b->id = id;
+	hash->count++;
+}
+
+/*
+ * Add the newest name to the index. When the table is three quarters
+ * full, it is discarded and rebuilt from snek_names at a larger size.
+ * If there isn't space for that, names are found by walking the list
+ * until a later rebuild succeeds.
+ */
+static void
+snek_name_hash_add(snek_name_t *n)
+{
+	snek_offset_t		count = snek_id - SNEK_BUILTIN_END;
+	snek_offset_t		nbucket = SNEK_NAME_HASH_MIN;
+	snek_name_hash_t	*hash = snek_name_hash;
+	snek_id_t		id;
+
+	if (hash && (hash->count + 1) * 4 <= hash->nbucket * 3) {
+		snek_name_hash_insert(hash, n, snek_id);
+		return;
+	}
+	while (nbucket * 3 < count * 4)
+		nbucket *= 2;
+	snek_name_hash = NULL;
+	snek_alloc_kind(name);
+	hash = snek_try_alloc(sizeof (snek_name_hash_t) +
+			      nbucket * sizeof (snek_name_bucket_t));
+	if (!hash)
+		return;
+	hash->nbucket = nbucket;
+	id = snek_id;
+	for (n = snek_names; n; n = snek_pool_addr(n->next))
+		snek_name_hash_insert(hash, n, id--);
+	snek_name_hash = hash;
+}
+
+#endif
+
 snek_id_t
 snek_name_id(char *name, bool *keyword)
 {
@@ -89,11 +169,19 @@ snek_name_id(char *name, bool *keyword)
 	*keyword = false;
 
 	id = snek_id;
+#if SNEK_NAME_HASH
+	if (snek_name_hash) {
+		snek_name_bucket_t *b = snek_name_hash_bucket(snek_name_hash, name);
+		if (b->id != SNEK_ID_NONE)
+			return b->id;
+	} else
+#endif
 	for (n = snek_names; n; n = snek_pool_addr(n->next)) {
 		if (!strcmp(n->name, name))
 			return id;
 		id--;
 	}
+	snek_alloc_kind(name);
 	n = snek_alloc(sizeof (snek_name_t) + strlen(name) + 1);
 	if (!n)
 		return SNEK_ID_NONE;
@@ -101,6 +189,9 @@ snek_name_id(char *name, bool *keyword)
 	n->next = snek_pool_offset(snek_names);
 	snek_id++;
 	snek_names = n;
+#if SNEK_NAME_HASH
+	snek_name_hash_add(n);
+#endif
 	return snek_id;
 }
 
@@ -109,7 +200,8 @@ snek_name_string(snek_id_t match_id)
 {
 	const char *b;
 
-	if ((b = snek_name_string_builtin(match_id)))
+	/* Keywords are in the builtin table too, their tokens can match larger ids */
+	if (match_id < SNEK_BUILTIN_END && (b = snek_name_string_builtin(match_id)))
 		return b;
 
 	snek_name_t *n;
@@ -163,3 +255,41 @@ const snek_mem_t SNEK_MEM_DECLARE(snek_name_mem) = {
 	.move = snek_name_move,
 	SNEK_MEM_DECLARE_NAME("name")
 };
+
+#if SNEK_NAME_HASH
+
+static snek_offset_t
+snek_name_hash_size(void *addr)
+{
+	snek_name_hash_t *hash = addr;
+
+	return (snek_offset_t) sizeof (snek_name_hash_t) +
+		hash->nbucket * (snek_offset_t) sizeof (snek_name_bucket_t);
+}
+
+/* The names themselves are held by snek_names */
+static void
+snek_name_hash_mark(void *addr)
+{
+	(void) addr;
+}
+
+static void
+snek_name_hash_move(void *addr)
+{
+	snek_name_hash_t *hash = addr;
+	snek_offset_t i;
+
+	for (i = 0; i < hash->nbucket; i++)
+		if (hash->bucket[i].id != SNEK_ID_NONE)
+			snek_move_block_offset(&hash->bucket[i].name);
+}
+
+const snek_mem_t SNEK_MEM_DECLARE(snek_name_hash_mem) = {
+	.size = snek_name_hash_size,
+	.mark = snek_name_hash_mark,
+	.move = snek_name_hash_move,
+	SNEK_MEM_DECLARE_NAME("name hash")
+};
+
+#endif
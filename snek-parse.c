@@ -20,10 +20,19 @@ bool snek_interactive;
 static bool snek_print_val;
 
 uint8_t snek_parse_nformal;
-snek_id_t snek_parse_formals[SNEK_MAX_FORMALS];
+uint8_t snek_parse_nlocal;
+snek_id_t snek_parse_formals[SNEK_MAX_LOCALS];
 
 snek_token_val_t snek_token_val;
 
+#if SNEK_IMPORT
+/* The module named by the last 'import', for snek_parse to load */
+snek_id_t snek_parse_import;
+
+/* Set when any statement fails to compile or run */
+bool snek_parse_failed;
+#endif
+
 #define GRAMMAR_TABLE
 #include "snek-gram.h"
 
@@ -167,6 +176,16 @@ snek_parse(void)
 
 		parse_return_t ret = parse(NULL);
 
+#if SNEK_IMPORT
+		if (ret != parse_return_success) {
+			snek_parse_failed = true;
+		} else if (snek_parse_import != SNEK_ID_NONE) {
+			snek_id_t id = snek_parse_import;
+			snek_parse_import = SNEK_ID_NONE;
+			snek_import(id);
+			continue;
+		}
+#endif
 		switch (ret) {
 		case parse_return_success:
 			return snek_parse_success;
@@ -80,7 +80,12 @@ snek_poly_equal(snek_poly_t a, snek_poly_t b, bool is)
 		return false;
 	switch (atype) {
 	case snek_string:
-		return !strcmp(snek_poly_to_string(a), snek_poly_to_string(b));
+	{
+		char *as = snek_poly_to_string(a);
+		char *bs = snek_poly_to_string(b);
+		snek_offset_t len = snek_string_len(as);
+		return len == snek_string_len(bs) && !memcmp(as, bs, len);
+	}
 	case snek_list:
 		if (!is)
 			return snek_list_equal(snek_poly_to_list(a), snek_poly_to_list(b));
@@ -100,7 +105,7 @@ snek_poly_true(snek_poly_t a)
 	case snek_list:
 		return snek_poly_to_list(a)->size != 0;
 	case snek_string:
-		return strlen(snek_poly_to_string(a)) != 0;
+		return snek_string_len(snek_poly_to_string(a)) != 0;
 	default:
 		return false;
 	}
@@ -111,7 +116,7 @@ snek_poly_len(snek_poly_t a)
 {
 	switch (snek_poly_type(a)) {
 	case snek_string:
-		return strlen(snek_poly_to_string(a));
+		return snek_string_len(snek_poly_to_string(a));
 	case snek_list:
 		return snek_poly_to_list(a)->size;
 	default:
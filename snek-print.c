@@ -102,17 +102,29 @@ snek_poly_format(snek_buf_t *buf, snek_poly_t a, char format)
 		break;
 	case snek_list:
 	{
-		snek_list_t *list = snek_poly_to_list(a);
-		buf->put_c(snek_list_readonly(list) ? '(' : '[', closure);
-		snek_poly_t *data = snek_pool_addr(list->data);
-		for (snek_offset_t o = 0; o < list->size; o++) {
+		/*
+		 * Formatting into a string allocates, which may move
+		 * the list; keep it on the stack to find it again. When
+		 * the stack is full, snek_abort stops any allocation.
+		 */
+		snek_list_t	*list = snek_poly_to_list(a);
+		snek_offset_t	stackp = snek_stackp;
+		bool		readonly = snek_list_readonly(list);
+		snek_offset_t	size = list->size;
+
+		snek_stack_push(a);
+		buf->put_c(readonly ? '(' : '[', closure);
+		for (snek_offset_t o = 0; o < size; o++) {
 			if (o)
 				buf->put_c(' ', closure);
-			snek_poly_format(buf, data[o], format);
-			if (o < list->size - 1 || (list->size == 1 && snek_list_readonly(list)))
+			if (snek_stackp != stackp)
+				list = snek_poly_to_list(snek_stack_pick(0));
+			snek_poly_format(buf, snek_list_data(list)[o], format);
+			if (o < size - 1 || (size == 1 && readonly))
 				buf->put_c(',', closure);
 		}
-		buf->put_c(snek_list_readonly(list) ? ')' : ']', closure);
+		buf->put_c(readonly ? ')' : ']', closure);
+		snek_stackp = stackp;
 		break;
 	}
 	}
@@ -0,0 +1,283 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+/*
+ * Instruction handlers for snek_code_run. This is included inside
+ * the interpreter loop, once as the body of a switch statement or,
+ * with SNEK_THREADED, twice to make separate handlers for the plain
+ * and push forms of each instruction. See snek-code.c for the macros.
+ */
+
+SNEK_RUN_OP(eq)
+SNEK_RUN_OP(ne)
+SNEK_RUN_OP(gt)
+SNEK_RUN_OP(lt)
+SNEK_RUN_OP(ge)
+SNEK_RUN_OP(le)
+
+SNEK_RUN_OP(is)
+SNEK_RUN_OP(is_not)
+SNEK_RUN_OP(in)
+SNEK_RUN_OP(not_in)
+
+SNEK_RUN_OP(array)
+
+SNEK_RUN_OP(plus)
+SNEK_RUN_OP(minus)
+SNEK_RUN_OP(times)
+SNEK_RUN_OP(divide)
+SNEK_RUN_OP(div)
+SNEK_RUN_OP(mod)
+SNEK_RUN_OP(pow)
+SNEK_RUN_OP(land)
+SNEK_RUN_OP(lor)
+SNEK_RUN_OP(lxor)
+SNEK_RUN_OP(lshift)
+SNEK_RUN_OP(rshift)
+	snek_a = snek_binary(snek_stack_pick(0), SNEK_RUN_CODE, snek_a, false);
+	snek_stack_drop(1);
+	SNEK_RUN_NEXT;
+
+SNEK_RUN_OP(assign_plus)
+SNEK_RUN_OP(assign_minus)
+SNEK_RUN_OP(assign_times)
+SNEK_RUN_OP(assign_divide)
+SNEK_RUN_OP(assign_div)
+SNEK_RUN_OP(assign_mod)
+SNEK_RUN_OP(assign_pow)
+SNEK_RUN_OP(assign_land)
+SNEK_RUN_OP(assign_lor)
+SNEK_RUN_OP(assign_lxor)
+SNEK_RUN_OP(assign_lshift)
+SNEK_RUN_OP(assign_rshift)
+
+SNEK_RUN_OP(assign)
+SNEK_RUN_OP(assign_named)
+	SNEK_RUN_CHECK;
+	memcpy(&id, &snek_code->code[ip], sizeof (snek_id_t));
+	ip += sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	snek_assign(id, SNEK_RUN_CODE, ip - SNEK_CACHE_SIZE);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(assign_local)
+	SNEK_RUN_CHECK;
+	memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
+	ip += sizeof (snek_offset_t) + SNEK_CACHE_SIZE;
+	snek_assign_local(o, ip - SNEK_CACHE_SIZE);
+	SNEK_RUN_NEXT;
+
+SNEK_RUN_OP(num)
+	memcpy(&snek_a.f, &snek_code->code[ip], sizeof(float));
+	ip += sizeof(float);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(int)
+	snek_a.f = (int8_t) snek_code->code[ip];
+	ip += 1;
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(string)
+	memcpy(&o, &snek_code->code[ip], sizeof(snek_offset_t));
+	ip += sizeof (snek_offset_t);
+	snek_a = snek_offset_to_poly(o, snek_string);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(list)
+SNEK_RUN_OP(tuple)
+	memcpy(&o, &snek_code->code[ip], sizeof(snek_offset_t));
+	ip += sizeof (snek_offset_t);
+	snek_a = snek_list_imm(o, SNEK_RUN_CODE == snek_op_tuple);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(local)
+	memcpy(&o, &snek_code->code[ip], sizeof(snek_offset_t));
+	ip += sizeof (snek_offset_t) + SNEK_CACHE_SIZE;
+	snek_a = snek_frame->variables[o].value;
+	/* not assigned yet, or declared global */
+	if (snek_is_unset(snek_a) || snek_is_global(snek_a))
+		snek_run_id(snek_frame->variables[o].id, ip - SNEK_CACHE_SIZE);
+	else
+		snek_string_grow_read(snek_a);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(id)
+	memcpy(&id, &snek_code->code[ip], sizeof(snek_id_t));
+	ip += sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	snek_run_id(id, ip - SNEK_CACHE_SIZE);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(not)
+	snek_a = snek_bool_to_poly(!snek_poly_true(snek_a));
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(uminus)
+	snek_a = snek_float_to_poly(-snek_poly_get_float(snek_a));
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(lnot)
+	snek_a = snek_float_to_poly(~(uint32_t) snek_poly_get_float(snek_a));
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(call)
+	SNEK_RUN_CHECK;
+	{
+		memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
+		snek_offset_t nposition = (o & 0xff);
+		snek_offset_t nnamed = (o >> 8);
+		snek_offset_t nstack = nposition + (nnamed<<1);
+		snek_a = snek_stack_pick(nstack);
+		switch (snek_poly_type(snek_a)) {
+		case snek_func:
+			if (!snek_func_push(nposition, nnamed, ip - 1))
+				break;
+			snek_a = snek_stack_pop();	/* get function back */
+			snek_code = snek_pool_addr(snek_poly_to_func(snek_a)->code);
+			ip = 0;
+			/* will pick up push on return */
+			SNEK_RUN_ENTER;
+		case snek_builtin:
+			snek_call_builtin(snek_poly_to_builtin(snek_a), nposition, nnamed);
+			break;
+		default:
+			snek_error("not a func: %p", snek_a);
+			break;
+		}
+		ip += sizeof (snek_offset_t);
+		snek_stack_drop(nstack + 1);
+	}
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(slice)
+	snek_slice(snek_code->code[ip]);
+	ip++;
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(global)
+	memcpy(&id, &snek_code->code[ip], sizeof (snek_id_t));
+	ip += sizeof (snek_id_t);
+	snek_frame_mark_global(id);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(name)
+	memcpy(&id, &snek_code->code[ip], sizeof (snek_id_t));
+	ip += sizeof (snek_id_t);
+	snek_a = snek_float_to_poly(id);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(branch)
+	memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
+	SNEK_RUN_BRANCH(o);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(branch_true)
+	if (snek_poly_true(snek_a)) {
+		memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
+		SNEK_RUN_BRANCH(o);
+	} else
+		ip += sizeof (snek_offset_t);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(branch_false)
+	if (!snek_poly_true(snek_a)) {
+		memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
+		SNEK_RUN_BRANCH(o);
+	} else
+		ip += sizeof (snek_offset_t);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(forward)
+	snek_error("not in loop");
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(range_start)
+	snek_range_start(ip);
+	ip += sizeof (snek_offset_t) + sizeof (uint8_t);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(range_step)
+	SNEK_RUN_CHECK;
+	if (!snek_range_step(ip))
+		memcpy(&ip, &snek_code->code[ip], sizeof (snek_offset_t));
+	else
+		ip += sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof(snek_id_t) + SNEK_CACHE_SIZE;
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(in_start)
+	snek_in_start(ip);
+	ip += sizeof (uint8_t);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(in_step)
+	SNEK_RUN_CHECK;
+	if (!snek_in_step(ip))
+		memcpy(&ip, &snek_code->code[ip], sizeof (snek_offset_t));
+	else
+		ip += sizeof (snek_offset_t) + sizeof (uint8_t) + sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(in_end)
+	snek_loop_state(snek_code->code[ip], false)[0].value = SNEK_NULL;
+	ip += sizeof (uint8_t);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(line)
+	memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
+	ip += sizeof (snek_offset_t);
+	snek_line = o;
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(null)
+	snek_a = SNEK_NULL;
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(nop)
+	SNEK_RUN_NEXT;
+
+#if SNEK_FUSE
+SNEK_RUN_OP(int_binary)
+	snek_a = snek_binary(snek_stack_pick(0), (snek_op_t) snek_code->code[ip],
+			     snek_float_to_poly((int8_t) snek_code->code[ip+1]), false);
+	ip += 2;
+	snek_stack_drop(1);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(compare_branch)
+SNEK_RUN_OP(int_compare_branch)
+	if (SNEK_RUN_CODE == snek_op_int_compare_branch)
+		snek_a = snek_float_to_poly((int8_t) snek_code->code[ip + sizeof (snek_offset_t) + 1]);
+	snek_a = snek_binary(snek_stack_pick(0), (snek_op_t) snek_code->code[ip + sizeof (snek_offset_t)],
+			     snek_a, false);
+	snek_stack_drop(1);
+	if (!snek_poly_true(snek_a)) {
+		memcpy(&o, &snek_code->code[ip], sizeof (snek_offset_t));
+		SNEK_RUN_BRANCH(o);
+	} else
+		ip += snek_op_extra_size(SNEK_RUN_CODE);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(id_array)
+	memcpy(&id, &snek_code->code[ip], sizeof(snek_id_t));
+	ip += sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	snek_run_id(id, ip - SNEK_CACHE_SIZE);
+	snek_a = snek_binary(snek_stack_pick(0), snek_op_array, snek_a, false);
+	snek_stack_drop(1);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(local_array)
+	memcpy(&o, &snek_code->code[ip], sizeof(snek_offset_t));
+	ip += sizeof (snek_offset_t) + SNEK_CACHE_SIZE;
+	snek_a = snek_frame->variables[o].value;
+	if (snek_is_unset(snek_a) || snek_is_global(snek_a))
+		snek_run_id(snek_frame->variables[o].id, ip - SNEK_CACHE_SIZE);
+	snek_a = snek_binary(snek_stack_pick(0), snek_op_array, snek_a, false);
+	snek_stack_drop(1);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(id_int_assign)
+	memcpy(&id, &snek_code->code[ip], sizeof(snek_id_t));
+	ip += sizeof (snek_id_t) + SNEK_CACHE_SIZE;
+	snek_run_id(id, ip - SNEK_CACHE_SIZE);
+	SNEK_RUN_CHECK;
+	snek_a = snek_binary(snek_a, (snek_op_t) snek_code->code[ip],
+			     snek_float_to_poly((int8_t) snek_code->code[ip+1]), false);
+	ip += 2;
+	SNEK_RUN_CHECK;
+	snek_assign(id, snek_op_assign, ip - 2 - SNEK_CACHE_SIZE);
+	SNEK_RUN_NEXT;
+SNEK_RUN_OP(local_int_assign)
+	memcpy(&o, &snek_code->code[ip], sizeof(snek_offset_t));
+	ip += sizeof (snek_offset_t) + SNEK_CACHE_SIZE;
+	snek_a = snek_frame->variables[o].value;
+	if (snek_is_unset(snek_a) || snek_is_global(snek_a)) {
+		snek_run_id(snek_frame->variables[o].id, ip - SNEK_CACHE_SIZE);
+		SNEK_RUN_CHECK;
+	}
+	snek_a = snek_binary(snek_a, (snek_op_t) snek_code->code[ip],
+			     snek_float_to_poly((int8_t) snek_code->code[ip+1]), false);
+	ip += 2;
+	SNEK_RUN_CHECK;
+	snek_assign_local((snek_op_assign << 8) | o, ip - 2 - SNEK_CACHE_SIZE);
+	SNEK_RUN_NEXT;
+#endif
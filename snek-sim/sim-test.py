@@ -0,0 +1,34 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Drive forward until the sensor on pin 14 sees the wall,
+# then back up for a second and stop
+
+motor = (5, 4)
+sensor = 14
+
+def seek():
+    talkto(motor)
+    listento(sensor)
+    setpower(0.5)
+    setleft()
+    on()
+    while read() < 0.5:
+        time.sleep(0.25)
+    setright()
+    setpower(1)
+    onfor(1)
+    stopall()
+
+seek()
@@ -0,0 +1,353 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+/*
+ * Simulation of the snek-duino GPIO builtins. Pin state follows
+ * snek-duino.c, but changes are logged instead of driving hardware
+ * and time.sleep advances a virtual clock without waiting.
+ *
+ *	SNEK_SIM_LOG	file receiving the pin activity log (default stderr)
+ *	SNEK_SIM_INPUT	file of "<time> <pin> <value>" lines which set
+ *			the value returned by read() from that time on
+ */
+
+#include "snek.h"
+
+#define NUM_PIN	21
+
+static uint8_t	power_pin;
+static uint8_t	dir_pin;
+static uint8_t	input_pin;
+static uint8_t	power[NUM_PIN];
+static uint8_t	level[NUM_PIN];
+static uint32_t	on_pins;
+static uint32_t	out_pins;
+static float	input[NUM_PIN];
+
+static double	sim_time;
+static FILE	*sim_log;
+
+struct sim_input {
+	double	time;
+	uint8_t	pin;
+	float	value;
+};
+
+static struct sim_input	*sim_inputs;
+static int		sim_ninput;
+static int		sim_next_input;
+
+static void
+sim_printf(const char *fmt, ...)
+{
+	va_list	args;
+
+	fprintf(sim_log, "%10.3f ", sim_time);
+	va_start(args, fmt);
+	vfprintf(sim_log, fmt, args);
+	va_end(args);
+	putc('\n', sim_log);
+}
+
+static void
+sim_load_inputs(const char *name)
+{
+	FILE	*f = fopen(name, "r");
+	char	line[256];
+	int	nalloc = 0;
+
+	if (!f) {
+		perror(name);
+		exit(1);
+	}
+	while (fgets(line, sizeof (line), f)) {
+		double	time;
+		int	pin;
+		float	value;
+
+		if (line[0] == '#')
+			continue;
+		if (sscanf(line, "%lf %d %f", &time, &pin, &value) != 3)
+			continue;
+		if (pin < 0 || NUM_PIN <= pin) {
+			fprintf(stderr, "%s: invalid pin %d\n", name, pin);
+			exit(1);
+		}
+		if (sim_ninput == nalloc) {
+			nalloc = nalloc ? nalloc * 2 : 16;
+			sim_inputs = realloc(sim_inputs, nalloc * sizeof (struct sim_input));
+			if (!sim_inputs) {
+				perror(name);
+				exit(1);
+			}
+		}
+		sim_inputs[sim_ninput++] = (struct sim_input) {
+			.time = time,
+			.pin = pin,
+			.value = value
+		};
+	}
+	fclose(f);
+}
+
+static void
+sim_init(void)
+{
+	const char	*name;
+	uint8_t		p;
+
+	if (sim_log)
+		return;
+
+	sim_log = stderr;
+	if ((name = getenv("SNEK_SIM_LOG"))) {
+		sim_log = fopen(name, "w");
+		if (!sim_log) {
+			perror(name);
+			exit(1);
+		}
+	}
+	if ((name = getenv("SNEK_SIM_INPUT")))
+		sim_load_inputs(name);
+
+	memset(power, 0xff, NUM_PIN);
+
+	/* digital inputs are pulled up */
+	for (p = 0; p < 14; p++)
+		input[p] = 1.0f;
+}
+
+static bool
+has_pwm(uint8_t p)
+{
+	return ((p) == 3 || (p) == 5 || (p) == 6 || (p) == 9 || (p) == 10 || (p) == 11);
+}
+
+static void
+set_dir(uint8_t pin, uint8_t d)
+{
+	uint32_t	b = ((uint32_t) 1) << pin;
+
+	if (d) {
+		if (!(out_pins & b))
+			sim_printf("pin %d output", pin);
+		out_pins |= b;
+	} else {
+		if (out_pins & b)
+			sim_printf("pin %d input", pin);
+		out_pins &= ~b;
+	}
+}
+
+static snek_poly_t
+snek_error_duino_pin(snek_poly_t a)
+{
+	return snek_error("invalid pin %p", a);
+}
+
+static uint8_t
+snek_poly_get_pin(snek_poly_t a)
+{
+	snek_soffset_t p = snek_poly_get_soffset(a);
+	if (p < 0 || NUM_PIN <= p) {
+		snek_error_duino_pin(a);
+		return 0;
+	}
+	return p;
+}
+
+static snek_poly_t
+sim_talkto(snek_poly_t a)
+{
+	snek_list_t *l;
+	uint8_t p, d;
+
+	if (snek_poly_type(a) == snek_list) {
+		l = snek_poly_to_list(a);
+		p = snek_poly_get_pin(snek_list_get(l, 0, true));
+		d = snek_poly_get_pin(snek_list_get(l, 1, true));
+	} else {
+		p = d = snek_poly_get_pin(a);
+	}
+	if (!snek_abort) {
+		set_dir(p, 1);
+		set_dir(d, 1);
+		power_pin = p;
+		dir_pin = d;
+	}
+	return SNEK_NULL;
+}
+
+static snek_poly_t
+sim_listento(snek_poly_t a)
+{
+	uint8_t p = snek_poly_get_pin(a);
+	if (!snek_abort) {
+		set_dir(p, 0);
+		input_pin = p;
+	}
+	return SNEK_NULL;
+}
+
+static bool
+is_on(uint8_t pin)
+{
+	return (on_pins >> pin) & 1;
+}
+
+static void
+set_on(uint8_t pin)
+{
+	on_pins |= ((uint32_t) 1) << pin;
+}
+
+static void
+set_off(uint8_t pin)
+{
+	on_pins &= ~(((uint32_t) 1) << pin);
+}
+
+static snek_poly_t
+set_out(uint8_t pin)
+{
+	uint8_t	p = 0;
+
+	if (is_on(pin))
+		p = power[pin];
+
+	/* pins without PWM are either high or low */
+	if (!has_pwm(pin) && p)
+		p = 255;
+
+	if (p != level[pin]) {
+		level[pin] = p;
+		sim_printf("pin %d %.3f", pin, p / 255.0);
+	}
+	return SNEK_NULL;
+}
+
+static snek_poly_t
+sim_setpower(snek_poly_t a)
+{
+	float p = snek_poly_get_float(a);
+	if (p < 0.0f) p = 0.0f;
+	if (p > 1.0f) p = 1.0f;
+	power[power_pin] = (uint8_t) (p * 255.0f + 0.5f);
+	return set_out(power_pin);
+}
+
+static snek_poly_t
+sim_sleep(snek_poly_t a)
+{
+	float secs = snek_poly_get_float(a);
+
+	if (secs > 0 && !snek_abort)
+		sim_time += secs;
+	return SNEK_NULL;
+}
+
+static snek_poly_t
+sim_read(void)
+{
+	while (sim_next_input < sim_ninput && sim_inputs[sim_next_input].time <= sim_time) {
+		struct sim_input *i = &sim_inputs[sim_next_input++];
+		input[i->pin] = i->value;
+	}
+
+	float value = input[input_pin];
+
+	sim_printf("read %d %.3f", input_pin, value);
+	if (input_pin >= 14) {
+		if (value < 0.0f) value = 0.0f;
+		if (value > 1.0f) value = 1.0f;
+		return snek_float_to_poly(value);
+	}
+	return snek_bool_to_poly(value != 0.0f);
+}
+
+static snek_poly_t
+sim_stopall(void)
+{
+	uint8_t p;
+	for (p = 0; p < NUM_PIN; p++)
+		if (is_on(p)) {
+			set_off(p);
+			set_out(p);
+		}
+	return SNEK_NULL;
+}
+
+snek_poly_t
+snek_sim_call(snek_id_t id, uint8_t nargs, snek_poly_t *args)
+{
+	(void) nargs;
+	sim_init();
+	switch (id) {
+	case SNEK_BUILTIN_time_sleep:
+		return sim_sleep(args[0]);
+	case SNEK_BUILTIN_talkto:
+		return sim_talkto(args[0]);
+	case SNEK_BUILTIN_listento:
+		return sim_listento(args[0]);
+	case SNEK_BUILTIN_setpower:
+		return sim_setpower(args[0]);
+	case SNEK_BUILTIN_setleft:
+		set_on(dir_pin);
+		return set_out(dir_pin);
+	case SNEK_BUILTIN_setright:
+		set_off(dir_pin);
+		return set_out(dir_pin);
+	case SNEK_BUILTIN_on:
+		set_on(power_pin);
+		return set_out(power_pin);
+	case SNEK_BUILTIN_off:
+		set_off(power_pin);
+		return set_out(power_pin);
+	case SNEK_BUILTIN_onfor:
+		set_on(power_pin);
+		set_out(power_pin);
+		sim_sleep(args[0]);
+		set_off(power_pin);
+		set_out(power_pin);
+		return args[0];
+	case SNEK_BUILTIN_read:
+		return sim_read();
+	case SNEK_BUILTIN_stopall:
+		return sim_stopall();
+	case SNEK_BUILTIN_reset:
+		sim_printf("reset");
+		exit(0);
+	default:
+		/* eeprom operations have nothing to act on */
+		sim_printf("%s", snek_name_string(id));
+		return SNEK_NULL;
+	}
+}
+
+snek_poly_t
+snek_builtin_exit(snek_poly_t a)
+{
+	int ret;
+	switch (snek_poly_type(a)) {
+	case snek_float:
+		ret = (int) snek_poly_to_float(a);
+		break;
+	default:
+		ret = snek_poly_true(a) ? 0 : 1;
+		break;
+	}
+	sim_init();
+	sim_printf("exit %d", ret);
+	exit(ret);
+}
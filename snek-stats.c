@@ -0,0 +1,81 @@
+/*
+ * Copyright © 2019 Keith Packard <keithp@keithp.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ */
+
+#include "snek.h"
+
+#if SNEK_STATS
+
+snek_stats_t	snek_stats;
+
+void
+snek_stats_print(void)
+{
+	fprintf(stderr, "allocations   %10lu (%lu bytes)\n",
+		(unsigned long) snek_stats.allocs,
+		(unsigned long) snek_stats.alloc_bytes);
+	fprintf(stderr, "collections   %10lu incremental, %lu full\n",
+		(unsigned long) snek_stats.collect_incremental,
+		(unsigned long) snek_stats.collect_full);
+	fprintf(stderr, "bytes moved   %10lu\n",
+		(unsigned long) snek_stats.moved_bytes);
+	fprintf(stderr, "collect time  %10.3f ms\n",
+		snek_stats.collect_usec / 1000.0);
+	fprintf(stderr, "peak heap     %10lu of %lu bytes\n",
+		(unsigned long) snek_stats.peak_heap,
+		(unsigned long) SNEK_POOL_SIZE);
+	fprintf(stderr, "instructions  %10lu\n",
+		(unsigned long) snek_stats.ops);
+	fprintf(stderr, "calls         %10lu\n",
+		(unsigned long) snek_stats.calls);
+}
+
+#endif
+
+/*
+ * Returns (allocations, bytes allocated, incremental collections,
+ * full collections, bytes moved, seconds collecting, peak heap use,
+ * instructions, calls), or an empty tuple without SNEK_STATS
+ */
+snek_poly_t
+snek_builtin_gc_stats(void)
+{
+#if SNEK_STATS
+	/* Copy first, as making the tuple allocates */
+	snek_stats_t	s = snek_stats;
+	float		values[] = {
+		s.allocs,
+		s.alloc_bytes,
+		s.collect_incremental,
+		s.collect_full,
+		s.moved_bytes,
+		s.collect_usec / 1e6f,
+		s.peak_heap,
+		s.ops,
+		s.calls,
+	};
+	snek_offset_t	n = sizeof (values) / sizeof (values[0]);
+#else
+	snek_offset_t	n = 0;
+#endif
+	snek_list_t	*l = snek_list_make(n, true);
+
+	if (!l)
+		return SNEK_NULL;
+#if SNEK_STATS
+	snek_poly_t	*data = snek_list_data(l);
+	while (n--)
+		data[n] = snek_float_to_poly(values[n]);
+#endif
+	return snek_list_to_poly(l);
+}
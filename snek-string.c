@@ -14,19 +14,56 @@
 
 #include "snek.h"
 
+/*
+ * Allocate a string of 'len' characters, returning a pointer to the
+ * characters
+ */
+char *
+snek_string_alloc(snek_offset_t len)
+{
+	snek_alloc_kind(string);
+	uint8_t *new = snek_alloc(SNEK_STRING_HEAD + len + 1);
+	if (!new)
+		return NULL;
+	memcpy(new, &len, sizeof (snek_offset_t));
+	return (char *) new + SNEK_STRING_HEAD;
+}
+
+#if SNEK_STRING_CHARS
+/* Fill in the one-character string table at the start of a new pool */
+void
+snek_string_chars_fill(void)
+{
+	int c;
+
+	for (c = 0; c < 256; c++) {
+		uint8_t *entry = snek_pool + (c << SNEK_STRING_CHAR_SHIFT);
+		snek_offset_t len = c != '\0';
+
+		memset(entry, '\0', 1 << SNEK_STRING_CHAR_SHIFT);
+		memcpy(entry, &len, sizeof (snek_offset_t));
+		entry[SNEK_STRING_HEAD] = c;
+	}
+}
+#endif
+
 char *
 snek_string_make(char c)
 {
-	char *new = snek_alloc(2);
+#if SNEK_STRING_CHARS
+	return (char *) snek_pool + ((uint8_t) c << SNEK_STRING_CHAR_SHIFT) + SNEK_STRING_HEAD;
+#else
+	char *new = snek_string_alloc(c != '\0');
 	if (new)
 		new[0] = c;
 	return new;
+#endif
 }
 
 snek_poly_t
 snek_string_get(char *string, snek_soffset_t o, bool report_error)
 {
-	if (o < 0 || strlen(string) <= (snek_offset_t) o) {
+	if (o < 0 || snek_string_len(string) <= (snek_offset_t) o) {
 		if (report_error)
 			snek_error_range(o);
 		return SNEK_NULL;
@@ -39,19 +76,21 @@ snek_string_catn(char *a, snek_offset_t aoff, snek_offset_t alen,
 		 char *b, snek_offset_t boff, snek_offset_t blen)
 {
 	char *new;
-	if (snek_is_pool_addr(a))
+	/* check before allocating; a and b are stale if the pool moves */
+	bool a_pool = snek_is_pool_moving(a);
+	bool b_pool = snek_is_pool_moving(b);
+	if (a_pool)
 		snek_stack_push_string(a);
-	if (snek_is_pool_addr(b))
+	if (b_pool)
 		snek_stack_push_string(b);
-	new = snek_alloc(alen + blen + 1);
-	if (snek_is_pool_addr(b))
+	new = snek_string_alloc(alen + blen);
+	if (b_pool)
 		b = snek_stack_pop_string();
-	if (snek_is_pool_addr(a))
+	if (a_pool)
 		a = snek_stack_pop_string();
 	if (new) {
 		memcpy(new, a + aoff, alen);
 		memcpy(new + alen, b + boff, blen);
-		new[alen+blen] = '\0';
 	}
 	return new;
 }
@@ -59,104 +98,167 @@ snek_string_catn(char *a, snek_offset_t aoff, snek_offset_t alen,
 snek_poly_t
 snek_string_cat(char *a, char *b)
 {
-	return snek_string_to_poly(snek_string_catn(a, 0, strlen(a),
-						    b, 0, strlen(b)));
+	return snek_string_to_poly(snek_string_catn(a, 0, snek_string_len(a),
+						    b, 0, snek_string_len(b)));
+}
+
+#if SNEK_STRING_GROW
+
+/*
+ * The result of the last 's += x', while that variable holds the
+ * only reference to it. Reading a variable holding this string or
+ * running the collector clears it.
+ */
+snek_poly_t snek_string_grow = SNEK_NULL;
+
+snek_poly_t
+snek_string_append(snek_poly_t a, char *b)
+{
+	char		*s = snek_poly_to_string(a);
+	snek_offset_t	len = snek_string_len(s);
+	snek_offset_t	blen = snek_string_len(b);
+	snek_offset_t	new_len = len + blen;
+
+	if (a.u == snek_string_grow.u &&
+	    snek_alloc_grow(s - SNEK_STRING_HEAD,
+			    SNEK_STRING_HEAD + len + 1,
+			    SNEK_STRING_HEAD + new_len + 1))
+	{
+		memcpy(s + len, b, blen);
+		s[new_len] = '\0';
+		memcpy(s - SNEK_STRING_HEAD, &new_len, sizeof (snek_offset_t));
+		return a;
+	}
+	a = snek_string_cat(s, b);
+	snek_string_grow = a;
+	return a;
 }
 
+#endif
+
 char *
 snek_string_slice(char *a, snek_slice_t *slice)
 {
+	snek_offset_t i = 0;
+	for (snek_slice_start(slice); snek_slice_test(slice); snek_slice_step(slice))
+		i++;
 	snek_stack_push_string(a);
-	char	*r = snek_alloc(slice->len + 1);
+	char	*r = snek_string_alloc(i);
 	a = snek_stack_pop_string();
 	if (!r)
 		return NULL;
-	snek_offset_t i = 0;
+	i = 0;
 	for (snek_slice_start(slice); snek_slice_test(slice); snek_slice_step(slice))
 		r[i++] = a[slice->pos];
-	r[i] = '\0';
 	return r;
 }
 
-static uint8_t
-snek_next_format(char *a)
+/* Find the next '%' in 'a' at or after 'start' */
+static snek_offset_t
+snek_next_format(char *a, snek_offset_t start)
 {
-	char *percent = strchr(a, '%');
+	char *percent = strchr(a + start, '%');
 	if (percent)
 		return percent - a;
-	return strlen(a);
+	return snek_string_len(a);
 }
 
+/*
+ * Formatted strings are built in a string object with room to spare
+ * which doubles in size as needed. Its stored length is the space
+ * available until snek_build_finish trims it to the characters
+ * written; the collector reclaims the rest.
+ */
+typedef struct snek_build {
+	char		*string;
+	snek_offset_t	len;
+} snek_build_t;
+
+#define SNEK_BUILD_MIN	16
 
-static char *
-snek_buf_realloc(char **str_p, snek_offset_t add)
+/*
+ * Append 'len' characters at 'off' in 's'; when 's' is in the pool it
+ * must be the start of a string so that it can be kept on the stack
+ */
+static void
+snek_build_add(snek_build_t *build, const char *s, snek_offset_t off, snek_offset_t len)
 {
-	char *old = *str_p;
-	char *new;
-	snek_offset_t len = old ? strlen(old) : 0;
+	snek_offset_t	alloc = build->string ? snek_string_len(build->string) : 0;
 
-	if (old)
-		snek_stack_push_string(old);
-	new = snek_alloc(len + add + 1);
-	if (old)
-		old = snek_stack_pop_string();
-	if (!new)
-		return NULL;
-	memcpy(new, old, len);
-	new[len+add] = '\0';
-	*str_p = new;
-	return new + len;
+	if (snek_abort)
+		return;
+	if (build->len + len > alloc) {
+		bool	is_pool = snek_is_pool_moving(s);
+		char	*new;
+
+		alloc *= 2;
+		if (alloc < build->len + len)
+			alloc = build->len + len;
+		if (alloc < SNEK_BUILD_MIN)
+			alloc = SNEK_BUILD_MIN;
+		if (is_pool)
+			snek_stack_push_string(s);
+		if (build->string)
+			snek_stack_push_string(build->string);
+		new = snek_string_alloc(alloc);
+		if (build->string)
+			build->string = snek_stack_pop_string();
+		if (is_pool)
+			s = snek_stack_pop_string();
+		if (!new)
+			return;
+		if (build->string)
+			memcpy(new, build->string, build->len);
+		build->string = new;
+	}
+	memcpy(build->string + build->len, s + off, len);
+	build->len += len;
+}
+
+static char *
+snek_build_finish(snek_build_t *build)
+{
+	if (!build->string)
+		return snek_string_alloc(0);
+	memcpy(build->string - SNEK_STRING_HEAD, &build->len, sizeof (snek_offset_t));
+	build->string[build->len] = '\0';
+	return build->string;
 }
 
 static int
-snek_buf_sprintc(int c, void *closure)
+snek_build_putc(int c, void *closure)
 {
-	char	**str_p = closure;
-	char	*new;
+	char	s = c;
 
-	if ((new = snek_buf_realloc(str_p, 1)) != NULL)
-		*new = c;
+	snek_build_add(closure, &s, 0, 1);
 	return 0;
 }
 
 static int
-snek_buf_sprints(const char *s, void *closure)
-{
-	char	**str_p = closure;
-	char	*new;
-	int	len = strlen(s);
-	bool	is_pool = snek_is_pool_addr(s);
-
-	if (is_pool)
-		snek_stack_push_string((char *) s);
-	new = snek_buf_realloc(str_p, len);
-	if (is_pool)
-		s = snek_stack_pop_string();
-	if (new)
-		memcpy(new, s, len);
+snek_build_puts(const char *s, void *closure)
+{
+	snek_build_add(closure, s, 0, strlen(s));
 	return 0;
 }
 
 char *
 snek_string_interpolate(char *a, snek_poly_t poly)
 {
-	uint8_t percent = 0;
-	char *result = NULL;
+	snek_offset_t percent = 0;
 	snek_offset_t o = 0;
+	snek_build_t build = { .string = NULL, .len = 0 };
 	snek_buf_t buf = {
-		.put_c = snek_buf_sprintc,
-		.put_s = snek_buf_sprints,
-		.closure = &result
+		.put_c = snek_build_putc,
+		.put_s = snek_build_puts,
+		.closure = &build
 	};
 
+	snek_stack_push(poly);
+	snek_stack_push_string(a);
 	while (a[percent]) {
-		uint8_t next = snek_next_format(a + percent) + percent;
-		snek_stack_push(poly);
-		snek_stack_push_string(a);
-		result = snek_string_catn(result, 0, result ? strlen(result) : 0,
-					  a, percent, next-percent);
-		a = snek_stack_pop_string();
-		poly = snek_stack_pop();
+		snek_offset_t next = snek_next_format(a, percent);
+		snek_build_add(&build, a, percent, next - percent);
+		a = snek_poly_to_string(snek_stack_pick(0));
 		percent = next;
 		if (a[percent] == '%') {
 			percent++;
@@ -164,8 +266,9 @@ snek_string_interpolate(char *a, snek_poly_t poly)
 			if (format)
 				percent++;
 			if (format == '%')
-				snek_buf_sprintc('%', &buf);
+				snek_build_putc('%', &build);
 			else {
+				poly = snek_stack_pick(1);
 				snek_poly_t	*data = &poly;
 				snek_offset_t	size = 1;
 				if (snek_poly_type(poly) == snek_list) {
@@ -176,15 +279,13 @@ snek_string_interpolate(char *a, snek_poly_t poly)
 				snek_poly_t v = SNEK_ZERO;
 				if (o < size)
 					v = data[o++];
-				snek_stack_push(poly);
-				snek_stack_push_string(a);
 				snek_poly_format(&buf, v, format);
-				a = snek_stack_pop_string();
-				poly = snek_stack_pop();
+				a = snek_poly_to_string(snek_stack_pick(0));
 			}
 		}
 	}
-	return result;
+	snek_stack_drop(2);
+	return snek_build_finish(&build);
 }
 
 void
@@ -202,8 +303,7 @@ snek_stack_pop_string(void)
 snek_offset_t
 snek_string_size(void *addr)
 {
-	char *string = addr;
-	return (snek_offset_t) strlen(string) + 1;
+	return SNEK_STRING_HEAD + snek_string_len((char *) addr + SNEK_STRING_HEAD) + 1;
 }
 
 void
@@ -36,6 +36,21 @@
 #ifndef SNEK_POOL
 #define SNEK_POOL		(32 * 1024)
 #endif
+
+/*
+ * With SNEK_DYNAMIC, snek_mem_alloc allocates the pool, starting at
+ * SNEK_POOL bytes. When an allocation fails even after a full
+ * collection, the pool is reallocated larger, up to snek_pool_limit.
+ * Offsets are sized to reach SNEK_POOL_MAX bytes.
+ */
+#ifdef SNEK_DYNAMIC
+#ifndef SNEK_POOL_MAX
+#define SNEK_POOL_MAX		(8 * 1024 * 1024 - 4096)
+#endif
+#else
+#undef SNEK_POOL_MAX
+#define SNEK_POOL_MAX		SNEK_POOL
+#endif
 #define SNEK_ALLOC_SHIFT	2
 #define SNEK_ALLOC_ROUND	(1 << SNEK_ALLOC_SHIFT)
 
@@ -55,7 +70,7 @@
 #define SNEK_EXPONENT_MASK	0xff800000u
 #define SNEK_NINF		0xff800000u
 
-#if SNEK_POOL <= 65536
+#if SNEK_POOL_MAX <= 65536
 typedef uint16_t	snek_offset_t;
 typedef int16_t		snek_soffset_t;
 #define SNEK_OFFSET_NONE	0xfffcu
@@ -119,6 +134,7 @@ typedef enum {
 
 	snek_op_assign = 35,
 	snek_op_assign_named = 36,
+	snek_op_assign_local = 37,
 
 	snek_op_num,
 	snek_op_int,
@@ -126,6 +142,7 @@ typedef enum {
 	snek_op_list,
 	snek_op_tuple,
 	snek_op_id,
+	snek_op_local,
 
 	snek_op_not,
 	snek_op_uminus,
@@ -137,13 +154,18 @@ typedef enum {
 
 	snek_op_global,
 
+	/* the id of a named actual, pushed as a number */
+	snek_op_name,
+
 	snek_op_branch,
 	snek_op_branch_true,
 	snek_op_branch_false,
 	snek_op_forward,
 	snek_op_range_start,
 	snek_op_range_step,
+	snek_op_in_start,
 	snek_op_in_step,
+	snek_op_in_end,
 
 	snek_op_line,
 
@@ -151,6 +173,15 @@ typedef enum {
 
 	snek_op_nop,
 
+	/* fused instructions, generated by snek_code_optimize */
+	snek_op_int_binary,
+	snek_op_compare_branch,
+	snek_op_int_compare_branch,
+	snek_op_id_array,
+	snek_op_local_array,
+	snek_op_id_int_assign,
+	snek_op_local_int_assign,
+
 	snek_op_push = 0x80,
 } __attribute__((packed)) snek_op_t;
 
@@ -224,8 +255,9 @@ typedef struct snek_in {
 
 typedef struct snek_func {
 	snek_soffset_t	nformal;
+	snek_offset_t	nlocal;
 	snek_offset_t	code;
-	snek_id_t	formals[0];
+	snek_id_t	locals[0];	/* formals, then other locals */
 } snek_func_t;
 
 #define SNEK_FUNC_VARARGS	SNEK_SOFFSET_NONE
@@ -235,6 +267,46 @@ typedef struct snek_name {
 	char		name[0];
 } snek_name_t;
 
+/*
+ * Open-addressed hash index over snek_names, mapping each name to
+ * the id it was assigned. Buckets with id == SNEK_ID_NONE are empty.
+ */
+#ifndef SNEK_NAME_HASH
+#define SNEK_NAME_HASH	0
+#endif
+
+typedef struct snek_name_bucket {
+	snek_offset_t	name;
+	snek_id_t	id;
+} snek_name_bucket_t;
+
+typedef struct snek_name_hash {
+	snek_offset_t		nbucket;
+	snek_offset_t		count;
+	snek_name_bucket_t	bucket[0];
+} snek_name_hash_t;
+
+/*
+ * Instructions referring to globals carry a cache of where the name
+ * was last found: the index of the variable in the globals frame, or
+ * SNEK_OFFSET_NONE when it wasn't there. The cache is valid while
+ * snek_globals_version matches.
+ */
+#ifndef SNEK_CACHE
+#define SNEK_CACHE	0
+#endif
+
+typedef struct snek_cache {
+	snek_offset_t	version;
+	snek_offset_t	index;
+} snek_cache_t;
+
+#if SNEK_CACHE
+#define SNEK_CACHE_SIZE	sizeof (snek_cache_t)
+#else
+#define SNEK_CACHE_SIZE	0
+#endif
+
 typedef struct snek_variable {
 	snek_id_t	id;
 	snek_poly_t	value;
@@ -243,11 +315,21 @@ typedef struct snek_variable {
 typedef struct snek_frame {
 	snek_offset_t	prev;
 	snek_offset_t	code;
-	snek_offset_t	ip;
+	union {
+		snek_offset_t	ip;
+		snek_offset_t	nalloc;		/* globals capacity */
+	};
+	snek_offset_t	line;		/* caller's line, restored on return */
 	snek_offset_t	nvariables;
 	snek_variable_t	variables[0];
 } snek_frame_t;
 
+/*
+ * Slots holding the state of each loop: current value, limit and
+ * step for range loops, iterable and index for other for loops
+ */
+#define SNEK_LOOP_STATE	3
+
 
 typedef struct snek_slice {
 	/* provided parameters */
@@ -296,6 +378,8 @@ extern const snek_builtin_t snek_builtins[];
 #define SNEK_NULL	((snek_poly_t) { .u = SNEK_NULL_U })
 #define SNEK_GLOBAL_U	0xfffffff8u
 #define SNEK_GLOBAL	((snek_poly_t) { .u = SNEK_GLOBAL_U })
+#define SNEK_UNSET_U	0xfffffff4u
+#define SNEK_UNSET	((snek_poly_t) { .u = SNEK_UNSET_U })
 #define SNEK_ZERO	((snek_poly_t) { .f = 0.0f })
 #define SNEK_ONE	((snek_poly_t) { .f = 1.0f })
 
@@ -325,12 +409,62 @@ snek_is_global(snek_poly_t p)
 	return p.u == SNEK_GLOBAL_U;
 }
 
+static inline bool
+snek_is_unset(snek_poly_t p)
+{
+	return p.u == SNEK_UNSET_U;
+}
+
+
+/*
+ * One-character strings live in a table at the start of the pool,
+ * below the heap, so that indexing and iterating over strings needn't
+ * allocate. Being outside snek_is_pool_addr, the collector leaves them
+ * alone, and their offsets stay put when a dynamic pool grows. The
+ * table is filled in when the pool is first allocated and never
+ * written after that, which is why it needs a dynamic pool.
+ */
+#ifndef SNEK_STRING_CHARS
+#define SNEK_STRING_CHARS	0
+#endif
+
+#if SNEK_STRING_CHARS
+#ifndef SNEK_DYNAMIC
+#error "SNEK_STRING_CHARS needs SNEK_DYNAMIC"
+#endif
+/* each entry holds the length, the character and a NUL */
+#if SNEK_POOL_MAX <= 65536
+#define SNEK_STRING_CHAR_SHIFT	SNEK_ALLOC_SHIFT
+#else
+#define SNEK_STRING_CHAR_SHIFT	(SNEK_ALLOC_SHIFT + 1)
+#endif
+#define SNEK_STRING_CHARS_SIZE	(256 << SNEK_STRING_CHAR_SHIFT)
+#else
+#define SNEK_STRING_CHARS_SIZE	0
+#endif
+
+/* The heap starts past the one-character string table */
+#define SNEK_POOL_BASE	SNEK_STRING_CHARS_SIZE
+
+#if SNEK_POOL_MAX <= 65536
+#if SNEK_POOL_BASE + SNEK_POOL_MAX > SNEK_OFFSET_NONE
+#error "No room for one-character strings in the pool"
+#endif
+#elif SNEK_POOL_BASE + SNEK_POOL_MAX > (SNEK_UNSET_U & SNEK_OFFSET_MASK)
+#error "SNEK_POOL_MAX is too large for offsets"
+#endif
 
 #ifdef SNEK_DYNAMIC
 extern uint8_t *snek_pool  __attribute__((aligned(SNEK_ALLOC_ROUND)));
 extern uint32_t	snek_pool_size;
+extern uint32_t	snek_pool_limit;
+#define SNEK_POOL_SIZE	snek_pool_size
+
+bool
+snek_mem_alloc(uint32_t pool_size);
 #else
-extern uint8_t	snek_pool[SNEK_POOL] __attribute__((aligned(SNEK_ALLOC_ROUND)));
+extern uint8_t	snek_pool[SNEK_POOL_BASE + SNEK_POOL] __attribute__((aligned(SNEK_ALLOC_ROUND)));
+#define SNEK_POOL_SIZE	SNEK_POOL
 #endif
 
 #include "snek-gram.h"
@@ -357,8 +491,64 @@ extern snek_token_val_t	snek_token_val;
 
 /* snek-code.c */
 
+/*
+ * Dispatch instructions through a table of label addresses (a GCC
+ * extension) instead of a switch
+ */
+#ifndef SNEK_THREADED
+#define SNEK_THREADED	0
+#endif
+
+/*
+ * Fold constants and tidy up branches in each finished piece of code
+ */
+#ifndef SNEK_OPTIMIZE
+#define SNEK_OPTIMIZE	1
+#endif
+
+/*
+ * Replace common instruction sequences with single instructions
+ */
+#if !SNEK_OPTIMIZE
+#undef SNEK_FUSE
+#endif
+#ifndef SNEK_FUSE
+#define SNEK_FUSE	0
+#endif
+
+/*
+ * Count how often each instruction follows each other one, printing
+ * the most common pairs at exit. Used to pick what to fuse.
+ */
+#ifndef SNEK_COUNT_PAIRS
+#define SNEK_COUNT_PAIRS	0
+#endif
+
+#if SNEK_COUNT_PAIRS
+void
+snek_code_pairs_print(void);
+#endif
+
 extern const char * const snek_op_names[];
 
+uint8_t
+snek_op_extra_size(snek_op_t op);
+
+/*
+ * The compiler's code buffer grows by at least SNEK_COMPILE_INC
+ * bytes, or by its size shifted right by SNEK_COMPILE_SHIFT. Up to
+ * SNEK_COMPILE_KEEP bytes of it are kept for the next piece of code.
+ */
+#ifndef SNEK_COMPILE_INC
+#define SNEK_COMPILE_INC	32
+#endif
+#ifndef SNEK_COMPILE_SHIFT
+#define SNEK_COMPILE_SHIFT	1
+#endif
+#ifndef SNEK_COMPILE_KEEP
+#define SNEK_COMPILE_KEEP	0
+#endif
+
 extern uint8_t		*snek_compile;
 extern snek_offset_t	snek_compile_size;
 extern snek_offset_t	snek_compile_prev, snek_compile_prev_prev;
@@ -385,11 +575,8 @@ snek_code_add_string(char *string);
 void
 snek_code_add_op_offset(snek_op_t op, snek_offset_t offset);
 
-static inline void
-snek_code_add_op_id(snek_op_t op, snek_id_t id)
-{
-	snek_code_add_op_offset(op, id);
-}
+void
+snek_code_add_op_id(snek_op_t op, snek_id_t id);
 
 void
 snek_code_add_op_branch(snek_op_t op);
@@ -397,7 +584,7 @@ snek_code_add_op_branch(snek_op_t op);
 void
 snek_code_add_forward(snek_forward_t forward);
 
-void
+bool
 snek_code_patch_forward(snek_offset_t start, snek_offset_t stop, snek_forward_t forward, snek_offset_t target);
 
 void
@@ -409,12 +596,18 @@ snek_code_add_in_range(snek_id_t id, snek_offset_t nactual, uint8_t for_depth);
 void
 snek_code_add_in_enum(snek_id_t id, uint8_t for_depth);
 
+void
+snek_code_add_loop_end(snek_offset_t top_off);
+
 void
 snek_code_patch_branch(snek_offset_t branch, snek_offset_t target);
 
 snek_code_t *
 snek_code_finish(void);
 
+bool
+snek_code_resolve_locals(snek_code_t *code);
+
 snek_offset_t
 snek_code_line(snek_code_t *code);
 
@@ -484,6 +677,8 @@ extern bool snek_abort;
 
 extern snek_frame_t	*snek_globals;
 extern snek_frame_t	*snek_frame;
+extern snek_frame_t	*snek_loops;
+extern snek_offset_t	snek_globals_version;
 
 bool
 snek_frame_mark_global(snek_offset_t name);
@@ -497,6 +692,14 @@ snek_frame_pop(void);
 snek_poly_t *
 snek_id_ref(snek_id_t id, bool insert);
 
+snek_variable_t *
+snek_loop_state(uint8_t slot, bool start);
+
+#if SNEK_CACHE
+snek_poly_t *
+snek_global_ref_cache(snek_id_t id, bool insert, snek_offset_t site);
+#endif
+
 bool
 snek_id_is_local(snek_id_t id);
 
@@ -504,6 +707,7 @@ bool
 snek_id_del(snek_id_t id);
 
 extern const snek_mem_t snek_frame_mem;
+extern const snek_mem_t snek_globals_mem;
 
 /* snek-func.c */
 
@@ -578,6 +782,8 @@ snek_list_move(void *addr);
 
 extern uint8_t snek_lex_indent;
 
+#define SNEK_LEX_UNGET	5
+
 token_t
 snek_lex(void);
 
@@ -589,6 +795,9 @@ snek_lex(void);
 bool
 snek_is_pool_addr(const void *addr);
 
+bool
+snek_is_pool_moving(const void *addr);
+
 bool
 snek_poly_mark(snek_poly_t p);
 
@@ -625,9 +834,33 @@ snek_move_addr(const struct snek_mem *type, void **ref);
 bool
 snek_move_offset(const struct snek_mem *type, snek_offset_t *ref);
 
+void *
+snek_try_alloc(snek_offset_t size);
+
 void *
 snek_alloc(snek_offset_t size);
 
+bool
+snek_alloc_grow(void *addr, snek_offset_t size, snek_offset_t new_size);
+
+/*
+ * With SNEK_IMAGE, snek_mem_save passes the roots and the pool to
+ * 'put' after a full collection, and snek_mem_load replaces the heap
+ * with what 'get' returns. The port saves anything kept outside the
+ * heap, such as snek_id.
+ */
+#ifndef SNEK_IMAGE
+#define SNEK_IMAGE	0
+#endif
+
+#if SNEK_IMAGE
+bool
+snek_mem_save(bool (*put)(const void *data, uint32_t size, void *closure), void *closure);
+
+bool
+snek_mem_load(bool (*get)(void *data, uint32_t size, void *closure), void *closure);
+#endif
+
 void
 snek_stack_push_string(const char *s);
 
@@ -676,13 +909,29 @@ snek_name_string(snek_id_t id);
 
 extern const snek_mem_t snek_name_mem;
 extern snek_name_t *snek_names;
+extern snek_id_t snek_id;
+
+#if SNEK_NAME_HASH
+extern const snek_mem_t snek_name_hash_mem;
+extern snek_name_hash_t *snek_name_hash;
+#endif
 
 /* snek-parse.c */
 
 #define SNEK_MAX_FORMALS	10
 
+/* Local slots are addressed with a single byte */
+#ifndef SNEK_MAX_LOCALS
+#define SNEK_MAX_LOCALS		32
+#endif
+
+#if SNEK_MAX_LOCALS > 255
+#error SNEK_MAX_LOCALS too large
+#endif
+
 extern uint8_t snek_parse_nformal;
-extern snek_id_t snek_parse_formals[SNEK_MAX_FORMALS];
+extern uint8_t snek_parse_nlocal;
+extern snek_id_t snek_parse_formals[SNEK_MAX_LOCALS];
 
 typedef enum {
 	snek_parse_success,
@@ -692,6 +941,67 @@ typedef enum {
 snek_parse_ret_t
 snek_parse(void);
 
+/* Modules */
+
+/*
+ * With SNEK_IMPORT, 'import NAME' calls snek_import, which the port
+ * provides. The parser returns at each import so that snek_import
+ * can call snek_parse again for the module. The snek_import_ hooks
+ * see each piece of top-level code as it is compiled, letting the
+ * port save it.
+ */
+#ifndef SNEK_IMPORT
+#define SNEK_IMPORT	0
+#endif
+
+#if SNEK_IMPORT
+extern snek_id_t snek_parse_import;
+extern bool snek_parse_failed;
+
+#define snek_parse_import_name(id)	(snek_parse_import = (id), true)
+
+typedef struct snek_lex_state {
+	char		*file;
+	snek_offset_t	line;
+	bool		midline;
+	bool		exdent;
+	uint8_t		indent;
+	uint8_t		ungetcount;
+	char		ungetbuf[SNEK_LEX_UNGET];
+} snek_lex_state_t;
+
+void
+snek_lex_save(snek_lex_state_t *state, char *file);
+
+void
+snek_lex_restore(const snek_lex_state_t *state);
+
+void
+snek_import(snek_id_t id);
+
+void
+snek_import_code(snek_code_t *code);
+
+void
+snek_import_def(snek_id_t id, snek_code_t *code);
+
+void
+snek_import_del(void);
+
+#if SNEK_IMAGE
+uint32_t
+snek_import_modules(const snek_id_t **ids);
+
+bool
+snek_import_mark(snek_id_t id);
+#endif
+#else
+#define snek_parse_import_name(id)	false
+#define snek_import_code(code)		((void) 0)
+#define snek_import_def(id, code)	((void) 0)
+#define snek_import_del()		((void) 0)
+#endif
+
 /* snek-poly.c */
 
 void *
@@ -728,17 +1038,168 @@ snek_poly_format(snek_buf_t *buf, snek_poly_t a, char format);
 void
 snek_print(snek_buf_t *buf, snek_poly_t poly);
 
+/* snek-stats.c */
+
+/*
+ * Count allocations, collections, instructions and calls for
+ * gc.stats() and 'snek --stats'. SNEK_STATS_USEC() reads a
+ * microsecond clock to time collections.
+ */
+#ifndef SNEK_STATS
+#define SNEK_STATS	0
+#endif
+
+#if SNEK_STATS
+#ifndef SNEK_STATS_USEC
+#define SNEK_STATS_USEC()	0
+#endif
+
+typedef struct snek_stats {
+	uint32_t	allocs;
+	uint32_t	alloc_bytes;
+	uint32_t	collect_incremental;
+	uint32_t	collect_full;
+	uint32_t	moved_bytes;
+	uint32_t	collect_usec;
+	uint32_t	peak_heap;
+	uint32_t	ops;
+	uint32_t	calls;
+} snek_stats_t;
+
+extern snek_stats_t	snek_stats;
+
+#define snek_stats_add(field, n)	(snek_stats.field += (n))
+
+void
+snek_stats_print(void);
+#else
+#define snek_stats_add(field, n)	((void) 0)
+#endif
+
+/*
+ * With SNEK_PROFILE, snek_mem_moving is set while the collector or a
+ * pool resize moves objects, so that a sampling profiler interrupting
+ * the program knows to leave the heap alone
+ */
+#ifndef SNEK_PROFILE
+#define SNEK_PROFILE	0
+#endif
+
+#if SNEK_PROFILE
+extern volatile bool	snek_mem_moving;
+
+#define snek_mem_set_moving(m)	(snek_mem_moving = (m))
+#else
+#define snek_mem_set_moving(m)	((void) 0)
+#endif
+
+/*
+ * With SNEK_TRACE, snek_code_run hands each instruction to
+ * snek_trace_op while snek_tracing is set, to count instructions by
+ * opcode and line and optionally log them to a file
+ */
+#ifndef SNEK_TRACE
+#define SNEK_TRACE	0
+#endif
+
+#if SNEK_TRACE
+extern bool	snek_tracing;
+
+void
+snek_trace_op(uint8_t op);
+#endif
+
+/*
+ * With SNEK_ALLOC_PROFILE, while snek_alloc_profiling is set, each
+ * allocation is reported with the kind of object named by the
+ * snek_alloc_kind() before it, and each collection reports the
+ * objects which survive and where they move to
+ */
+#ifndef SNEK_ALLOC_PROFILE
+#define SNEK_ALLOC_PROFILE	0
+#endif
+
+#if SNEK_ALLOC_PROFILE
+typedef enum snek_kind {
+	snek_kind_other,
+	snek_kind_string,
+	snek_kind_list,
+	snek_kind_func,
+	snek_kind_frame,
+	snek_kind_code,
+	snek_kind_name,
+} __attribute__((packed)) snek_kind_t;
+
+extern bool		snek_alloc_profiling;
+extern snek_kind_t	snek_alloc_next;
+
+#define snek_alloc_kind(k)	(snek_alloc_next = snek_kind_ ## k)
+
+void
+snek_alloc_note(snek_offset_t offset, snek_offset_t size);
+
+void
+snek_alloc_note_grow(snek_offset_t offset, snek_offset_t size);
+
+void
+snek_alloc_note_collect(snek_offset_t low);
+
+void
+snek_alloc_note_live(snek_offset_t old_offset, snek_offset_t new_offset, snek_offset_t size);
+
+void
+snek_alloc_note_done(void);
+
+void
+snek_alloc_note_reset(void);
+#else
+#define snek_alloc_kind(k)	((void) 0)
+#endif
+
 /* snek-string.c */
 
+/*
+ * Let 's += x' extend a string in place when the variable holds the
+ * only reference to it and it sits at the top of the heap
+ */
+#ifndef SNEK_STRING_GROW
+#define SNEK_STRING_GROW	0
+#endif
+
+#if SNEK_STRING_GROW
+extern snek_poly_t snek_string_grow;
+
+/* Called when a variable is read, as the string may now be shared */
+static inline void
+snek_string_grow_read(snek_poly_t a)
+{
+	if (a.u == snek_string_grow.u)
+		snek_string_grow = SNEK_NULL;
+}
+#else
+#define snek_string_grow_read(a)	((void) (a))
+#endif
+
+char *
+snek_string_alloc(snek_offset_t len);
+
 char *
 snek_string_make(char c);
 
+#if SNEK_STRING_CHARS
+void
+snek_string_chars_fill(void);
+#endif
+
 snek_poly_t
 snek_string_get(char *string, snek_soffset_t i, bool report_error);
 
 snek_poly_t
 snek_string_cat(char *a, char *b);
 
+snek_poly_t
+snek_string_append(snek_poly_t a, char *b);
+
 char *
 snek_string_slice(char *a, snek_slice_t *slice);
 
@@ -813,16 +1274,34 @@ snek_list_data(snek_list_t *list)
 	return snek_pool_addr(list->data);
 }
 
+/*
+ * Strings hold their length ahead of the characters. Values refer to
+ * the start of the object, char pointers to the characters, which
+ * are still NUL terminated for the C library.
+ */
+#define SNEK_STRING_HEAD	sizeof (snek_offset_t)
+
+static inline snek_offset_t
+snek_string_len(const char *string)
+{
+	snek_offset_t	len;
+
+	memcpy(&len, string - SNEK_STRING_HEAD, sizeof (snek_offset_t));
+	return len;
+}
+
 static inline snek_poly_t
 snek_string_to_poly(char *string)
 {
-	return snek_poly(string, snek_string);
+	if (!string)
+		return SNEK_NULL;
+	return snek_poly(string - SNEK_STRING_HEAD, snek_string);
 }
 
 static inline char *
 snek_poly_to_string(snek_poly_t poly)
 {
-	return snek_ref(poly);
+	return (char *) snek_ref(poly) + SNEK_STRING_HEAD;
 }
 
 static inline snek_func_t *
@@ -0,0 +1,33 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Deleting globals must leave the others alone
+
+a = 1
+b = 2
+c = 3
+d = 4
+
+del b
+del d
+b = 5
+
+if a != 1 or b != 5 or c != 3:
+    exit(1)
+
+del a, c
+a = 6
+
+if a != 6 or b != 5:
+    exit(1)
@@ -0,0 +1,60 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+
+# Constant expressions and rewritten branches must behave as written
+
+if 2 * 3 + 1 != 7 or -2 ** 2 != -4 or 1 - 2 - 3 != -4:
+    exit(1)
+if 7 // 2 != 3 or 7 % 3 != 1 or 1 << 4 != 16:
+    exit(1)
+if 2 * 3.5 / 7 != 1 or -(-3) != 3:
+    exit(1)
+
+x = 0
+if (not x and 5) != 5 or (not 3 or 7) != 7:
+    exit(1)
+
+def f(a):
+    if not a:
+        y = 1
+    else:
+        y = 2
+    while not a:
+        a = 1
+    return y
+    exit(1)
+
+if f(0) != 1 or f(1) != 2:
+    exit(1)
+
+def g(a, b):
+    if a and b:
+        return 1
+    elif a or b:
+        return 2
+    return 3
+
+if g(1, 1) != 1 or g(0, 1) != 2 or g(1, 0) != 2 or g(0, 0) != 3:
+    exit(1)
+
+s = 0
+for i in range(10):
+    if i % 2:
+        continue
+    if not i:
+        s += 100
+    s += i
+if s != 120:
+    exit(1)
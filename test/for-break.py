@@ -27,3 +27,35 @@ def test():
     return tries
 
 if test() != 2: exit(1)
+
+# Breaking out of 'for ... in' lets go of what it was iterating over,
+# which mustn't disturb loops still running
+
+def find(l, v):
+    n = 0
+    for row in l:
+        for x in row:
+            if x == v:
+                break
+            n += 1
+        else:
+            continue
+        break
+    return n
+
+if find([[1, 2], [3, 4, 5], [6]], 4) != 3: exit(1)
+if find([[1, 2], [3]], 7) != 3: exit(1)
+
+t = 0
+for s in ["ab", "cd", "ef"]:
+    for c in s:
+        if c == "d":
+            break
+        t += 1
+    t += 10
+    if s == "cd":
+        for c in "xyz":
+            t += 100
+            break
+if t != 135: exit(1)
+if c != "f" or s != "ef": exit(1)
@@ -0,0 +1,54 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+
+#
+# Loop state is separate from the loop variable
+#
+
+t = 0
+for i in range(5):
+    t = t + i
+    i = 100
+if t != 10 or i != 100:
+    exit(1)
+
+for c in "xyz":
+    c = "q"
+if c != "q":
+    exit(1)
+
+def f(l):
+    s = 0
+    for a in l:
+        for b in range(a):
+            s = s + b
+            b = -1
+        if b != -1:
+            return -1
+    return s
+
+if f([2, 3, 4]) != 10:
+    exit(1)
+
+def g(n):
+    if n == 0:
+        return 1
+    s = 0
+    for i in range(n):
+        s = s + g(i)
+    return s
+
+if g(5) != 16:
+    exit(1)
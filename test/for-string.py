@@ -16,3 +16,30 @@ result=""
 for c in "abc": result = c + result
 
 if result != "cba": exit(1)
+
+#
+# Characters from the same string, or from chr, are equal strings
+#
+
+s = "abcabc"
+if s[0] != s[3] or s[1] + s[2] != "bc" or chr(ord(s[4])) != "b":
+    exit(1)
+
+n = 0
+for c in s + s:
+    if c == "c":
+        n = n + 1
+if n != 4:
+    exit(1)
+
+#
+# Keep characters around while the collector runs
+#
+
+c = s[2]
+l = [s[0], s[1]]
+t = ""
+for i in range(2000):
+    t = t + "x"
+if c != "c" or l[0] + l[1] != "ab" or len(t) != 2000:
+    exit(1)
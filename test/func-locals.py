@@ -0,0 +1,69 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Formals and assigned names are locals, everything
+# else comes from the globals
+
+g = 10
+
+def reader():
+    return g
+
+def shadow():
+    g = 3
+    g += 1
+    return g
+
+def declared():
+    global g
+    g = g + 1
+    return g
+
+def dflt(a, b=2, c=3):
+    return a * 100 + b * 10 + c
+
+def loop(n):
+    t = 0
+    for i in range(n):
+        t += i
+    for c in "abc":
+        t += 1
+    return t
+
+def fib(n):
+    if n < 2:
+        return n
+    a = fib(n-1)
+    b = fib(n-2)
+    return a + b
+
+def copy():
+    x = g
+    y = x * 2
+    return y
+
+if reader() != 10:
+    exit(1)
+if shadow() != 4 or g != 10:
+    exit(1)
+if declared() != 11 or g != 11:
+    exit(1)
+if dflt(1) != 123 or dflt(1, c=5) != 125 or dflt(1, b=7, c=8) != 178:
+    exit(1)
+if loop(5) != 13:
+    exit(1)
+if fib(15) != 610:
+    exit(1)
+if copy() != 22:
+    exit(1)
@@ -0,0 +1,91 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+
+#
+# Check instruction sequences replaced by fused instructions
+#
+
+a = [3, 1, 4, 1, 5]
+
+t = 0
+i = 0
+while i < 5:
+    t = t + a[i] * 2
+    i = i + 1
+if t != 28:
+    exit(1)
+
+def sum_odd(l):
+    s = 0
+    for j in range(len(l)):
+        if l[j] % 2 == 1:
+            s += l[j]
+    return s
+
+if sum_odd(a) != 10:
+    exit(1)
+
+n = 0
+for k in range(10):
+    if k >= 3 and k != 7:
+        n = n + 1
+if n != 6:
+    exit(1)
+
+x = 7
+if not (x > -3 and x - 1 == 6 and x < 100):
+    exit(1)
+
+# x = x op int, at the top level and in a function
+
+c = 10
+c = c - 3
+c = c * 2
+c = c // 4
+c = c << 2
+if c != 12:
+    exit(1)
+
+s = "abc"
+s = s[1]
+if s != "b":
+    exit(1)
+
+def count(m):
+    y = 0
+    while y < m:
+        y = y + 1
+    z = y
+    z = z % 3
+    return z
+
+if count(5) != 2:
+    exit(1)
+
+def bump():
+    global c
+    c = c + 1
+    c = c + 1
+
+bump()
+if c != 14:
+    exit(1)
+
+# names which aren't the same are left alone
+
+f = 1
+g = f + 1
+if f != 1 or g != 2:
+    exit(1)
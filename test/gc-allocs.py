@@ -0,0 +1,23 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Run with --allocs, gc.allocs() reports the allocations so far on
+# stdout. Snek only; python has no gc.allocs
+#
+
+words = []
+for i in range(100):
+    words += ["w" + chr(97 + i % 26)]
+gc.allocs()
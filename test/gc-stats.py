@@ -0,0 +1,41 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# gc.stats() returns nine counts, which only ever grow. Snek only;
+# python has no gc.stats
+#
+
+def f(v):
+    return v + 1
+
+before = gc.stats()
+l = []
+for i in range(200):
+    l += [f(i)]
+after = gc.stats()
+
+if len(before) != 9 or len(after) != 9:
+    exit(1)
+
+# Each value is a number, which errors on anything else
+for i in range(9):
+    if before[i] + 0 != before[i] or before[i] < 0 or after[i] < before[i]:
+        exit(1)
+
+# allocations, bytes allocated, peak heap, instructions and calls
+if after[0] <= before[0] or after[1] <= before[1] or after[6] <= 0:
+    exit(1)
+if after[7] <= before[7] or after[8] < before[8] + 200:
+    exit(1)
@@ -0,0 +1,107 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Functions cache where they found each global; the caches must
+# notice globals being deleted, added and redefined
+#
+
+a = 1
+b = 2
+c = 3
+
+def get_b():
+    return b
+
+def get_c():
+    return c
+
+def set_c(v):
+    global c
+    c = v
+
+if get_b() != 2 or get_c() != 3:
+    exit(1)
+
+# Deleting a global moves the ones after it
+
+del a
+if get_b() != 2 or get_c() != 3:
+    exit(1)
+set_c(4)
+if c != 4 or get_c() != 4:
+    exit(1)
+
+del b
+b = 5
+if get_b() != 5 or get_c() != 4:
+    exit(1)
+
+# Adding globals, enough to grow the table, leaves them where they are
+
+d0 = 10
+d1 = 11
+d2 = 12
+d3 = 13
+d4 = 14
+d5 = 15
+d6 = 16
+d7 = 17
+d8 = 18
+d9 = 19
+if get_b() != 5 or get_c() != 4:
+    exit(1)
+set_c(6)
+if c != 6 or d9 != 19:
+    exit(1)
+
+# A global missing when first looked for is found once it is added
+
+def get_e():
+    global e
+    e = e + 1
+    return e
+
+e = 20
+if get_e() != 21:
+    exit(1)
+del e
+e = 30
+if get_e() != 31:
+    exit(1)
+
+# Calls through a global see the function it names now
+
+def f():
+    return 1
+
+def call_f():
+    return f()
+
+if call_f() != 1:
+    exit(1)
+
+def f():
+    return 2
+
+if call_f() != 2:
+    exit(1)
+
+del f
+
+def f():
+    return 3
+
+if call_f() != 3:
+    exit(1)
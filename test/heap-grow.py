@@ -0,0 +1,48 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Keep far more than the initial 32kB heap alive at once, so that
+# the heap has to grow, and check nothing was lost on the way
+#
+
+s = "abcdefgh"
+for i in range(3):
+    s = s + s
+
+# 64 bytes of characters each, over 160kB in all
+strings = []
+for i in range(2500):
+    strings += [s[i % 64:] + s[:i % 64]]
+
+lists = []
+for i in range(500):
+    lists += [[i, i + 1, i + 2, i + 3, i + 4, i + 5, i + 6, i + 7]]
+
+# errors don't stop snek, so check that everything was made
+
+if len(strings) != 2500 or len(lists) != 500:
+    exit(1)
+
+for i in range(2500):
+    t = strings[i]
+    if len(t) != 64 or t[0] != s[i % 64] or t[63] != s[(i + 63) % 64]:
+        exit(1)
+
+total = 0
+for l in lists:
+    for v in l:
+        total += v
+if total != 500 * 28 + 8 * (499 * 500 / 2):
+    exit(1)
@@ -0,0 +1,45 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Runs from the image saved after image-prelude.py
+#
+
+if greeting != "hello" or shout(greeting) != "hello!":
+    exit(1)
+if primes[4] != 11 or len(primes) != 5:
+    exit(1)
+if point[0] * point[0] + point[1] * point[1] != 25:
+    exit(1)
+if letters != "kens":
+    exit(1)
+if square(12) != 144 or count_to(50) != 50:
+    exit(1)
+
+counted()
+counted()
+if calls != 2:
+    exit(1)
+
+# The restored heap can still grow and collect
+
+words = []
+for i in range(1000):
+    words += [shout(greeting) + letters]
+if len(words) != 1000 or words[999] != "hello!kens":
+    exit(1)
+
+# Make sure this is reached, as undefined names don't stop snek
+
+print("image ok")
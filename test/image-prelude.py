@@ -0,0 +1,44 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Run with --save-image; image-main.py then runs from the image
+# and checks that all of this survived
+#
+
+greeting = "hello"
+primes = [2, 3, 5, 7, 11]
+point = (3, 4)
+letters = ""
+for c in "snek":
+    letters = c + letters
+
+def square(x):
+    return x * x
+
+def count_to(n):
+    t = 0
+    for i in range(n):
+        t = t + 1
+    return t
+
+def shout(s):
+    return s + "!"
+
+calls = 0
+
+def counted():
+    global calls
+    calls = calls + 1
+    return calls
@@ -0,0 +1,27 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+import importmod
+
+if importmod.values != [6, 'hello, module!']:
+    exit(1)
+if importmod.greet('snek', punct='?') != 'hello, snek?':
+    exit(1)
+if importmod.total([4, 5]) != 9:
+    exit(1)
+
+# Importing again leaves the module alone
+import importmod
+
+if importmod.greeting != 'hello':
+    exit(1)
@@ -0,0 +1,28 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+# Module imported by import.py
+
+greeting = 'hello'
+
+def greet(name, punct='!'):
+    return greeting + ', ' + name + punct
+
+def total(l):
+    t = 0
+    for v in l:
+        t += v
+    return t
+
+values = [total([1, 2, 3]), greet('module')]
@@ -0,0 +1,34 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+#
+# Something for the profiler and instruction counts to look at:
+# 'inner' is always called from 'outer'
+#
+
+def inner(n):
+    t = 0
+    for i in range(n):
+        t += i % 7
+    return t
+
+def outer(n):
+    return inner(n)
+
+total = 0
+for i in range(3000):
+    total += outer(1000)
+
+if total != 3000 * 2997:
+    exit(1)
@@ -0,0 +1,92 @@
+#
+# Copyright © 2019 Keith Packard <keithp@keithp.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+
+
+#
+# String lengths through concatenation, slicing and formatting
+#
+
+s = "abc"
+t = s + "defg"
+if len(t) != 7 or t[6] != "g":
+    exit(1)
+if len(t[2:5]) != 3 or t[2:5] != "cde" or t[0:7:3] != "adg":
+    exit(1)
+if t[3:3] or len(t[5:]) != 2:
+    exit(1)
+if "ab" == "abc" or s != "ab" + "c":
+    exit(1)
+f = "%s-%d" % (s, 12)
+if len(f) != 6 or f != "abc-12":
+    exit(1)
+n = 0
+for c in t + t:
+    n = n + 1
+if n != 14:
+    exit(1)
+
+l = (1, 2, 3)
+f = "%d:%d:%d" % l
+if f != "1:2:3":
+    exit(1)
+g = ""
+for i in range(20):
+    g = "%s%d," % (g, i % 10)
+if len(g) != 40 or g[36:40] != "8,9,":
+    exit(1)
+
+#
+# 's += x' may extend the string in place, which must not
+# change any other reference to it
+#
+
+s = ""
+for i in range(300):
+    s += "ab"
+if len(s) != 600 or s[598:600] != "ab":
+    exit(1)
+s = "a"
+s += "b"
+t = s
+s += "c"
+if t != "ab" or s != "abc":
+    exit(1)
+l = [s]
+s += "d"
+if l[0] != "abc":
+    exit(1)
+s += s
+if s != "abcdabcd":
+    exit(1)
+l = ["x"]
+l[0] += "y"
+t = l[0]
+l[0] += "z"
+if t != "xy" or l[0] != "xyz":
+    exit(1)
+
+
+def grow(n):
+    global g
+    g += "g"
+    h = "h"
+    for i in range(n):
+        h += "h"
+    return g + h
+
+
+g = "g"
+r = grow(2)
+if grow(3) != "ggghhhh" or r != "gghhh":
+    exit(1)